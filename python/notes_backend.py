@@ -0,0 +1,914 @@
+# Import os module for low-level file access and atomic renames
+import os
+# Import struct module for the fixed-size packfile record and index headers
+import struct
+# Import threading module for serializing writers and the background compaction
+import threading
+# Import ABC and abstractmethod for the backend interface
+from abc import ABC, abstractmethod
+# Import namedtuple for packfile directory entries
+from collections import namedtuple
+# Import contextmanager for the lock and batch helpers
+from contextlib import contextmanager
+# Import partial for binding keyword arguments of worker functions
+from functools import partial
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import utility functions from notes_utils module
+from notes_utils import (
+    NoteBatchWriter, format_note, load_note, load_note_body, load_note_body_bytes,
+    load_note_bytes, open_temp_file, write_note_atomic, _fsync_directory
+)
+# Import the flat/sharded directory layout
+from notes_layout import NoteLayout
+# Import the worker pool helper
+from notes_parallel import parallel_map
+
+# Define the marker file that records which backend a notes directory uses
+BACKEND_FILENAME = ".notes_backend"
+# Define the supported backends: one file per note, or one append-only packfile
+FILES, PACK = "files", "pack"
+BACKENDS = (FILES, PACK)
+# Define the packfile, its saved offset index and the lock file serializing its writers
+PACK_FILENAME = "notes.pack"
+PACK_INDEX_FILENAME = ".notes.pack.idx"
+PACK_LOCK_FILENAME = ".notes.pack.lock"
+# Define the bytes every packfile starts with
+PACK_MAGIC = b"NOTEPACK\x00\x01"
+# Define the record header: CRC-32 of the rest of the record, kind, sequence number,
+# note length and filename length; the filename and the note text follow
+RECORD = struct.Struct("<IBQIH")
+# Define the record kinds: a note's latest text, or a tombstone for a deleted note
+PUT, DELETE = 1, 2
+# Define the saved offset index: a header with the pack's inode, the end of the records it
+# covers, the last sequence number and the garbage bytes, then one entry per live note
+INDEX_MAGIC = b"NPACKIDX"
+INDEX_HEADER = struct.Struct("<8sQQQQ")
+INDEX_ENTRY = struct.Struct("<QIQH")
+# Define how many records may be scanned or appended before the offset index is saved again
+PACK_INDEX_INTERVAL = 256
+# Define when a pack is compacted: enough garbage, making up enough of the file
+COMPACT_MIN_BYTES = 1024 * 1024
+COMPACT_RATIO = 0.5
+# Define the read buffer size used when scanning records
+SCAN_BUFFER = 1024 * 1024
+
+# Define record for a note in a packfile, as listed by PackBackend.scan()
+PackEntry = namedtuple('PackEntry', ['name', 'stamp'])
+
+# Map notes directories to their open packfile, shared by every store in the process
+_packs = {}
+# Guard the packfile table itself
+_packs_guard = threading.Lock()
+
+
+# Define helper that reduces a stat result to the fields that reveal a changed file
+def file_stamp(st) -> tuple:
+    """Return ``(mtime_ns, size, inode)``; a new inode catches files replaced with the same times and size."""
+    # Pick the modification time, size and inode number
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+# Define function that reads which backend a notes directory uses
+def backend_name(notes_dir: Path) -> str:
+    # Read the marker, defaulting to note files
+    try:
+        name = (Path(notes_dir) / BACKEND_FILENAME).read_text(encoding='utf-8').strip()
+    except OSError:
+        return FILES
+    # Ignore unknown values rather than guessing
+    return name if name in BACKENDS else FILES
+
+
+# Define function that opens the backend a notes directory uses
+def open_backend(notes_dir: Path):
+    """Return the :class:`NoteBackend` recorded in ``notes_dir`` (note files unless marked otherwise)."""
+    # Share one packfile per directory so its offset index is loaded once per process
+    if backend_name(notes_dir) == PACK:
+        return _open_pack(notes_dir)
+    # Note files keep no state, so a new object is as good as a shared one
+    return FileBackend(notes_dir)
+
+
+# Define helper that returns the shared packfile of a notes directory
+def _open_pack(notes_dir: Path):
+    # Create the packfile object on first use
+    key = os.path.abspath(notes_dir)
+    with _packs_guard:
+        pack = _packs.get(key)
+        if pack is None:
+            pack = _packs[key] = PackBackend(notes_dir)
+        return pack
+
+
+# Define helper that writes a small file through a temporary file
+def _replace_bytes(path: Path, data: bytes, sync=True):
+    # Write next to the target so the rename is atomic; the temporary name is not a note file
+    fd, temp = open_temp_file(path)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp, path)
+    # Remove the temporary file when anything went wrong
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+# Define class describing where note text is stored
+class NoteBackend(ABC):
+    """Storage for the text of notes, keyed by note filename.
+
+    Backends hand out *stamps*: small tuples that change whenever a note
+    changes, which the metadata cache compares to skip unchanged notes.
+    Every backend keeps each note in the ``.note`` format, so
+    :meth:`read_raw` always returns bytes that can be saved as a note file
+    and read without this program.
+    """
+
+    # Name written to the backend marker
+    name = None
+
+    # Initialize the backend for a notes directory
+    def __init__(self, notes_dir: Path):
+        # Remember the notes directory and its layout
+        self.notes_dir = Path(notes_dir)
+        self.layout = NoteLayout(self.notes_dir)
+
+    # Define method listing every note
+    @abstractmethod
+    def scan(self):
+        """Return or yield entries with a ``name`` attribute, in no particular order."""
+
+    # Define method returning the stamp of a scanned entry
+    @abstractmethod
+    def entry_stamp(self, entry) -> tuple:
+        """Return the stamp of an entry from :meth:`scan`; raise ``OSError`` if it is gone."""
+
+    # Define method returning the stamp of a note
+    @abstractmethod
+    def stamp(self, filename: str):
+        """Return the stamp of ``filename``, or None when there is no such note."""
+
+    # Define method telling whether a note exists
+    def exists(self, filename: str) -> bool:
+        # A note exists when it has a stamp
+        return self.stamp(filename) is not None
+
+    # Define method that reads and parses one note
+    @abstractmethod
+    def load(self, filename: str, header_only=False):
+        """Return ``(meta, content, error)`` like :func:`notes_utils.load_note`."""
+
+    # Define method that reads and parses several notes
+    def load_many(self, filenames, header_only=False) -> list:
+        # Load the notes one by one, in order
+        return [self.load(filename, header_only) for filename in filenames]
+
+    # Define method that reads the body of a note without parsing its header
+    @abstractmethod
+    def load_body(self, filename: str):
+        """Return ``(content, error)`` like :func:`notes_utils.load_note_body`."""
+
+    # Define method that returns a note exactly as stored
+    @abstractmethod
+    def read_raw(self, filename: str) -> bytes:
+        """Return the bytes of ``filename`` in the ``.note`` format; raise ``FileNotFoundError`` if missing."""
+
+    # Define method that returns what substring search runs against
+    @abstractmethod
+    def match_sources(self, filenames) -> list:
+        """Return one picklable source per note: a file path, or ``(filename, bytes)``."""
+
+    # Define method that creates or replaces a note
+    @abstractmethod
+    def write(self, filename: str, metadata: dict, content: str):
+        """Store a note atomically: readers see the old or the new version, never a mix."""
+
+    # Define method that stores a new note
+    @abstractmethod
+    def create(self, filename: str, metadata: dict, content: str):
+        """Store a note that must not exist yet; raise ``FileExistsError`` if it does, even when
+        another process created it concurrently."""
+
+    # Define method that removes a note
+    @abstractmethod
+    def delete(self, filename: str):
+        """Remove a note; raise ``FileNotFoundError`` if there is none."""
+
+    # Define method that starts a batch of writes
+    @abstractmethod
+    def batch(self):
+        """Return a context manager whose ``add(filename, metadata, content)`` stages a note and
+        returns its stamp; the notes become visible together when the block ends cleanly."""
+
+    # Define method that returns a change detector for the daemon
+    @abstractmethod
+    def watcher(self):
+        """Return a watcher whose ``changes()`` returns the filenames changed since the last call
+        (None when a full rescan is needed) and whose ``close()`` releases it."""
+
+    # Define method that reclaims space held by old versions of notes
+    def compact(self):
+        """Return ``(bytes before, bytes after)``, or None when the backend has nothing to compact."""
+        return None
+
+
+# Define class for the one-file-per-note backend
+class FileBackend(NoteBackend):
+    """One ``.note`` file per note, in the flat or sharded layout.
+
+    Stamps are ``(mtime_ns, size, inode)``, so notes changed by an editor or
+    another program are noticed like notes changed through this program.
+    """
+
+    # Name written to the backend marker
+    name = FILES
+
+    # Define method listing every note file
+    def scan(self):
+        # Yield the directory entries of the layout
+        return self.layout.scan()
+
+    # Define method returning the stamp of a scanned entry
+    def entry_stamp(self, entry) -> tuple:
+        # Stat the directory entry
+        return file_stamp(entry.stat())
+
+    # Define method returning the stamp of a note
+    def stamp(self, filename: str):
+        # Stat the note wherever the layout keeps it
+        try:
+            return file_stamp(self.layout.path(filename).stat())
+        except OSError:
+            return None
+
+    # Define method that reads and parses one note
+    def load(self, filename: str, header_only=False):
+        # Read the note file
+        return load_note(self.layout.path(filename), header_only)
+
+    # Define method that reads and parses several notes
+    def load_many(self, filenames, header_only=False) -> list:
+        # Read the note files, possibly on a worker pool
+        return parallel_map(partial(load_note, header_only=header_only),
+                            [self.layout.path(filename) for filename in filenames])
+
+    # Define method that reads the body of a note without parsing its header
+    def load_body(self, filename: str):
+        # Skip the header of the note file
+        return load_note_body(self.layout.path(filename))
+
+    # Define method that returns a note exactly as stored
+    def read_raw(self, filename: str) -> bytes:
+        # Read the note file
+        return self.layout.path(filename).read_bytes()
+
+    # Define method that returns what substring search runs against
+    def match_sources(self, filenames) -> list:
+        # Search reads the note files themselves
+        return [self.layout.path(filename) for filename in filenames]
+
+    # Define method that creates or replaces a note
+    def write(self, filename: str, metadata: dict, content: str):
+        # Replace the note where it lives, or create it in the current layout
+        filepath = self.layout.path(filename)
+        if not filepath.exists():
+            filepath = self.layout.new_path(filename)
+        write_note_atomic(filepath, metadata, content)
+
+    # Define method that stores a new note
+    def create(self, filename: str, metadata: dict, content: str):
+        # Refuse names used anywhere in the layout, then link the note into place without replacing anything
+        if self.exists(filename):
+            raise FileExistsError(filename)
+        write_note_atomic(self.layout.new_path(filename), metadata, content, exclusive=True)
+
+    # Define method that removes a note
+    def delete(self, filename: str):
+        # Remove the note file
+        self.layout.path(filename).unlink()
+
+    # Define method that starts a batch of writes
+    def batch(self):
+        # Write through temporary files renamed into place at the end
+        return _FileBatch(self)
+
+    # Define method that returns a change detector for the daemon
+    def watcher(self):
+        # Use inotify where possible, else snapshot diffs
+        from notes_watch import make_watcher
+        return make_watcher(self.layout)
+
+
+# Define class that stages notes for the file backend
+class _FileBatch:
+    # Initialize the batch with a writer for the notes directory
+    def __init__(self, backend: FileBackend):
+        # Remember the layout and start a batch of temporary files
+        self.layout = backend.layout
+        self.writer = NoteBatchWriter(backend.notes_dir)
+
+    # Start the batch when entering a with-block
+    def __enter__(self):
+        return self
+
+    # Commit or discard the temporary files when leaving the with-block
+    def __exit__(self, exc_type, exc, tb):
+        self.writer.__exit__(exc_type, exc, tb)
+
+    # Define method that stages one note
+    def add(self, filename: str, metadata: dict, content: str) -> tuple:
+        # Write the note to a temporary file next to its final place
+        temp = self.writer.add(filename, metadata, content, self.layout.new_path(filename))
+        # The rename keeps mtime, size and inode, so the temporary file's stamp is final
+        return file_stamp(os.stat(temp))
+
+    # Define method that stages one note given as raw bytes
+    def add_raw(self, filename: str, data: bytes) -> tuple:
+        # Write the bytes unchanged to a temporary file next to the final place
+        temp = self.writer.add_bytes(filename, data, self.layout.new_path(filename))
+        return file_stamp(os.stat(temp))
+
+
+# Define helper that returns the size of a packfile record
+def _record_size(name: str, length: int) -> int:
+    # Header, filename and note text
+    return RECORD.size + len(name.encode('utf-8')) + length
+
+
+# Define helper that reads part of a file without moving a shared file position
+def _pread(fd: int, length: int, offset: int) -> bytes:
+    # Use pread where the platform has it, else seek and read (callers hold the pack lock)
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+# Define worker that parses one packfile record
+def _load_record(task):
+    # Unpack the task and parse the note text
+    name, data, header_only = task
+    if data is None:
+        return None, None, f"Error reading note {name}: not in {PACK_FILENAME}"
+    return load_note_bytes(name, data, header_only)
+
+
+# Define class for the append-only packfile backend
+class PackBackend(NoteBackend):
+    """Every note as a record in one append-only packfile, ``notes.pack``.
+
+    A record holds a note's filename and its complete ``.note`` text, with a
+    CRC so a write cut short by a crash is detected and dropped. Changing a
+    note appends a new record and deleting one appends a tombstone. An
+    in-memory offset index maps each filename to its latest record, so a
+    read is a single ``pread`` and a scan needs no directory listing. The
+    index is saved to ``.notes.pack.idx`` every few hundred records, so
+    opening the pack only reads the records appended since.
+
+    Superseded records and tombstones are garbage. Once they make up more
+    than half of the pack, a background thread rewrites it with only the
+    live records and swaps it in atomically. Records keep their sequence
+    numbers, which are the stamps, so compaction does not invalidate the
+    metadata cache. Writers in other processes take turns through a lock
+    file; readers notice their appends, and compactions, with one ``stat``.
+    """
+
+    # Name written to the backend marker
+    name = PACK
+
+    # Initialize the backend for a notes directory
+    def __init__(self, notes_dir: Path):
+        # Remember the notes directory and the files of the pack
+        super().__init__(notes_dir)
+        self.pack_path = self.notes_dir / PACK_FILENAME
+        self.index_path = self.notes_dir / PACK_INDEX_FILENAME
+        self.lock_path = self.notes_dir / PACK_LOCK_FILENAME
+        # Guard the offset index and the open pack; readers hold it only briefly
+        self._lock = threading.Lock()
+        # Serialize writers and compaction within this process
+        self._write_lock = threading.Lock()
+        # Initialize the background compaction thread
+        self._compactor = None
+        # Start with nothing open
+        self._fd = None
+        self._reset()
+
+    # Define helper that forgets the open pack
+    def _reset(self):
+        # Close the pack and clear the offset index
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._ino = None
+        # Map filename to (note offset, note length, sequence number)
+        self._entries = {}
+        # Track the end of the valid records, the last sequence number and the garbage bytes
+        self._end = 0
+        self._last_seq = 0
+        self._garbage = 0
+        # Count records scanned or appended since the offset index was saved
+        self._unsaved = 0
+
+    # Define helper that brings the offset index up to date with the pack on disk
+    def _refresh(self):
+        # Call with self._lock held; one stat tells whether anything changed
+        try:
+            st = os.stat(self.pack_path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        # Reopen a pack that was created or replaced by a compaction
+        if self._fd is None or st.st_ino != self._ino:
+            self._reset()
+            self._fd = os.open(self.pack_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            st = os.fstat(self._fd)
+            self._ino = st.st_ino
+            self._load_index(st.st_size)
+        # Read records appended since the last look
+        if st.st_size > self._end:
+            self._scan(st.st_size)
+
+    # Define helper that loads the saved offset index
+    def _load_index(self, size: int):
+        # Start from scratch when there is no usable index
+        try:
+            data = self.index_path.read_bytes()
+            magic, ino, end, last_seq, garbage = INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return
+        # Only trust an index written for this very pack
+        if magic != INDEX_MAGIC or ino != self._ino or end > size:
+            return
+        # Read the entries
+        entries = {}
+        try:
+            pos = INDEX_HEADER.size
+            while pos < len(data):
+                offset, length, seq, name_length = INDEX_ENTRY.unpack_from(data, pos)
+                pos += INDEX_ENTRY.size
+                entries[data[pos:pos + name_length].decode('utf-8')] = (offset, length, seq)
+                pos += name_length
+        except (struct.error, UnicodeDecodeError):
+            return
+        # Adopt the index
+        self._entries, self._end, self._last_seq, self._garbage = entries, end, last_seq, garbage
+
+    # Define helper that writes the offset index of a pack
+    def _write_index(self, ino, end, last_seq, garbage, entries):
+        # Pack the header and one entry per live note
+        parts = [INDEX_HEADER.pack(INDEX_MAGIC, ino, end, last_seq, garbage)]
+        for name, (offset, length, seq) in entries.items():
+            raw = name.encode('utf-8')
+            parts.append(INDEX_ENTRY.pack(offset, length, seq, len(raw)))
+            parts.append(raw)
+        # The index is only a shortcut; losing it in a crash just means a full scan
+        _replace_bytes(self.index_path, b"".join(parts), sync=False)
+
+    # Define helper that saves the offset index, ignoring read-only directories
+    def _save_index(self):
+        # Call with self._lock held
+        try:
+            self._write_index(self._ino, self._end, self._last_seq, self._garbage, self._entries)
+        except OSError:
+            return
+        self._unsaved = 0
+
+    # Define helper that reads the records between the known end and the end of the file
+    def _scan(self, size: int):
+        """Apply the records after ``self._end``; stop at a torn or corrupted record."""
+        # Import zlib here; only packfiles need CRCs
+        import zlib
+        pos = self._end
+        with open(os.dup(self._fd), 'rb', buffering=SCAN_BUFFER) as f:
+            f.seek(pos)
+            # Check the magic bytes of a pack read from the start
+            if pos == 0:
+                magic = f.read(len(PACK_MAGIC))
+                if magic != PACK_MAGIC:
+                    # A pack being created may not have its magic bytes yet
+                    if PACK_MAGIC.startswith(magic):
+                        return
+                    raise ValueError(f"{self.pack_path} is not a notes packfile")
+                pos = len(PACK_MAGIC)
+            # Apply whole records until the end of the file
+            while pos + RECORD.size <= size:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    break
+                crc, kind, seq, length, name_length = RECORD.unpack(header)
+                body = f.read(name_length + length)
+                # Stop at a record cut short or damaged, e.g. by a crash while appending
+                if len(body) < name_length + length or zlib.crc32(body, zlib.crc32(header[4:])) != crc:
+                    break
+                try:
+                    name = body[:name_length].decode('utf-8')
+                except UnicodeDecodeError:
+                    break
+                self._apply(name, kind, seq, pos + RECORD.size + name_length, length)
+                pos += RECORD.size + name_length + length
+        # Remember how far the valid records go
+        self._end = pos
+        # Save the offset index now and then so the next process scans less
+        if self._unsaved >= PACK_INDEX_INTERVAL:
+            self._save_index()
+
+    # Define helper that applies one record to the offset index
+    def _apply(self, name, kind, seq, offset, length):
+        # The previous version of the note becomes garbage
+        old = self._entries.pop(name, None)
+        if old is not None:
+            self._garbage += _record_size(name, old[1])
+        # Point the note at its new text, or count the tombstone itself as garbage
+        if kind == PUT:
+            self._entries[name] = (offset, length, seq)
+        else:
+            self._garbage += _record_size(name, length)
+        # Track the sequence numbers and the records not in the saved index
+        self._last_seq = max(self._last_seq, seq)
+        self._unsaved += 1
+
+    # Define helper that holds the lock shared with writers in other processes
+    @contextmanager
+    def _pack_lock(self):
+        # Lock a separate file; the pack itself is replaced by compaction
+        try:
+            import fcntl
+        # Platforms without flock only serialize writers within the process
+        except ImportError:
+            yield
+            return
+        self.notes_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # Closing the file releases the lock
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    # Define helper that runs a block of writes and appends them in one go
+    @contextmanager
+    def _writing(self):
+        # Hold the write locks so sequence numbers and the end of the pack stay ours
+        with self._write_lock, self._pack_lock():
+            with self._lock:
+                self._refresh()
+            batch = _PackBatch(self)
+            yield batch
+            self._append(batch.records)
+        # Compact in the background once enough garbage piled up
+        self._maybe_compact()
+
+    # Define helper that appends records to the pack
+    def _append(self, records):
+        # Call with the write locks held; nothing to do for an empty batch
+        if not records:
+            return
+        self.notes_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.pack_path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            # Cut off a torn record left by a crashed writer; nobody else appends while we hold the lock
+            if os.fstat(fd).st_size != self._end:
+                os.ftruncate(fd, self._end)
+            # Build the records, starting a new pack with its magic bytes
+            data = bytearray(PACK_MAGIC if self._end == 0 else b"")
+            applied = []
+            for kind, filename, seq, head, payload in records:
+                offset = self._end + len(data) + len(head)
+                data += head
+                data += payload
+                applied.append((filename, kind, seq, offset, len(payload)))
+            # Write everything with one call and flush it to disk
+            os.lseek(fd, self._end, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        # Apply the records to the offset index without reading them back
+        with self._lock:
+            if self._fd is None:
+                self._refresh()
+            else:
+                for name, kind, seq, offset, length in applied:
+                    self._apply(name, kind, seq, offset, length)
+                self._end += len(data)
+            if self._unsaved >= PACK_INDEX_INTERVAL:
+                self._save_index()
+
+    # Define helper that reads the text of a note
+    def _read(self, filename: str):
+        # Look the note up and read it in one call, before a compaction can swap the pack
+        with self._lock:
+            self._refresh()
+            slot = self._entries.get(filename)
+            if slot is None:
+                return None
+            return _pread(self._fd, slot[1], slot[0])
+
+    # Define method listing every note
+    def scan(self):
+        # List the offset index, whose sequence numbers are the stamps
+        with self._lock:
+            self._refresh()
+            return [PackEntry(name, (seq, length, 0)) for name, (_, length, seq) in self._entries.items()]
+
+    # Define method returning the stamp of a scanned entry
+    def entry_stamp(self, entry) -> tuple:
+        # The stamp was taken while listing
+        return entry.stamp
+
+    # Define method returning the stamp of a note
+    def stamp(self, filename: str):
+        # Look the note up in the offset index
+        with self._lock:
+            self._refresh()
+            slot = self._entries.get(filename)
+        return None if slot is None else (slot[2], slot[1], 0)
+
+    # Define method that reads and parses one note
+    def load(self, filename: str, header_only=False):
+        # Read the record and parse it like a note file
+        return _load_record((filename, self._read(filename), header_only))
+
+    # Define method that reads and parses several notes
+    def load_many(self, filenames, header_only=False) -> list:
+        # Read the records one after another, then parse them, possibly on a worker pool
+        return parallel_map(_load_record, [(name, data, header_only)
+                                           for name, data in self.match_sources(filenames)])
+
+    # Define method that reads the body of a note without parsing its header
+    def load_body(self, filename: str):
+        # Read the record and skip its header
+        data = self._read(filename)
+        if data is None:
+            return None, f"Error reading note {filename}: not in {PACK_FILENAME}"
+        return load_note_body_bytes(filename, data)
+
+    # Define method that returns a note exactly as stored
+    def read_raw(self, filename: str) -> bytes:
+        # Read the record
+        data = self._read(filename)
+        if data is None:
+            raise FileNotFoundError(f"No note {filename} in {self.pack_path}")
+        return data
+
+    # Define method that returns what substring search runs against
+    def match_sources(self, filenames) -> list:
+        # Read the records in pack order under one lock, then return them in the requested order
+        with self._lock:
+            self._refresh()
+            slots = {name: self._entries.get(name) for name in filenames}
+            data = {name: _pread(self._fd, slot[1], slot[0])
+                    for name, slot in sorted(slots.items(), key=lambda item: item[1] or (0,))
+                    if slot is not None}
+        return [(name, data.get(name)) for name in filenames]
+
+    # Define method that creates or replaces a note
+    def write(self, filename: str, metadata: dict, content: str):
+        # Append the new text in one record
+        with self._writing() as batch:
+            batch.add(filename, metadata, content)
+
+    # Define method that stores a new note
+    def create(self, filename: str, metadata: dict, content: str):
+        # Check and append under the pack lock, so no other process can add the name in between
+        with self._writing() as batch:
+            if filename in self._entries:
+                raise FileExistsError(filename)
+            batch.add(filename, metadata, content)
+
+    # Define method that removes a note
+    def delete(self, filename: str):
+        # Append a tombstone
+        with self._writing() as batch:
+            batch.remove(filename)
+
+    # Define method that starts a batch of writes
+    def batch(self):
+        # Collect records and append them with one write and one flush
+        return self._writing()
+
+    # Define method that returns a change detector for the daemon
+    def watcher(self):
+        # Watch the pack file itself
+        return PackWatcher(self)
+
+    # Define helper that starts a background compaction when it pays off
+    def _maybe_compact(self):
+        # Compact when garbage is both large and most of the pack, unless a compaction is running
+        if self._garbage < COMPACT_MIN_BYTES or self._garbage <= COMPACT_RATIO * self._end:
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        # The thread is not a daemon, so a short-lived process finishes the compaction before exiting
+        self._compactor = threading.Thread(target=self._compact_in_background, name="notes-pack-compactor")
+        self._compactor.start()
+
+    # Define helper run by the background compaction thread
+    def _compact_in_background(self):
+        # A failed compaction leaves the pack as it was; the next write tries again
+        try:
+            self.compact()
+        except OSError:
+            pass
+
+    # Define method that waits for a background compaction
+    def wait_for_compaction(self):
+        # Join the compaction thread if one is running
+        if self._compactor is not None:
+            self._compactor.join()
+
+    # Define method that rewrites the pack without garbage
+    def compact(self):
+        """Rewrite the pack with only the latest record of each note; return ``(bytes before, bytes after)``.
+
+        Readers carry on during the copy; writers wait for it.
+        """
+        # Keep writers in every process out while the live records are copied
+        with self._write_lock, self._pack_lock():
+            with self._lock:
+                self._refresh()
+                if self._fd is None:
+                    return 0, 0
+                before, ino, last_seq = self._end, self._ino, self._last_seq
+                live = sorted(self._entries.items(), key=lambda item: item[1][0])
+            # Copy each live record, unchanged, into a new pack next to the old one, with its permissions
+            fd, temp = open_temp_file(self.pack_path)
+            try:
+                entries = {}
+                with open(self.pack_path, 'rb', buffering=SCAN_BUFFER) as old, open(fd, 'wb') as new:
+                    # Another process cannot have swapped the pack while we hold the lock
+                    if os.fstat(old.fileno()).st_ino != ino:
+                        raise OSError(f"{self.pack_path} changed during compaction")
+                    new.write(PACK_MAGIC)
+                    for name, (offset, length, seq) in live:
+                        start = offset - RECORD.size - len(name.encode('utf-8'))
+                        old.seek(start)
+                        entries[name] = (new.tell() + offset - start, length, seq)
+                        new.write(old.read(offset + length - start))
+                    new.flush()
+                    os.fsync(new.fileno())
+                    after = new.tell()
+                # Save the new pack's index first, so processes that reopen it can use the index
+                new_ino = os.stat(temp).st_ino
+                self._write_index(new_ino, after, last_seq, 0, entries)
+                # Swap the new pack in and make the rename durable
+                os.replace(temp, self.pack_path)
+                _fsync_directory(self.notes_dir)
+            # Remove the partial copy on failure
+            except BaseException:
+                try:
+                    os.unlink(temp)
+                except OSError:
+                    pass
+                raise
+            # Point this process at the new pack
+            with self._lock:
+                self._reset()
+                self._refresh()
+        # Return the sizes before and after
+        return before, after
+
+
+# Define class that collects records for one append
+class _PackBatch:
+    # Initialize an empty batch; call with the pack's write locks held
+    def __init__(self, backend: PackBackend):
+        # Remember the pack and continue its sequence numbers
+        self.backend = backend
+        self.records = []
+        self._seq = backend._last_seq
+        # Track the notes this batch adds or removes
+        self._staged = {}
+
+    # Define helper that builds one record
+    def _record(self, kind: int, filename: str, payload: bytes) -> tuple:
+        # Import zlib here; only packfiles need CRCs
+        import zlib
+        self._seq += 1
+        name = filename.encode('utf-8')
+        header = RECORD.pack(0, kind, self._seq, len(payload), len(name))
+        crc = zlib.crc32(payload, zlib.crc32(name, zlib.crc32(header[4:])))
+        head = RECORD.pack(crc, kind, self._seq, len(payload), len(name)) + name
+        self.records.append((kind, filename, self._seq, head, payload))
+        return self._seq
+
+    # Define method that stages one note given as raw bytes
+    def add_raw(self, filename: str, data: bytes) -> tuple:
+        # Append the note text unchanged and return its stamp
+        seq = self._record(PUT, filename, data)
+        self._staged[filename] = True
+        return seq, len(data), 0
+
+    # Define method that stages one note
+    def add(self, filename: str, metadata: dict, content: str) -> tuple:
+        # Store exactly what the note file would contain
+        return self.add_raw(filename, format_note(metadata, content).encode('utf-8'))
+
+    # Define method that stages a deletion
+    def remove(self, filename: str):
+        # Refuse to delete notes that do not exist
+        with self.backend._lock:
+            present = self._staged.get(filename, filename in self.backend._entries)
+        if not present:
+            raise FileNotFoundError(f"No note {filename} in {self.backend.pack_path}")
+        self._record(DELETE, filename, b"")
+        self._staged[filename] = False
+
+
+# Define class that notices changes to a packfile
+class PackWatcher:
+    """Change detector for the daemon: the pack grows or is replaced whenever a note changes.
+
+    The offset index already lists every note with its stamp, so a full
+    refresh only re-parses the notes that changed; this watcher just says
+    when one is due.
+    """
+
+    # Events are not delivered; the daemon polls every interval
+    realtime = False
+
+    # Initialize the watcher with the current state of the pack
+    def __init__(self, backend: PackBackend):
+        # Remember the pack and its current stamp
+        self.backend = backend
+        self._stamp = self._pack_stamp()
+
+    # Define helper that stamps the pack file
+    def _pack_stamp(self):
+        # A missing pack has no stamp
+        try:
+            return file_stamp(os.stat(self.backend.pack_path))
+        except OSError:
+            return None
+
+    # Define method that reports whether the pack changed
+    def changes(self):
+        """Return ``[]`` when nothing changed, else None to ask for a full refresh."""
+        # Compare with the stamp seen last time
+        current = self._pack_stamp()
+        if current == self._stamp:
+            return []
+        self._stamp = current
+        return None
+
+    # Define method that releases the watcher
+    def close(self):
+        pass
+
+
+# Define function that records a new backend in the marker file
+def set_backend(notes_dir: Path, name: str):
+    # Reject unknown backends
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    # Write the marker through a temporary file so it is never half-written
+    notes_dir = Path(notes_dir)
+    notes_dir.mkdir(parents=True, exist_ok=True)
+    _replace_bytes(notes_dir / BACKEND_FILENAME, (name + "\n").encode('utf-8'))
+
+
+# Define function that moves every note into another backend
+def migrate_backend(notes_dir: Path, target: str) -> int:
+    """Move every note of ``notes_dir`` into the ``target`` backend and return how many were moved.
+
+    Notes are copied byte for byte into the target, the marker is switched,
+    and only then are the old copies removed, so a crash leaves at worst a
+    second copy behind. Unlike layout migration this is not meant to run
+    while other programs write notes.
+    """
+    # Reject unknown backends and do nothing when already there
+    if target not in BACKENDS:
+        raise ValueError(f"Unknown backend '{target}', expected one of: {', '.join(BACKENDS)}")
+    source = open_backend(notes_dir)
+    if source.name == target:
+        return 0
+    # Copy every note into the target in one batch
+    names = sorted(entry.name for entry in source.scan())
+    destination = _open_pack(notes_dir) if target == PACK else FileBackend(notes_dir)
+    with destination.batch() as batch:
+        for name in names:
+            batch.add_raw(name, source.read_raw(name))
+    # Switch to the target before removing anything
+    set_backend(notes_dir, target)
+    # Remove the note files, or the pack and its index
+    if source.name == FILES:
+        for name in names:
+            source.layout.path(name).unlink()
+    else:
+        with source._lock:
+            source._reset()
+        for path in (source.pack_path, source.index_path, source.lock_path):
+            path.unlink(missing_ok=True)
+    # Return the number of notes moved
+    return len(names)
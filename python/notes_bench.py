@@ -0,0 +1,485 @@
+# Import argparse module for command-line argument parsing
+import argparse
+# Import contextlib for silencing command output while timing
+import contextlib
+# Import datetime module for reproducible timestamps
+import datetime
+# Import io module for an in-memory sink for command output
+import io
+# Import json module for writing and comparing results
+import json
+# Import os module for file system access
+import os
+# Import platform module for recording the Python version
+import platform
+# Import random module for the seeded corpus generator
+import random
+# Import re module for splitting sample notes into words
+import re
+# Import shutil module for removing generated corpora
+import shutil
+# Import subprocess module for recording the current git commit
+import subprocess
+# Import sys module for exiting with a status code
+import sys
+# Import tempfile module for the default corpus location
+import tempfile
+# Import time module for high-resolution timers
+import time
+# Import mock for running create/edit without launching an editor
+from unittest import mock
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import note helpers and commands under test
+import notes_commands
+import notes_watch
+from notes_layout import NoteLayout
+from notes_utils import NOTE_EXT, read_note_file, sanitize_filename, write_note_file
+
+# Try to import resource for peak RSS (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Define the directory holding the sample notes the corpus is modeled on
+SAMPLE_NOTES_DIR = Path(__file__).parent.parent / "test-notes"
+# Define the corpus sizes benchmarked by default
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+# Define the number of timed runs per operation by default
+DEFAULT_REPEAT = 5
+# Define the query used for searches that must not match anything
+MISS_QUERY = "zqxjv-no-such-text"
+# Define the number of distinct tags in the generated corpus
+TAG_VOCABULARY_SIZE = 200
+# Define how likely a note is to have 0, 1, 2, ... tags
+TAG_COUNT_WEIGHTS = (10, 25, 30, 20, 10, 5)
+# Define the chance that a note repeats one of its tags (as First_e2.note does)
+DUPLICATE_TAG_RATE = 0.02
+# Define the spread of body sizes around the median of the sample notes
+BODY_SIZE_SIGMA = 0.8
+# Define the CLI command lines timed by the startup benchmark
+STARTUP_COMMANDS = (("--help",), ("read", "--body", "no-such-note.note"))
+# Define the import time budget, in milliseconds, for each startup command; --startup exits 1 above it
+STARTUP_BUDGET_MS = 90
+# Define heavy modules the startup commands must not import
+STARTUP_FORBIDDEN_MODULES = ("yaml", "sqlite3", "subprocess", "concurrent.futures", "tarfile", "socket")
+
+
+# Define class that writes a reproducible synthetic notes repository
+class CorpusGenerator:
+    """Generate notes in the ``write_note_file`` format from a fixed seed.
+
+    Body sizes follow a log-normal distribution around the median body of
+    the sample notes in ``test-notes/``, whose paragraphs and words are
+    reused as text. Tags follow a Zipf-like distribution, so a few tags are
+    very common and most are rare.
+    """
+
+    # Initialize the generator from the sample notes and a seed
+    def __init__(self, seed=0, samples_dir=SAMPLE_NOTES_DIR):
+        # Keep the seed so every corpus with the same seed is identical
+        self.seed = seed
+        # Load paragraphs and body sizes from the sample notes
+        self.paragraphs, sizes = _load_samples(samples_dir)
+        # Build the vocabulary used for titles and tags
+        self.words = sorted({w for p in self.paragraphs for w in re.findall(r"[a-z]{4,}", p.lower())})
+        # Use the median sample body size as the center of the size distribution
+        self.median_size = sorted(sizes)[len(sizes) // 2]
+        # Build a stable tag vocabulary from the word list
+        rng = random.Random(seed)
+        self.tags = rng.sample(self.words, min(TAG_VOCABULARY_SIZE, len(self.words)))
+        # Give tag number k a weight of 1/k so tag frequencies are Zipf-like
+        self.tag_weights = [1 / (k + 1) for k in range(len(self.tags))]
+
+    # Define method that builds the metadata and content of note number i
+    def make_note(self, i):
+        # Seed a generator per note so any single note can be regenerated
+        rng = random.Random(self.seed * 1_000_003 + i)
+        # Pick a short title from the vocabulary
+        title = ' '.join(rng.choice(self.words) for _ in range(rng.randint(1, 4))).title()
+        # Pick the number of tags and the tags themselves
+        count = rng.choices(range(len(TAG_COUNT_WEIGHTS)), weights=TAG_COUNT_WEIGHTS)[0]
+        tags = list(dict.fromkeys(rng.choices(self.tags, weights=self.tag_weights, k=count)))
+        # Occasionally repeat a tag, as notes edited by hand sometimes do
+        if tags and rng.random() < DUPLICATE_TAG_RATE:
+            tags.append(tags[0])
+        # Pick a creation time within the last few years and a later modification time
+        created = datetime.datetime(2022, 1, 1) + datetime.timedelta(seconds=rng.randrange(3 * 365 * 86400))
+        modified = created + datetime.timedelta(seconds=rng.randrange(30 * 86400))
+        # Pick a body size and fill it with sample paragraphs
+        target = int(rng.lognormvariate(0, BODY_SIZE_SIGMA) * self.median_size)
+        parts, size = [], 0
+        while size < target:
+            paragraph = rng.choice(self.paragraphs)
+            parts.append(paragraph)
+            size += len(paragraph) + 2
+        content = '\n\n'.join(parts) + '\n'
+        # Build the filename in the same shape generate_note_filename produces
+        filename = f"{sanitize_filename(title)}_{i:015x}{NOTE_EXT}"
+        # Format timestamps the way iso_now() does
+        metadata = {
+            'title': title,
+            'created': created.isoformat() + "Z",
+            'modified': modified.isoformat() + "Z",
+            'tags': tags,
+        }
+        # Give half of the notes the extra fields create_note writes
+        if i % 2 == 0:
+            metadata = {
+                'note_id': filename[:-len(NOTE_EXT)],
+                'filename': filename,
+                'path': filename,
+                **metadata,
+                'content': '',
+                'editor': 'nano',
+            }
+        # Give the rest the optional fields used by the sample notes
+        else:
+            metadata.update(author=f"Student{i % 50:03d}", status='draft', priority=i % 5 + 1)
+        # Return the pieces of the note
+        return filename, metadata, content
+
+    # Define method that writes notes 0..count-1 into a directory
+    def write(self, notes_dir: Path, count: int):
+        """Write ``count`` notes into ``notes_dir`` and return their filenames."""
+        # Make sure the target directory exists
+        notes_dir.mkdir(parents=True, exist_ok=True)
+        # Initialize list of written filenames
+        filenames = []
+        # Write each note with the regular note writer
+        for i in range(count):
+            filename, metadata, content = self.make_note(i)
+            write_note_file(notes_dir / filename, metadata, content)
+            filenames.append(filename)
+        # Return the filenames in generation order
+        return filenames
+
+
+# Define helper that loads paragraphs and body sizes from the sample notes
+def _load_samples(samples_dir: Path):
+    # Initialize paragraphs and body sizes
+    paragraphs, sizes = [], []
+    # Read every sample note
+    for path in sorted(Path(samples_dir).glob("*.md")):
+        meta, content = read_note_file(path)
+        # Skip samples that cannot be parsed
+        if meta is None:
+            continue
+        # Remember the body size and its non-empty paragraphs
+        sizes.append(len(content))
+        paragraphs.extend(p.strip() for p in content.split('\n\n') if p.strip())
+    # Fall back to a tiny built-in sample when the sample notes are missing
+    if not paragraphs:
+        paragraphs = ["Notes about data structures, algorithms and project planning."]
+        sizes = [1500]
+    # Return the loaded samples
+    return paragraphs, sizes
+
+
+# Define helper that returns the peak resident set size of this process in bytes
+def peak_rss():
+    # Report nothing where the resource module is unavailable
+    if resource is None:
+        return None
+    # Read the peak RSS (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Define helper that computes a percentile of sorted samples
+def percentile(sorted_samples, fraction):
+    # Pick the nearest-rank sample
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+# Define helper that times repeated calls of one operation
+def time_operation(func, repeat, items=1):
+    """Run ``func`` once cold and ``repeat`` times warm; return timing statistics.
+
+    ``items`` is the number of notes one call processes, used for throughput.
+    """
+    # Time one cold run separately, since it may have to build caches
+    start = time.perf_counter()
+    func()
+    cold = time.perf_counter() - start
+    # Time the warm runs
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    # Summarize the warm runs
+    samples.sort()
+    p50 = percentile(samples, 0.50)
+    return {
+        'cold_s': cold,
+        'p50_s': p50,
+        'p99_s': percentile(samples, 0.99),
+        'mean_s': sum(samples) / len(samples),
+        'notes_per_s': items / p50 if p50 else None,
+        'runs': repeat,
+    }
+
+
+# Define function that benchmarks every command against one corpus
+def benchmark_corpus(notes_dir: Path, filenames, generator, repeat=DEFAULT_REPEAT):
+    """Time every ``notes_commands`` operation against the corpus in ``notes_dir``."""
+    # Point the commands at the corpus and silence the editor
+    with mock.patch.object(notes_commands, 'NOTES_DIR', notes_dir), \
+            mock.patch('subprocess.run'), \
+            contextlib.redirect_stdout(io.StringIO()) as sink:
+        # Pick a tag and a title word that are known to occur
+        rng = random.Random(generator.seed)
+        tag = generator.tags[0]
+        _, sample_meta, _ = generator.make_note(0)
+        hit_query = sample_meta['title'].split()[0].lower()
+        count = len(filenames)
+
+        # Define the create round-trip: prompts answered, editor skipped
+        def create():
+            answers = iter([f"Bench note {rng.random()}", "bench, tags"])
+            with mock.patch('builtins.input', lambda _prompt: next(answers)):
+                notes_commands.create_note()
+
+        # Define the edit round-trip on a random existing note
+        def edit():
+            notes_commands.edit_note(rng.choice(filenames))
+
+        # Define the check every command runs without the daemon: open the index and compare stamps
+        def change_check():
+            with notes_commands._open_index() as index:
+                index.refresh()
+
+        # Poll the corpus, and watch it the way the daemon does, to time checks that find no change
+        poller = notes_watch.PollingWatcher(NoteLayout(notes_dir))
+        watcher = notes_watch.make_watcher(NoteLayout(notes_dir))
+
+        # Define the operations to time and how many notes each touches
+        operations = {
+            'change_check': (change_check, count),
+            'change_check_poll': (poller.changes, count),
+            'change_check_daemon': (watcher.changes, count),
+            'list': (lambda: notes_commands.list_notes(), count),
+            'list_tag': (lambda: notes_commands.list_notes(filter_tag=tag), count),
+            'search_hit': (lambda: notes_commands.search_notes(hit_query), count),
+            'search_miss': (lambda: notes_commands.search_notes(MISS_QUERY), count),
+            'search_ranked': (lambda: notes_commands.search_notes(hit_query, ranked=True), count),
+            'stats': (lambda: notes_commands.stats(), count),
+            'read': (lambda: notes_commands.read_note(rng.choice(filenames)), 1),
+            'create': (create, 1),
+            'edit': (edit, 1),
+        }
+        # Time each operation, discarding the captured output as it goes
+        results = {}
+        for name, (func, items) in operations.items():
+            results[name] = time_operation(func, repeat, items)
+            sink.seek(0)
+            sink.truncate()
+        # Stop watching the corpus
+        poller.close()
+        watcher.close()
+    # Return the timings
+    return results
+
+
+# Define function that generates corpora and benchmarks them
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, seed=0, workdir=None, keep=False):
+    """Benchmark every corpus size and return a JSON-serializable report."""
+    # Use a temporary directory unless a work directory was given
+    base = Path(workdir) if workdir else Path(tempfile.mkdtemp(prefix="notes-bench-"))
+    # Build the generator once for all sizes
+    generator = CorpusGenerator(seed)
+    # Describe the environment the numbers were measured in
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'sizes': {},
+    }
+    # Benchmark each size in its own directory
+    for size in sizes:
+        notes_dir = base / f"corpus-{size}"
+        # Reuse a kept corpus of the right size, otherwise generate it
+        if notes_dir.is_dir() and sum(1 for _ in notes_dir.glob(f"*{NOTE_EXT}")) == size:
+            filenames = sorted(p.name for p in notes_dir.glob(f"*{NOTE_EXT}"))
+            generate_s = 0.0
+        else:
+            shutil.rmtree(notes_dir, ignore_errors=True)
+            start = time.perf_counter()
+            filenames = generator.write(notes_dir, size)
+            generate_s = time.perf_counter() - start
+        # Time the operations and record peak memory so far
+        operations = benchmark_corpus(notes_dir, filenames, generator, repeat)
+        report['sizes'][str(size)] = {
+            'generate_s': generate_s,
+            'peak_rss_bytes': peak_rss(),
+            'operations': operations,
+        }
+        # Remove the corpus unless asked to keep it
+        if not keep:
+            shutil.rmtree(notes_dir, ignore_errors=True)
+    # Remove the temporary base directory when it is empty
+    if not keep and not workdir:
+        shutil.rmtree(base, ignore_errors=True)
+    # Return the full report
+    return report
+
+
+# Define helper that parses the output of ``python -X importtime``
+def _parse_importtime(stderr: str):
+    # Sum the self times of every import and collect the module names
+    total_us, modules = 0, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        total_us += int(self_us)
+        modules.append(name.strip())
+    # Return the total in milliseconds and the modules in import order
+    return total_us / 1000, modules
+
+
+# Define function that measures how long CLI commands take to start
+def measure_startup(commands=STARTUP_COMMANDS, repeat=DEFAULT_REPEAT):
+    """Return ``{command: {'import_ms', 'wall_ms', 'modules'}}`` for CLI command lines.
+
+    Each command runs in a fresh ``python -X importtime`` process with the
+    daemon disabled, after one untimed run that warms the bytecode cache.
+    Times are medians over ``repeat`` runs.
+    """
+    # Build the interpreter command and an environment that never forwards to a daemon
+    cli = Path(__file__).with_name("notes_cli.py")
+    env = dict(os.environ, NOTES_DAEMON="0")
+    results = {}
+    # Time each command line separately
+    for argv in commands:
+        import_ms, wall_ms = [], []
+        for run in range(repeat + 1):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", str(cli), *argv],
+                                  capture_output=True, text=True, env=env)
+            elapsed = time.perf_counter() - start
+            # Skip the warm-up run
+            if run:
+                total, modules = _parse_importtime(proc.stderr)
+                import_ms.append(total)
+                wall_ms.append(elapsed * 1000)
+        results[" ".join(argv)] = {
+            'import_ms': percentile(sorted(import_ms), 0.5),
+            'wall_ms': percentile(sorted(wall_ms), 0.5),
+            'modules': modules,
+        }
+    # Return the measurements
+    return results
+
+
+# Define function that compares two reports operation by operation
+def compare_reports(baseline: dict, current: dict, threshold=1.2):
+    """Return ``[(size, operation, ratio)]`` where p50 grew by more than ``threshold``."""
+    # Initialize list of regressions
+    regressions = []
+    # Compare every size and operation present in both reports
+    for size, data in current['sizes'].items():
+        old = baseline.get('sizes', {}).get(size)
+        if not old:
+            continue
+        for name, stats in data['operations'].items():
+            before = old['operations'].get(name)
+            # Flag operations whose median latency grew past the threshold
+            if before and before['p50_s'] and stats['p50_s'] / before['p50_s'] > threshold:
+                regressions.append((size, name, stats['p50_s'] / before['p50_s']))
+    # Return the regressions found
+    return regressions
+
+
+# Define helper that returns the current git commit, if any
+def _git_commit():
+    # Ask git for the commit hash, ignoring failures outside a checkout
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Define helper that prints a human-readable summary of a report
+def print_report(report):
+    # Print one table per corpus size
+    for size, data in report['sizes'].items():
+        rss = data['peak_rss_bytes']
+        rss_text = f"{rss / 2**20:.1f} MiB" if rss else "n/a"
+        print(f"{size} notes (generated in {data['generate_s']:.1f}s, peak RSS {rss_text})")
+        for name, stats in data['operations'].items():
+            rate = f"{stats['notes_per_s']:.0f} notes/s" if stats['notes_per_s'] else ""
+            print(f"  {name:<14} cold {stats['cold_s'] * 1000:9.2f} ms  "
+                  f"p50 {stats['p50_s'] * 1000:9.2f} ms  p99 {stats['p99_s'] * 1000:9.2f} ms  {rate}")
+
+
+# Define the main function that handles the benchmark command line
+def main(argv=None):
+    # Create an ArgumentParser object with a description for the benchmark tool
+    parser = argparse.ArgumentParser(description="Benchmark the notes commands on synthetic corpora")
+    # Add options for corpus sizes, repetitions and reproducibility
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='Corpus sizes to benchmark')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Warm runs per operation')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the corpus generator')
+    # Add options for where corpora live and whether to keep them
+    parser.add_argument('--workdir', help='Directory for generated corpora (default: a temp dir)')
+    parser.add_argument('--keep', action='store_true', help='Keep generated corpora for reuse')
+    # Add options for saving and comparing results
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Baseline JSON report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='p50 slowdown ratio that counts as a regression')
+    # Add an option for measuring CLI startup instead of command throughput
+    parser.add_argument('--startup', action='store_true',
+                        help=f'Time CLI startup with -X importtime against a {STARTUP_BUDGET_MS} ms budget')
+    # Parse the command-line arguments
+    args = parser.parse_args(argv)
+    # Measure startup only when asked, failing when a command is over budget
+    if args.startup:
+        over_budget = False
+        for command, result in measure_startup(repeat=args.repeat).items():
+            print(f"notes {command:<32} imports {result['import_ms']:7.2f} ms  "
+                  f"wall {result['wall_ms']:7.2f} ms  modules {len(result['modules'])}")
+            over_budget = over_budget or result['import_ms'] > STARTUP_BUDGET_MS
+        return 1 if over_budget else 0
+    # Run the benchmarks
+    report = run_benchmarks(args.sizes, args.repeat, args.seed, args.workdir, args.keep)
+    # Print the summary
+    print_report(report)
+    # Save the JSON report if requested
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    # Compare against a baseline if requested, failing on regressions
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+        for size, name, ratio in regressions:
+            print(f"REGRESSION: {name} on {size} notes is {ratio:.2f}x slower")
+        return 1 if regressions else 0
+    # Report success
+    return 0
+
+
+# Check if this script is being run directly (not imported)
+if __name__ == "__main__":
+    # Run the benchmarks and exit with their status
+    sys.exit(main())
+
+
+# Multi-line comment containing usage instructions for the benchmark tool
+# Usage instructions:
+'''
+python python/notes_bench.py --sizes 1000 10000 --output bench.json
+python python/notes_bench.py --sizes 1000 10000 --compare bench.json
+python python/notes_bench.py --sizes 100000 --workdir /tmp/notes-bench --keep
+python python/notes_bench.py --startup
+'''
@@ -0,0 +1,245 @@
+# Import datetime module for serializing timestamps to JSON
+import datetime
+# Import io module for decoding archive members as text
+import io
+# Import json module for the JSON Lines format
+import json
+# Import os module for atomic renames
+import os
+# Import shutil module for removing a partial directory export
+import shutil
+# Import tarfile module for tar archives
+import tarfile
+# Import time module for dating archive members that are not files
+import time
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import utility functions from notes_utils module
+from notes_utils import (
+    NOTE_EXT, generate_note_filename, iso_now,
+    load_note, parse_note_stream, sanitize_filename, _fsync_directory
+)
+# Import the metadata cache and search index
+from notes_index import NotesIndex
+# Import the storage backends
+from notes_backend import FILES, open_backend
+
+# Define the file extensions recognized as notes when importing
+IMPORT_EXTS = (NOTE_EXT, ".md")
+# Define the archive suffixes and the tarfile mode used to write each
+TAR_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tar.xz": "w:xz"}
+
+
+# Define helper that tells whether a path names a tar archive
+def _tar_mode(path: Path):
+    # Match the longest known archive suffix
+    name = path.name.lower()
+    for suffix, mode in sorted(TAR_MODES.items(), key=lambda item: -len(item[0])):
+        if name.endswith(suffix):
+            return mode
+    # Not a tar archive
+    return None
+
+
+# Define generator that reads notes from a directory, JSON Lines file or tar archive
+def iter_source(source: Path):
+    """Yield ``(name, meta, content, error)`` for every note in ``source``.
+
+    ``source`` can be a directory of ``.note``/``.md`` files in the
+    front-matter format, a ``.jsonl`` file as written by :func:`export_notes`,
+    or a tar archive of note files. ``error`` is a message for entries that
+    could not be read, in which case ``meta`` is None.
+    """
+    # Read every note file of a directory in name order
+    if source.is_dir():
+        for path in sorted(p for p in source.iterdir() if p.suffix in IMPORT_EXTS and p.is_file()):
+            meta, content, error = load_note(path)
+            yield path.name, meta, content, error
+    # Read one JSON object per line
+    elif source.suffix == ".jsonl":
+        with open(source, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                # Skip blank lines
+                if not line.strip():
+                    continue
+                # Parse the record, reporting malformed lines
+                try:
+                    record = json.loads(line)
+                    meta = record['meta']
+                    content = record.get('content', '')
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    yield f"line {number}", None, None, f"Error reading {source.name} line {number}: {e}"
+                    continue
+                yield record.get('filename') or f"line {number}", meta, content, None
+    # Read note files stored in a tar archive
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                # Only regular files with a note extension are imported
+                name = Path(member.name).name
+                if not member.isfile() or Path(name).suffix not in IMPORT_EXTS:
+                    continue
+                # Decode and parse the member like a note file on disk
+                try:
+                    with io.TextIOWrapper(archive.extractfile(member), encoding='utf-8') as f:
+                        meta, content = parse_note_stream(f)
+                except Exception as e:
+                    yield name, None, None, f"Error reading note {name}: {e}"
+                    continue
+                yield name, meta, content, None
+    # Anything else cannot be imported
+    else:
+        raise ValueError(f"Cannot import from '{source}': expected a directory, .jsonl file or tar archive")
+
+
+# Define helper that picks a free note filename for an imported note
+def _choose_filename(name, meta, backend, taken: set) -> str:
+    # Prefer the source name, turned into a note filename
+    stem = Path(name).stem if name.endswith(IMPORT_EXTS) else ''
+    filename = sanitize_filename(stem) + NOTE_EXT if stem else None
+    # Generate a new name when there is none or it is already used
+    while filename is None or filename in taken or backend.exists(filename):
+        filename = generate_note_filename(str(meta.get('title', 'note')))
+    # Reserve the name for the rest of the import
+    taken.add(filename)
+    return filename
+
+
+# Define function that imports notes in one atomic batch
+def import_notes(source: Path, notes_dir: Path):
+    """Import every note from ``source`` into ``notes_dir``.
+
+    Notes are written as one batch of the directory's backend, so they
+    appear together once the whole import succeeded, flushed to disk
+    before any of them is renamed into place. The metadata cache, tag index and search index are updated in the
+    same pass. Returns ``(filenames, errors)``.
+    """
+    # Initialize the results
+    imported, errors = [], []
+    # Track filenames used by this import
+    taken = set()
+    # Make sure the target directory exists before the index opens its sidecar there
+    notes_dir.mkdir(parents=True, exist_ok=True)
+    # Write the notes and index them in the same pass
+    with NotesIndex(notes_dir) as index:
+        try:
+            with index.backend.batch() as batch:
+                for name, meta, content, error in iter_source(Path(source)):
+                    # Collect entries that could not be read
+                    if meta is None or not isinstance(meta, dict):
+                        errors.append(error or f"Skipped {name}: missing metadata")
+                        continue
+                    # Fill in the required fields the source does not provide
+                    meta.setdefault('title', Path(name).stem)
+                    now = iso_now()
+                    meta.setdefault('created', now)
+                    meta.setdefault('modified', now)
+                    # Pick the filename, stage the note and index it under its final stamp
+                    filename = _choose_filename(name, meta, index.backend, taken)
+                    stamp = batch.add(filename, meta, content or '')
+                    index.index_note(filename, stamp, meta, content or '')
+                    imported.append(filename)
+        # Undo the index changes if the files could not be written
+        except BaseException:
+            index.rollback()
+            raise
+        # Persist the index once every note is in place
+        index.commit()
+    # Return what was imported and what was skipped
+    return imported, errors
+
+
+# Define helper that makes metadata values JSON-serializable
+def _json_default(value):
+    # Write timestamps parsed by YAML as ISO 8601 strings
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    # Fall back to the string form of anything else
+    return str(value)
+
+
+# Define helper that copies every note into a directory of .note files
+def _export_directory(backend, names, directory: Path) -> int:
+    # Write each note byte for byte and flush it, then the directory entries
+    directory.mkdir()
+    for name in names:
+        with open(directory / name, 'wb') as f:
+            f.write(backend.read_raw(name))
+            os.fsync(f.fileno())
+    _fsync_directory(directory)
+    return len(names)
+
+
+# Define helper that adds one note to a tar archive
+def _add_to_archive(archive, backend, name: str):
+    # Note files keep their own mtime and permissions
+    if backend.name == FILES:
+        archive.add(backend.layout.path(name), arcname=name)
+        return
+    # Other notes are added from their bytes, dated now
+    data = backend.read_raw(name)
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+
+
+# Define function that exports every note to a directory, JSON Lines file or tar archive
+def export_notes(notes_dir: Path, target: Path):
+    """Export ``notes_dir`` to ``target`` and return ``(count, errors)``.
+
+    A ``.jsonl`` target gets one ``{"filename", "meta", "content"}`` object
+    per line. A tar target, or a directory (a name without a suffix), gets
+    the ``.note`` files byte for byte, whatever backend stores them, so the
+    export stays readable without this program. The target is written
+    under a temporary name and renamed into place when complete.
+    """
+    # Work out the format from the target name
+    target = Path(target)
+    mode = _tar_mode(target)
+    directory = mode is None and (target.suffix == "" or target.is_dir())
+    if mode is None and not directory and target.suffix != ".jsonl":
+        raise ValueError(f"Cannot export to '{target}': expected a directory, .jsonl or tar file name")
+    # List the notes in name order, whatever stores them
+    backend = open_backend(notes_dir)
+    names = sorted(entry.name for entry in backend.scan())
+    # Initialize the results
+    count, errors = 0, []
+    # Write to a temporary file or directory next to the target
+    temp = target.with_name(f".{target.name}.tmp")
+    try:
+        # Copy the notes into a fresh directory; renaming it replaces only an empty target
+        if directory:
+            count = _export_directory(backend, names, temp)
+        # Copy the notes into the archive unchanged
+        elif mode is not None:
+            with tarfile.open(temp, mode) as archive:
+                for name in names:
+                    _add_to_archive(archive, backend, name)
+                    count += 1
+        # Write one JSON object per readable note
+        else:
+            with open(temp, 'w', encoding='utf-8') as f:
+                for name in names:
+                    meta, content, error = backend.load(name)
+                    if meta is None:
+                        errors.append(error or f"Skipped {name}: missing metadata")
+                        continue
+                    record = {'filename': name, 'meta': meta, 'content': content}
+                    f.write(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n")
+                    count += 1
+        # Make the export durable before it replaces the target
+        if not directory:
+            with open(temp, 'rb') as f:
+                os.fsync(f.fileno())
+        # Move the finished export into place
+        os.replace(temp, target)
+    # Remove the partial export on failure
+    except BaseException:
+        if temp.is_dir():
+            shutil.rmtree(temp, ignore_errors=True)
+        else:
+            temp.unlink(missing_ok=True)
+        raise
+    # Return the number of notes exported and any errors
+    return count, errors
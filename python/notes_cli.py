@@ -1,65 +1,232 @@
 # Import the argparse module for command-line argument parsing
 import argparse
-# Import specific functions from the notes_commands module
-from notes_commands import (
-    create_note, list_notes, read_note, edit_note,
-    delete_note, search_notes, stats
-)
+# Import os module for redirecting output when the pipe is closed
+import os
+# Import sys module for exiting with a status code
+import sys
+# Import the worker pool settings
+import notes_parallel
+# Import the optional per-phase profiler
+import notes_profile
 
-# Define the main function that will handle command-line interface logic
-def main():
+# Define the choices of --sort, migrate-layout and migrate-backend here, so building the parser imports
+# neither the model nor the storage modules (a test keeps them equal to SORT_FIELDS, LAYOUTS and BACKENDS)
+SORT_CHOICES = ('modified', 'created', 'title')
+LAYOUT_CHOICES = ('flat', 'sharded')
+BACKEND_CHOICES = ('files', 'pack')
+# Define the commands a running daemon may answer, as listed in notes_daemon.FORWARDED_COMMANDS
+FORWARDED_COMMANDS = ('list', 'search', 'stats', 'read')
+
+# Define argparse type for options that must be zero or positive
+def non_negative_int(value):
+    # Convert the value to an integer
+    number = int(value)
+    # Reject negative numbers with a readable message
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be zero or positive, got {value}")
+    # Return the validated number
+    return number
+
+# Define helper that adds --offset and --limit options to a subcommand
+def add_paging_arguments(subparser):
+    # Add an --offset option to skip the first results
+    subparser.add_argument('--offset', type=non_negative_int, default=0, metavar='N',
+                           help='Skip the first N results')
+    # Add a --limit option to stop after enough results
+    subparser.add_argument('--limit', type=non_negative_int, metavar='N',
+                           help='Stop after N results')
+
+# Define helper that adds --sort and --desc options to a subcommand
+def add_sort_arguments(subparser):
+    # Add a --sort option to order the results by a header field
+    subparser.add_argument('--sort', choices=SORT_CHOICES,
+                           help='Order by this field instead of the filename (notes without it come first)')
+    # Add a --desc flag to reverse the order
+    subparser.add_argument('--desc', action='store_true', help='Reverse the order, e.g. newest first')
+
+# Define function that builds the command-line parser
+def build_parser():
     # Create an ArgumentParser object with a description for the CLI tool
     parser = argparse.ArgumentParser(description="Personal Notes Manager - Phase 1 CLI")
+    # Add a global --jobs option to scan and parse notes on a worker pool
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help=f'Number of workers for scanning notes (0 = one per CPU, '
+                             f'default: ${notes_parallel.JOBS_ENV} or 1)')
+    # Add a global --pool option to choose threads or processes for the workers
+    parser.add_argument('--pool', choices=notes_parallel.POOL_KINDS,
+                        help=f'Kind of worker pool (default: ${notes_parallel.POOL_ENV} or thread)')
+    # Add a global --profile option to print per-phase timings and counters as JSON on stderr
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Print phase timings and counters as JSON on stderr (also: ${notes_profile.PROFILE_ENV}=1)')
+    # Add a global --profile-dump option to save cProfile statistics
+    parser.add_argument('--profile-dump', metavar='FILE',
+                        help=f'Also write cProfile statistics to FILE (also: ${notes_profile.PROFILE_DUMP_ENV})')
     # Create subparsers to handle different commands (create, list, read, etc.)
     subparsers = parser.add_subparsers(dest='command')
     # Add a 'create' subcommand with help text
     subparsers.add_parser('create', help='Create a new note')
     # Add a 'list' subcommand and store its parser object
     list_parser = subparsers.add_parser('list', help='List notes, optionally filtered by tag')
-    # Add an optional --tag argument to the list command
-    list_parser.add_argument('--tag', help='Filter notes by tag')
+    # Add a repeatable --tag argument; notes must carry every given tag
+    list_parser.add_argument('--tag', action='append',
+                             help='Only notes with this tag (repeat to require several tags)')
+    # Add a repeatable --any-tag argument; notes must carry at least one of them
+    list_parser.add_argument('--any-tag', action='append', default=[], metavar='TAG',
+                             help='Only notes with at least one of these tags (repeatable)')
+    # Add a repeatable --exclude-tag argument; notes must carry none of them
+    list_parser.add_argument('--exclude-tag', action='append', default=[], metavar='TAG',
+                             help='Leave out notes with this tag (repeatable)')
+    # Add --sort and --desc arguments for ordering the list
+    add_sort_arguments(list_parser)
+    # Add --offset and --limit arguments for paging through the list
+    add_paging_arguments(list_parser)
     # Add a 'read' subcommand and store its parser object
     read_parser = subparsers.add_parser('read', help='Read/display a note')
     # Add a required positional argument for note_id to the read command
-    read_parser.add_argument('note_id', help='Note filename')
+    read_parser.add_argument('note_id', help='Note filename, a unique prefix of it, or the note title')
+    # Add an optional --body flag to print only the note body, skipping YAML parsing
+    read_parser.add_argument('--body', action='store_true', help='Print only the note body')
     # Add an 'edit' subcommand and store its parser object
     edit_parser = subparsers.add_parser('edit', help='Edit a note')
     # Add a required positional argument for note_id to the edit command
-    edit_parser.add_argument('note_id', help='Note filename')
+    edit_parser.add_argument('note_id', help='Note filename, a unique prefix of it, or the note title')
     # Add a 'delete' subcommand and store its parser object
     delete_parser = subparsers.add_parser('delete', help='Delete a note')
     # Add a required positional argument for note_id to the delete command
-    delete_parser.add_argument('note_id', help='Note filename')
+    delete_parser.add_argument('note_id', help='Note filename, a unique prefix of it, or the note title')
     # Add a 'search' subcommand and store its parser object
     search_parser = subparsers.add_parser('search', help='Search notes')
     # Add a required positional argument for search query to the search command
     search_parser.add_argument('query', help='Search query')
+    # Create a group so only one search mode can be chosen at a time
+    search_mode = search_parser.add_mutually_exclusive_group()
+    # Add an optional --ranked flag to use the inverted index with BM25 ranking
+    search_mode.add_argument('--ranked', action='store_true',
+                             help='Match whole words and rank results by relevance')
+    # Add an optional --regex flag to treat the query as a regular expression
+    search_mode.add_argument('--regex', action='store_true',
+                             help='Treat the query as a case-insensitive regular expression')
+    # Add --sort and --desc arguments for ordering the results
+    add_sort_arguments(search_parser)
+    # Add --offset and --limit arguments for paging through the results
+    add_paging_arguments(search_parser)
     # Add a 'stats' subcommand with help text
     subparsers.add_parser('stats', help='Show notes statistics')
-    # Parse the command-line arguments and store them in args object
+    # Add an 'import' subcommand and store its parser object
+    import_parser = subparsers.add_parser('import', help='Import notes without prompts')
+    # Add a required positional argument for the import source
+    import_parser.add_argument('source', help='Directory of .note/.md files, .jsonl file or tar archive')
+    # Add an 'export' subcommand and store its parser object
+    export_parser = subparsers.add_parser('export', help='Export all notes')
+    # Add a required positional argument for the export target
+    export_parser.add_argument('target', help='Directory for .note files, or output file ending in .jsonl, '
+                                              '.tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz')
+    # Add a 'reindex' subcommand to rebuild the metadata cache and search index
+    subparsers.add_parser('reindex', help='Rebuild the metadata cache and search index')
+    # Add a 'migrate-layout' subcommand and store its parser object
+    migrate_parser = subparsers.add_parser('migrate-layout', help='Move notes into a flat or sharded directory layout')
+    # Add a required positional argument for the target layout
+    migrate_parser.add_argument('layout', choices=LAYOUT_CHOICES, help='Sharded spreads notes over hashed subdirectories')
+    # Add a 'migrate-backend' subcommand and store its parser object
+    backend_parser = subparsers.add_parser('migrate-backend', help='Move notes into note files or a packfile')
+    # Add a required positional argument for the target backend
+    backend_parser.add_argument('backend', choices=BACKEND_CHOICES,
+                                help='Pack keeps every note in one append-only file, notes.pack')
+    # Add a 'compact' subcommand to drop old versions of notes from the packfile
+    subparsers.add_parser('compact', help='Reclaim space taken by old versions of notes in the packfile')
+    # Add a 'daemon' subcommand and store its parser object
+    daemon_parser = subparsers.add_parser('daemon', help='Serve read-only commands from memory over a local socket')
+    # Add an optional --stop flag to shut a running daemon down
+    daemon_parser.add_argument('--stop', action='store_true', help='Stop the running daemon')
+    # Add an optional --interval option for how often the daemon looks for changes on disk
+    daemon_parser.add_argument('--interval', type=float, metavar='SECONDS',
+                               help='Seconds between rescans for outside changes when inotify is unavailable '
+                                    '(default: 2)')
+    # Add a 'serve' subcommand and store its parser object
+    serve_parser = subparsers.add_parser('serve', help='Serve notes over a local REST API')
+    # Add optional --host and --port options for the listening address
+    serve_parser.add_argument('--host', help='Address to listen on (default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=non_negative_int, help='Port to listen on (default: 8080, 0 = any free port)')
+    # Return the finished parser
+    return parser
+
+# Define the main function that will handle command-line interface logic
+def main():
+    # Build the parser and parse the command-line arguments
+    parser = build_parser()
     args = parser.parse_args()
+    # Start or stop the daemon when asked to
+    if args.command == 'daemon':
+        # Load the daemon only for the commands that talk to it
+        import notes_daemon
+        # Ask a running daemon to shut down, or run one in the foreground
+        if args.stop:
+            if not notes_daemon.stop(notes_daemon.DEFAULT_NOTES_DIR):
+                print("No daemon is running.")
+        else:
+            notes_daemon.serve(notes_daemon.DEFAULT_NOTES_DIR,
+                               notes_daemon.REFRESH_INTERVAL if args.interval is None else args.interval)
+        return
+    # Run the REST server in the foreground, loading the HTTP stack only for this command
+    if args.command == 'serve':
+        import notes_server
+        notes_server.serve(notes_server.DEFAULT_NOTES_DIR,
+                           args.host or notes_server.DEFAULT_HOST,
+                           notes_server.DEFAULT_PORT if args.port is None else args.port)
+        return
+    # Work out whether to profile, from the flags or the environment
+    dump = args.profile_dump or os.environ.get(notes_profile.PROFILE_DUMP_ENV)
+    profile = args.profile or dump or os.environ.get(notes_profile.PROFILE_ENV, "0") == "1"
+    # Let a running daemon answer read-only commands, falling back to running them here; profiling always runs here
+    if args.command in FORWARDED_COMMANDS and not profile:
+        import notes_daemon
+        status = notes_daemon.forward(sys.argv[1:], notes_daemon.DEFAULT_NOTES_DIR)
+        if status is not None:
+            sys.exit(status)
+    # Run the command in this process, profiling it when asked
+    if profile:
+        notes_profile.start(dump)
+    try:
+        # Share one worker pool across every batch of the command
+        with notes_parallel.worker_pool():
+            run_command(args, parser)
+    finally:
+        notes_profile.stop(dump)
+
+# Define function that runs one parsed command in this process
+def run_command(args, parser):
+    # Apply the worker pool settings before running any command
+    notes_parallel.configure(jobs=args.jobs, pool=args.pool)
+    # Import the commands only now, so --help and forwarded commands start quickly
+    from notes_commands import (
+        create_note, iter_notes, read_note, edit_note,
+        delete_note, iter_search_notes, stats, reindex,
+        import_notes, export_notes, migrate_notes_layout, migrate_notes_backend, compact_notes
+    )
     # Check if the command is 'create'
     if args.command == 'create':
         # Call the create_note function
         create_note()
     # Check if the command is 'list'
     elif args.command == 'list':
-        # Call list_notes function with optional tag filter and store results
-        notes = list_notes(filter_tag=args.tag)
+        # Initialize flag that records whether anything was printed
+        found = False
+        # Print each note (filename and metadata) as soon as it is streamed
+        for filename, meta in iter_notes(filter_tag=args.tag, offset=args.offset, limit=args.limit,
+                                         any_tags=args.any_tag, exclude_tags=args.exclude_tag,
+                                         sort=args.sort, descending=args.desc):
+            # Print formatted note information with filename, title, and tags
+            tags = ', '.join(str(tag) for tag in meta.get('tags', []))
+            print(f"{filename}: {meta.get('title', '')} (tags: {tags})")
+            found = True
         # Check if no notes were found
-        if not notes:
+        if not found:
             # Print message indicating no notes found
             print("No notes found.")
-        # If notes were found
-        else:
-            # Iterate through each note (filename and metadata)
-            for filename, meta in notes:
-                # Print formatted note information with filename, title, and tags
-                print(f"{filename}: {meta.get('title', '')} (tags: {', '.join(meta.get('tags', []))})")
     # Check if the command is 'read'
     elif args.command == 'read':
         # Call read_note function with the provided note_id
-        read_note(args.note_id)
+        read_note(args.note_id, body_only=args.body)
     # Check if the command is 'edit'
     elif args.command == 'edit':
         # Call edit_note function with the provided note_id
@@ -70,22 +237,47 @@ def main():
         delete_note(args.note_id)
     # Check if the command is 'search'
     elif args.command == 'search':
-        # Call search_notes function with the query and store results
-        results = search_notes(args.query)
+        # Initialize flag that records whether anything was printed
+        found = False
+        # Print each search result (filename and metadata) as soon as it is found
+        for filename, meta in iter_search_notes(args.query, ranked=args.ranked, regex=args.regex,
+                                                offset=args.offset, limit=args.limit,
+                                                sort=args.sort, descending=args.desc):
+            # Print formatted search result with filename and title
+            print(f"{filename}: {meta.get('title', '')}")
+            found = True
         # Check if no search results were found
-        if not results:
+        if not found:
             # Print message indicating no matching notes found
             print("No matching notes found.")
-        # If search results were found
-        else:
-            # Iterate through each search result (filename and metadata)
-            for filename, meta in results:
-                # Print formatted search result with filename and title
-                print(f"{filename}: {meta.get('title', '')}")
     # Check if the command is 'stats'
     elif args.command == 'stats':
         # Call the stats function to display statistics
         stats()
+    # Check if the command is 'import'
+    elif args.command == 'import':
+        # Call import_notes function with the provided source
+        import_notes(args.source)
+    # Check if the command is 'export'
+    elif args.command == 'export':
+        # Call export_notes function with the provided target
+        export_notes(args.target)
+    # Check if the command is 'reindex'
+    elif args.command == 'reindex':
+        # Call the reindex function to rebuild the index
+        reindex()
+    # Check if the command is 'migrate-layout'
+    elif args.command == 'migrate-layout':
+        # Call migrate_notes_layout function with the requested layout
+        migrate_notes_layout(args.layout)
+    # Check if the command is 'migrate-backend'
+    elif args.command == 'migrate-backend':
+        # Call migrate_notes_backend function with the requested backend
+        migrate_notes_backend(args.backend)
+    # Check if the command is 'compact'
+    elif args.command == 'compact':
+        # Call the compact_notes function to rewrite the packfile
+        compact_notes()
     # If no valid command was provided
     else:
         # Print the help message showing available commands
@@ -94,7 +286,13 @@ def main():
 # Check if this script is being run directly (not imported)
 if __name__ == "__main__":
     # Call the main function to start the CLI application
-    main()
+    try:
+        main()
+    # Exit quietly when the output is piped into a command like `head` that stops reading
+    except BrokenPipeError:
+        # Point stdout at devnull so the interpreter does not complain at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
 
 
 # Multi-line comment containing usage instructions for the CLI tool
@@ -102,9 +300,37 @@ if __name__ == "__main__":
 '''
 python python/notes_cli.py create
 python python/notes_cli.py list
+python python/notes_cli.py list --offset 20 --limit 10
+python python/notes_cli.py list --tag work --tag urgent --exclude-tag done
+python python/notes_cli.py list --any-tag home --any-tag errands
+python python/notes_cli.py list --sort modified --desc --limit 20
+python python/notes_cli.py list --tag work --sort title
 python python/notes_cli.py read <note_filename>
+python python/notes_cli.py read --body <note_filename>
+python python/notes_cli.py read "Shopping list"
+python python/notes_cli.py read Shopping_list_6bq
 python python/notes_cli.py edit <note_filename>
 python python/notes_cli.py delete <note_filename>
 python python/notes_cli.py search <query>
+python python/notes_cli.py search --limit 1 <query>
+python python/notes_cli.py search --ranked <query>
+python python/notes_cli.py search --regex <pattern>
+python python/notes_cli.py search --sort created --desc --limit 5 <query>
 python python/notes_cli.py stats
+python python/notes_cli.py reindex
+python python/notes_cli.py migrate-layout sharded
+python python/notes_cli.py migrate-backend pack
+python python/notes_cli.py compact
+python python/notes_cli.py daemon &
+python python/notes_cli.py daemon --stop
+python python/notes_cli.py serve --port 8080
+python python/notes_loadtest.py --url http://127.0.0.1:8080 --clients 16 --duration 10
+python python/notes_cli.py --profile search <query>
+python python/notes_cli.py --profile-dump search.prof search <query>
+python python/notes_cli.py import test-notes
+python python/notes_cli.py export notes.jsonl
+python python/notes_cli.py export notes.tar.gz
+python python/notes_cli.py export notes-backup
+python python/notes_cli.py --jobs 8 search <query>
+python python/notes_cli.py --jobs 0 --pool process search --regex <pattern>
 '''
\ No newline at end of file
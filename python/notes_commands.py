@@ -1,44 +1,49 @@
 # Import os module for operating system interface functions
 import os
-# Import subprocess module for running external commands
-import subprocess
+# Import re module for reporting invalid search patterns
+import re
 # Import Path class from pathlib for cross-platform path handling
 from pathlib import Path
-# Import utility functions from notes_utils module
-from notes_utils import (
-    NOTE_EXT, iso_now, generate_note_filename,
-    read_note_file, write_note_file
-)
-
-# Define the notes directory path relative to this file's parent directory
-NOTES_DIR = Path(__file__).parent.parent / "notes_repository"
-# Create the notes directory if it doesn't exist
-NOTES_DIR.mkdir(exist_ok=True)
+# Import the default notes directory
+from notes_utils import DEFAULT_NOTES_DIR
+# Import the store that does the actual work, and its errors
+from notes_store import BlockingNotesStore, NoteNotFound, NoteReadError
+# Import the layout migration
+from notes_layout import migrate_layout
+# Import the backend migration and the backend lookup used by compaction
+from notes_backend import PACK_FILENAME, migrate_backend, open_backend
+
+# Define the notes directory path relative to this file's parent directory; it is created on first write
+NOTES_DIR = DEFAULT_NOTES_DIR
 # Get the editor command from environment variable, default to "nano"
 EDITOR = os.environ.get("EDITOR", "nano")
 
+# Define helper that opens the store for the current notes directory
+def _store():
+    # Build a store on every call so changes to NOTES_DIR (tests, the daemon) take effect
+    return BlockingNotesStore(NOTES_DIR)
+
+# Define helper that opens the metadata cache and search index
+def _open_index():
+    # Import the index on first use so commands like `read` do not load SQLite
+    from notes_index import NotesIndex
+    return NotesIndex(NOTES_DIR)
+
+# Define generator that streams notes with optional tag filtering
+def iter_notes(filter_tag=None, offset=0, limit=None, any_tags=(), exclude_tags=(), sort=None, descending=False):
+    """Yield ``(filename, NoteMeta)`` pairs as the notes directory is scanned.
+
+    ``filter_tag`` may be one tag or a list of tags that must all be
+    present; ``any_tags`` and ``exclude_tags`` add OR and NOT conditions.
+    ``sort`` orders the notes by modified, created or title.
+    """
+    # Stream the notes from the store
+    yield from _store().iter_notes(filter_tag, offset, limit, any_tags, exclude_tags, sort, descending)
+
 # Define function to list notes with optional tag filtering
-def list_notes(filter_tag=None):
-    # Initialize empty list to store results
-    results = []
-    # Iterate through all files in notes directory with NOTE_EXT extension
-    for note_file in NOTES_DIR.glob(f"*{NOTE_EXT}"):
-        # Read metadata and content from the note file
-        meta, content = read_note_file(note_file)
-        # Skip this file if metadata couldn't be read
-        if meta is None:
-            continue
-        # If tag filtering is requested
-        if filter_tag:
-            # Get the tags list from metadata, default to empty list
-            tags = meta.get('tags', [])
-            # Skip this note if the filter tag is not in its tags
-            if filter_tag not in tags:
-                continue
-        # Add filename and metadata tuple to results
-        results.append((note_file.name, meta))
-    # Return the list of matching notes
-    return results
+def list_notes(filter_tag=None, offset=0, limit=None, any_tags=(), exclude_tags=(), sort=None, descending=False):
+    # Collect the streamed notes into a list
+    return list(iter_notes(filter_tag, offset, limit, any_tags, exclude_tags, sort, descending))
 
 # Define function to create a new note
 def create_note():
@@ -53,56 +58,38 @@ def create_note():
     tags_raw = input("Enter tags (comma separated, optional): ").strip()
     # Split tags by comma and strip whitespace, or empty list if no tags
     tags = [t.strip() for t in tags_raw.split(",")] if tags_raw else []
-    # Generate filename from title using utility function
-    filename = generate_note_filename(title)
-    # Create full file path by joining directory and filename
-    filepath = NOTES_DIR / filename
-    # Get current timestamp in ISO format
-    created = iso_now()
-    # Create metadata dictionary with note information
-    metadata = {
-        'note_id': filename[:-len(NOTE_EXT)],  # Use filename without extension as ID
-        'filename': filename,
-        'path': str(filepath),
-        'created': created,
-        'modified': created,
-        'tags': tags,   
-        'title': title,
-        'content': '',
-        'editor': EDITOR    
-    }
-    # Initialize empty content string
-    content = ""
-    # Write the note file with metadata and empty content
-    write_note_file(filepath, metadata, content)
-    # Open the note file in the configured editor
-    subprocess.run([EDITOR, str(filepath)])
-    # Re-read the note file after editing
-    meta, content = read_note_file(filepath)
-    # If metadata was successfully read
-    if meta:
-        # Update the modified timestamp
-        meta['modified'] = iso_now()
-        # Write the updated note file
-        write_note_file(filepath, meta, content)
+    # Write and index the empty note
+    store = _store()
+    filename, _ = store.create(title, tags)
+    # Open the note in the configured editor, importing subprocess only for the commands that need it
+    import subprocess
+    # Store what the editor left, bump the modified timestamp and re-index it
+    try:
+        with store.editing(filename) as filepath:
+            subprocess.run([EDITOR, str(filepath)])
+    # Report notes the editor left unreadable
+    except (NoteNotFound, NoteReadError) as e:
+        print(e)
     # Print confirmation message with filename
     print(f"Note created as {filename}")
 
 # Define function to read and display a note
-def read_note(note_id):
-    # Create file path from notes directory and note_id
-    filepath = NOTES_DIR / note_id
-    # Check if the file exists
-    if not filepath.exists():
-        # Print error message and exit function
-        print(f"Note '{note_id}' not found.")
+def read_note(note_id, body_only=False):
+    # Read the note, or just its body without parsing the YAML header when that is all that is wanted
+    try:
+        if body_only:
+            print(_store().read_body(note_id))
+            return
+        meta, content = _store().read(note_id)
+    # Print error message and exit function for missing notes
+    except NoteNotFound as e:
+        print(e)
         return
-    # Read metadata and content from the note file
-    meta, content = read_note_file(filepath)
-    # Check if metadata was successfully read
-    if meta is None:
-        # Print error message and exit function
-        print("Failed to read note metadata.")
+    # Print the reader's error message for unreadable notes
+    except NoteReadError as e:
+        print(e)
+        if not body_only:
+            print("Failed to read note metadata.")
         return
     # Print the note title from metadata
     print(f"Title: {meta.get('title', '')}")
@@ -111,7 +98,7 @@ def read_note(note_id):
     # Print the modification timestamp from metadata
     print(f"Modified: {meta.get('modified', '')}")
     # Print the tags joined by commas from metadata
-    print(f"Tags: {', '.join(meta.get('tags', []))}")
+    print(f"Tags: {', '.join(str(tag) for tag in meta.get('tags', []))}")
     # Print separator line
     print("\n---\n")
     # Print the note content
@@ -119,107 +106,143 @@ def read_note(note_id):
 
 # Define function to edit an existing note
 def edit_note(note_id):
-    # Create file path from notes directory and note_id
-    filepath = NOTES_DIR / note_id
-    # Check if the file exists
-    if not filepath.exists():
-        # Print error message and exit function
-        print(f"Note '{note_id}' not found.")
+    # Open the note in the configured editor, importing subprocess only for the commands that need it
+    import subprocess
+    # Store what the editor left, bump the modified timestamp and re-index it
+    try:
+        with _store().editing(note_id) as filepath:
+            subprocess.run([EDITOR, str(filepath)])
+    # Report missing notes and notes the editor removed or left unreadable
+    except (NoteNotFound, NoteReadError) as e:
+        print(e)
         return
-    # Open the note file in the configured editor
-    subprocess.run([EDITOR, str(filepath)])
-    # Re-read the note file after editing
-    meta, content = read_note_file(filepath)
-    # If metadata was successfully read
-    if meta:
-        # Update the modified timestamp
-        meta['modified'] = iso_now()
-        # Write the updated note file
-        write_note_file(filepath, meta, content)
-        # Print confirmation message
-        print("Note updated.")
+    # Print confirmation message
+    print("Note updated.")
 
 # Define function to delete a note
 def delete_note(note_id):
-    # Create file path from notes directory and note_id
-    filepath = NOTES_DIR / note_id
-    # Check if the file exists
-    if not filepath.exists():
-        # Print error message and exit function
-        print(f"Note '{note_id}' not found.")
-        return
-    # Try to delete the file
+    # Remove the file and its index entry
     try:
-        # Remove the file from filesystem
-        filepath.unlink()
-        # Print confirmation message
-        print(f"Note '{note_id}' deleted.")
-    # Handle any exceptions during deletion
+        filename = _store().delete(note_id)
+    # Print error message for missing notes
+    except NoteNotFound as e:
+        print(e)
+        return
+    # Handle any other exceptions during deletion
     except Exception as e:
         # Print error message with exception details
         print(f"Failed to delete note: {e}")
+        return
+    # Print confirmation message
+    print(f"Note '{filename}' deleted.")
+
+# Define generator that streams notes matching a query
+def iter_search_notes(query: str, ranked=False, regex=False, offset=0, limit=None, sort=None, descending=False):
+    """Yield ``(filename, NoteMeta)`` for matching notes as they are found."""
+    # Stream the matches from the store, reporting invalid patterns once
+    try:
+        yield from _store().iter_search(query, ranked, regex, offset, limit, sort, descending)
+    except re.error as e:
+        print(f"Invalid regular expression: {e}")
 
 # Define function to search notes by query string
-def search_notes(query: str):
-    # Initialize empty list to store search results
-    results = []
-    # Convert query to lowercase for case-insensitive search
-    q = query.lower()
-    # Track corrupted files
-    corrupted_files = []
-    
-    # Iterate through all files in notes directory with NOTE_EXT extension
-    for note_file in NOTES_DIR.glob(f"*{NOTE_EXT}"):
-        # Read metadata and content from the note file
-        meta, content = read_note_file(note_file)
-        # Skip this file if metadata couldn't be read (corrupted)
-        if meta is None:
-            corrupted_files.append(note_file.name)
-            continue
-        
-        # Create searchable text by combining title, tags, and content (all lowercase)
-        haystack = ' '.join([
-            meta.get('title', '').lower(),
-            ' '.join(tag.lower() for tag in meta.get('tags', [])),
-            content.lower()
-        ])
-        # Check if query is found in the searchable text
-        if q in haystack:
-            # Add filename and metadata tuple to results
-            results.append((note_file.name, meta))
-    
-    # Warn about corrupted files if any were found
-    if corrupted_files:
-        print(f"Warning: Skipped {len(corrupted_files)} corrupted file(s): {', '.join(corrupted_files)}")
-    
-    # Return the list of matching notes
-    return results
+def search_notes(query: str, ranked=False, regex=False, offset=0, limit=None, sort=None, descending=False):
+    # Collect the streamed matches into a list
+    return list(iter_search_notes(query, ranked, regex, offset, limit, sort, descending))
+
+# Define function to import notes from a directory, JSON Lines file or tar archive
+def import_notes(source):
+    # Load the bulk pipeline (json, tarfile) only for import and export
+    import notes_bulk
+    # Import everything in one atomic batch, reporting unsupported sources
+    try:
+        imported, errors = notes_bulk.import_notes(Path(source), NOTES_DIR)
+    except (ValueError, OSError) as e:
+        print(f"Import failed: {e}")
+        return
+    # Print each entry that had to be skipped
+    for error in errors:
+        print(error)
+    # Print confirmation message with the note count
+    print(f"Imported {len(imported)} note(s).")
+
+# Define function to export every note to a directory of .note files, a JSON Lines file or a tar archive
+def export_notes(target):
+    # Load the bulk pipeline (json, tarfile) only for import and export
+    import notes_bulk
+    # Export the notes, reporting unsupported targets
+    try:
+        count, errors = notes_bulk.export_notes(NOTES_DIR, Path(target))
+    except (ValueError, OSError) as e:
+        print(f"Export failed: {e}")
+        return
+    # Print each note that had to be skipped
+    for error in errors:
+        print(error)
+    # Print confirmation message with the note count
+    print(f"Exported {count} note(s) to {target}.")
+
+# Define function to rebuild the metadata cache and search index from scratch
+def reindex():
+    # Rebuild the index and report how many notes it now holds
+    with _open_index() as index:
+        count = index.rebuild()
+    # Print confirmation message with the note count
+    print(f"Indexed {count} note(s).")
+
+# Define function to move every note into the flat or sharded directory layout
+def migrate_notes_layout(target):
+    # Move the notes, reporting anything that could not be moved
+    try:
+        moved = migrate_layout(NOTES_DIR, target)
+    except (ValueError, OSError) as e:
+        print(f"Migration failed: {e}")
+        return
+    # Print confirmation message with the number of notes moved
+    print(f"Moved {moved} note(s) to the {target} layout.")
+
+# Define function to move every note into note files or a packfile
+def migrate_notes_backend(target):
+    # Move the notes, reporting anything that could not be moved
+    try:
+        moved = migrate_backend(NOTES_DIR, target)
+    except (ValueError, OSError) as e:
+        print(f"Migration failed: {e}")
+        return
+    # Print confirmation message with the number of notes moved
+    print(f"Moved {moved} note(s) to the {target} backend.")
+
+# Define function to reclaim the space old versions of notes take up in a packfile
+def compact_notes():
+    # Rewrite the pack, reporting failures
+    try:
+        result = open_backend(NOTES_DIR).compact()
+    except (ValueError, OSError) as e:
+        print(f"Compaction failed: {e}")
+        return
+    # Note files have nothing to compact
+    if result is None:
+        print("Nothing to compact: notes are stored as separate files.")
+        return
+    # Print the size before and after
+    before, after = result
+    print(f"Compacted {PACK_FILENAME} from {before} to {after} bytes.")
 
 # Define function to display notes statistics
 def stats():
-    # Get all notes using list_notes function
-    notes = list_notes()
-    # Count total number of notes
-    count = len(notes)
-    # Initialize empty dictionary to count tags
-    tag_count = {}
-    # Iterate through each note and its metadata
-    for _, meta in notes:
-        # Iterate through each tag in the note's tags
-        for tag in meta.get('tags', []):
-            # Increment tag count, defaulting to 0 if tag not seen before
-            tag_count[tag] = tag_count.get(tag, 0) + 1
+    # Read the note count and the precomputed tag counts
+    summary = _store().stats()
     # Print total notes count
-    print(f"Total notes: {count}")
+    print(f"Total notes: {summary['count']}")
     # Print tags summary header
     print("Tags summary:")
     # Check if any tags were found
-    if tag_count:
+    if summary['tags']:
         # Iterate through each tag and its count
-        for tag, c in tag_count.items():
+        for tag, c in summary['tags'].items():
             # Print tag name and count with indentation
             print(f"  {tag}: {c}")
     # If no tags were found
     else:
         # Print message indicating no tags
-        print("  No tags found.")
\ No newline at end of file
+        print("  No tags found.")
@@ -0,0 +1,291 @@
+# Import io module for capturing command output
+import io
+# Import json module for the request/response protocol
+import json
+# Import os module for environment variables and removing the socket file
+import os
+# Import signal module for shutting down cleanly on SIGTERM
+import signal
+# Import sys module for writing forwarded output
+import sys
+# Import time module for scheduling background refreshes
+import time
+# Import redirect_stdout for capturing what a command prints
+from contextlib import redirect_stdout
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import the default notes directory
+from notes_utils import DEFAULT_NOTES_DIR
+# Import the worker pool settings, which forwarded commands may change
+import notes_parallel
+
+# Define the filename of the daemon socket kept inside the notes directory
+SOCKET_FILENAME = ".notes_daemon.sock"
+# Define environment variable that stops the CLI from using a daemon when set to "0"
+DAEMON_ENV = "NOTES_DAEMON"
+# Define the read-only commands a running daemon answers for the CLI
+FORWARDED_COMMANDS = ("list", "search", "stats", "read")
+# Define how often, in seconds, the daemon looks for notes changed outside the CLI
+REFRESH_INTERVAL = 2.0
+# Define how long the client waits for a daemon to accept the connection
+CONNECT_TIMEOUT = 1.0
+# Define how long the client waits for the reply before running the command itself
+REPLY_TIMEOUT = 30.0
+# Define how long the daemon waits on a client's request or reply before dropping it
+CLIENT_TIMEOUT = 5.0
+
+
+# Define function that returns the socket path for a notes directory
+def socket_path(notes_dir: Path) -> Path:
+    # Keep the socket next to the notes it serves
+    return Path(notes_dir) / SOCKET_FILENAME
+
+
+# Define helper that sends one request to the daemon and returns its reply
+def _request(notes_dir: Path, request: dict):
+    # Connect to the daemon, giving up quickly when it is not there
+    path = socket_path(notes_dir)
+    if not path.exists():
+        return None
+    # Import socket only now, so the CLI does not pay for it when no daemon runs
+    import socket
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(CONNECT_TIMEOUT)
+            conn.connect(str(path))
+            # Wait a bounded time for the command to run once connected
+            conn.settimeout(REPLY_TIMEOUT)
+            # Send the request as one JSON line and read the reply to the end
+            conn.sendall(json.dumps(request).encode('utf-8') + b"\n")
+            conn.shutdown(socket.SHUT_WR)
+            with conn.makefile('rb') as f:
+                reply = json.loads(f.read())
+    # Treat stale sockets, dead or stuck daemons and garbled replies as "no daemon"
+    except (OSError, ValueError):
+        return None
+    # Only dictionaries are valid replies
+    return reply if isinstance(reply, dict) else None
+
+
+# Define function that lets a running daemon execute a CLI command
+def forward(argv, notes_dir: Path = DEFAULT_NOTES_DIR):
+    """Run ``argv`` on the daemon and return its exit status.
+
+    Returns ``None`` when no daemon is running, forwarding is disabled with
+    ``NOTES_DAEMON=0``, or the daemon failed or did not reply within
+    :data:`REPLY_TIMEOUT`, so the caller runs the command itself. Only read-only commands are forwarded, so running one again
+    locally after a failed attempt is safe.
+    """
+    # Respect the opt-out
+    if os.environ.get(DAEMON_ENV, "1") == "0":
+        return None
+    # Send the command line to the daemon
+    reply = _request(notes_dir, {'argv': list(argv)})
+    if reply is None or 'error' in reply:
+        return None
+    # Print what the command printed on the daemon side
+    sys.stdout.write(reply.get('stdout', ''))
+    sys.stdout.flush()
+    # Return the command's exit status
+    return reply.get('status', 0)
+
+
+# Define function that asks a running daemon to shut down
+def stop(notes_dir: Path = DEFAULT_NOTES_DIR) -> bool:
+    # Return whether a daemon answered the request
+    return _request(notes_dir, {'command': 'stop'}) is not None
+
+
+# Define class for the resident process that answers CLI commands
+class NotesDaemon:
+    """Answer read-only CLI commands from a warm, incrementally refreshed index.
+
+    The daemon keeps the metadata cache and search tables open and trusts
+    them instead of rescanning the notes directory on every request.
+    Commands run through this CLI update the shared index themselves.
+    Notes edited by other programs are found by a watcher from
+    :mod:`notes_watch`: with inotify, pending events are applied before
+    every request; otherwise directory snapshots are diffed every
+    ``interval`` seconds; a packfile is checked for growth every interval.
+    Either way only the notes that changed are re-parsed. Requests are handled one at a time on a single thread.
+    """
+
+    # Initialize the daemon for a notes directory
+    def __init__(self, notes_dir: Path = DEFAULT_NOTES_DIR, interval: float = REFRESH_INTERVAL):
+        # Remember the notes directory and the refresh interval
+        self.notes_dir = Path(notes_dir)
+        self.interval = interval
+        # Build the path of the socket file
+        self.path = socket_path(self.notes_dir)
+        # Initialize the listening socket, the refresh index, the watcher and the run flag
+        self.server = None
+        self.index = None
+        self.watcher = None
+        self.running = False
+        # Initialize the time of the last refresh
+        self.refreshed = 0.0
+
+    # Define method that binds the socket
+    def start(self):
+        # Import the command layer and sockets here; the CLI imports this module for the client side
+        import notes_commands
+        import socket
+        # Refuse to start twice for the same directory, but replace a stale socket
+        if self.path.exists():
+            if _request(self.notes_dir, {'command': 'ping'}) is not None:
+                raise RuntimeError(f"A daemon is already running for {self.notes_dir}")
+            self.path.unlink()
+        # Point the command layer at the served directory, creating it if needed
+        notes_commands.NOTES_DIR = self.notes_dir
+        self.notes_dir.mkdir(parents=True, exist_ok=True)
+        # Listen on the socket
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(str(self.path))
+        self.server.listen()
+        self.running = True
+
+    # Define method that applies the changes the watcher saw
+    def catch_up(self):
+        # Rescan everything when the watcher lost track, otherwise re-check only what changed
+        names = self.watcher.changes()
+        if names is None:
+            self.refresh()
+            return
+        if names:
+            self.index.apply_changes(names)
+            self.index.index_pending()
+        # Remember when this happened
+        self.refreshed = time.monotonic()
+
+    # Define method that rescans the notes directory
+    def refresh(self):
+        # Re-parse changed notes and index their content ahead of the next search
+        self.index.refresh()
+        self.index.index_pending()
+        # Remember when this happened
+        self.refreshed = time.monotonic()
+
+    # Define method that handles requests until the daemon is stopped
+    def serve_forever(self):
+        # Import the index class; SQLite connections must stay on the serving thread
+        from notes_index import NotesIndex
+        # Keep one index that really scans the directory, then trust the cache everywhere else
+        self.index = NotesIndex(self.notes_dir)
+        self.index.assume_fresh = False
+        # Start watching the backend before the first scan so nothing changed during it is missed
+        self.watcher = self.index.backend.watcher()
+        try:
+            self.refresh()
+            NotesIndex.assume_fresh = True
+            self._serve()
+        # Go back to scanning on every command and close the refresh index
+        finally:
+            NotesIndex.assume_fresh = False
+            self.watcher.close()
+            self.index.close()
+            self.index = None
+
+    # Define method that runs the accept loop
+    def _serve(self):
+        # Import select for waiting on the socket and the watcher together
+        import select
+        # Wait on inotify events as well when the watcher has them
+        sources = [self.server] + ([self.watcher] if self.watcher.realtime else [])
+        timeout = None if self.watcher.realtime else self.interval
+        # Keep answering until a stop request arrives
+        while self.running:
+            # Wait for a client or a change on disk
+            ready, _, _ = select.select(sources, [], [], timeout)
+            # Apply outside changes first: always with events, every interval when polling
+            if self.watcher.realtime or time.monotonic() - self.refreshed >= self.interval:
+                self.catch_up()
+            # Answer the client, if one is waiting
+            if self.server in ready:
+                conn, _ = self.server.accept()
+                with conn:
+                    self._handle(conn)
+
+    # Define method that answers one client connection
+    def _handle(self, conn):
+        # Read the request and work out the reply, dropping clients that stall so others are not kept waiting
+        conn.settimeout(CLIENT_TIMEOUT)
+        try:
+            with conn.makefile('rb') as f:
+                request = json.loads(f.readline())
+            reply = self._dispatch(request)
+        # Report failures, including argparse exits, so the client runs the command itself
+        except (Exception, SystemExit) as e:
+            reply = {'error': str(e)}
+        # Send the reply, ignoring clients that went away
+        try:
+            conn.sendall(json.dumps(reply).encode('utf-8'))
+        except OSError:
+            pass
+
+    # Define method that executes one request
+    def _dispatch(self, request: dict) -> dict:
+        # Answer control requests
+        command = request.get('command')
+        if command == 'ping':
+            return {'status': 0}
+        if command == 'stop':
+            self.running = False
+            return {'status': 0}
+        # Import the CLI here to avoid a circular import
+        import notes_cli
+        # Parse the command line exactly like the CLI does
+        parser = notes_cli.build_parser()
+        args = parser.parse_args(request['argv'])
+        # Refuse anything that is not a read-only command
+        if args.command not in FORWARDED_COMMANDS:
+            return {'error': f"Command '{args.command}' is not served by the daemon"}
+        # Run the command, capturing what it prints and its exit status
+        output = io.StringIO()
+        status = 0
+        # Keep the client's --jobs and --pool from applying to later requests
+        with redirect_stdout(output), notes_parallel.scoped_settings():
+            try:
+                notes_cli.run_command(args, parser)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+        # Return the output and the status
+        return {'status': status, 'stdout': output.getvalue()}
+
+    # Define method that releases the socket
+    def close(self):
+        # Close and remove the socket
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+# Define function that runs a daemon in the foreground
+def serve(notes_dir: Path = DEFAULT_NOTES_DIR, interval: float = REFRESH_INTERVAL):
+    # Unix sockets are required
+    import socket
+    if not hasattr(socket, 'AF_UNIX'):
+        print("The daemon needs Unix domain sockets, which this platform does not provide.")
+        return
+    # Turn SIGTERM into a normal exit so the socket gets removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon = NotesDaemon(notes_dir, interval)
+    try:
+        daemon.start()
+    except (RuntimeError, OSError) as e:
+        print(f"Cannot start daemon: {e}")
+        daemon.close()
+        return
+    print(f"Serving {daemon.notes_dir} on {daemon.path}", flush=True)
+    # Serve until stopped, cleaning up on Ctrl-C as well
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
@@ -0,0 +1,856 @@
+# Import base64 module for storing binary header values as text
+import base64
+# Import datetime module for restoring timestamps in cached metadata
+import datetime
+# Import json module for storing metadata as plain data that cannot run code when loaded
+import json
+# Import os module for reading environment variables
+import os
+# Import re module for tokenizing text into search terms
+import re
+# Import sqlite3 module for the persistent on-disk sidecar database
+import sqlite3
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import the haystack builder shared with substring search, and the tag field reader
+from notes_utils import search_haystack, tag_list
+# Import the storage backends
+from notes_backend import open_backend
+# Import the sort keys of notes
+from notes_model import SORT_FIELDS, sort_key
+# Import the optional per-phase profiler
+import notes_profile
+
+# Define the filename of the sidecar database kept inside the notes directory
+INDEX_FILENAME = ".notes_index.sqlite3"
+# Bump this number whenever the schema changes so old sidecars get rebuilt
+SCHEMA_VERSION = 11
+# Define environment variable that makes a run skip the trigram prefilter when set to "0"
+TRIGRAM_ENV = "NOTES_TRIGRAM_INDEX"
+
+# Define the SQL statements that create the sidecar schema
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    doc INTEGER UNIQUE,
+    modified_key INTEGER NOT NULL,
+    created_key INTEGER NOT NULL,
+    title_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_by_modified ON notes (modified_key, filename);
+CREATE INDEX IF NOT EXISTS notes_by_created ON notes (created_key, filename);
+CREATE INDEX IF NOT EXISTS notes_by_title ON notes (title_key, filename);
+CREATE TABLE IF NOT EXISTS note_tags (
+    tag TEXT NOT NULL,
+    note_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, note_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS note_tags_by_note ON note_tags (note_id);
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS note_tags_insert AFTER INSERT ON note_tags BEGIN
+    INSERT INTO tag_counts (tag, count) VALUES (new.tag, 1)
+        ON CONFLICT (tag) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS note_tags_delete AFTER DELETE ON note_tags BEGIN
+    UPDATE tag_counts SET count = count - 1 WHERE tag = old.tag;
+    DELETE FROM tag_counts WHERE tag = old.tag AND count <= 0;
+END;
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO settings (key, value) VALUES ('note_count', 0);
+CREATE TRIGGER IF NOT EXISTS notes_insert AFTER INSERT ON notes BEGIN
+    UPDATE settings SET value = value + 1 WHERE key = 'note_count';
+END;
+CREATE TRIGGER IF NOT EXISTS notes_delete AFTER DELETE ON notes BEGIN
+    UPDATE settings SET value = value - 1 WHERE key = 'note_count';
+END;
+"""
+# Define the FTS5 table holding the word postings used for ranked search; contentless, so no note text is stored
+FULLTEXT_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(
+    title, tags, content, content = '', tokenize = "unicode61 tokenchars '_'"
+)
+"""
+# Define the FTS5 table holding the trigrams used to prefilter substring search; contentless as well
+TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS trigrams USING fts5(
+    text, content = '', tokenize = 'trigram', detail = 'none'
+)
+"""
+# Define how many outdated documents the search tables may hold before they are rebuilt, at least
+MIN_DEAD_DOCS = 1000
+
+# Map each sort field to the column holding its key, which has its own index
+SORT_COLUMNS = {field: f"{field}_key" for field in SORT_FIELDS}
+
+# Define how many notes a lookup returns at most when a name is ambiguous
+RESOLVE_LIMIT = 10
+
+# Define how many directory entries are refreshed per batch while streaming
+SYNC_BATCH = 256
+
+# Define how much a term occurrence counts in the title, tags and content when ranking
+FIELD_WEIGHTS = (3.0, 2.0, 1.0)
+# Define the pattern that splits text into search terms
+TOKEN_RE = re.compile(r"\w+")
+
+
+# Map the markers of header values JSON has no type for to the functions that restore them
+JSON_TYPES = {
+    '$datetime': datetime.datetime.fromisoformat,
+    '$date': datetime.date.fromisoformat,
+    '$bytes': base64.b64decode,
+    '$set': set,
+}
+
+
+# Define helper that writes the header values JSON has no type for as marked objects
+def _json_default(value):
+    # Check datetimes before dates, since every datetime is a date
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': list(value)}
+    raise TypeError(f"Cannot cache a header value of type {type(value).__name__}")
+
+
+# Define helper that restores a marked object while JSON is decoded
+def _json_object(obj: dict):
+    # Leave ordinary mappings, and marked ones that do not decode, as they are
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        restore = JSON_TYPES.get(key)
+        if restore is not None:
+            try:
+                return restore(value)
+            except (TypeError, ValueError):
+                pass
+    return obj
+
+
+# Define helper that turns header values JSON cannot hold as they are into plain data
+def _plain(value, seen=()):
+    # Cut values that contain themselves, which YAML anchors can build
+    if id(value) in seen:
+        return None
+    if isinstance(value, dict):
+        seen = (*seen, id(value))
+        return {key if isinstance(key, str) else str(key): _plain(item, seen) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        seen = (*seen, id(value))
+        return [_plain(item, seen) for item in value]
+    return value
+
+
+# Define function that serializes a note's metadata for the cache
+def dump_meta(meta: dict) -> str:
+    """Return ``meta`` as JSON text, keeping timestamps, dates, binary values and sets.
+
+    The sidecar lives in the (possibly synced) notes directory, so it holds
+    plain data that loading can never turn into code. Keys that are not
+    strings, such as dates, are stored as their text.
+    """
+    # Most headers hold strings, lists and timestamps only
+    try:
+        return json.dumps(meta, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+    # Fall back for non-string keys and self-referencing values
+    except (TypeError, ValueError):
+        return json.dumps(_plain(meta), default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+# Define function that restores metadata stored by dump_meta
+def load_meta(text: str) -> dict:
+    # Decode the JSON, restoring the marked values
+    return json.loads(text, object_hook=_json_object)
+
+
+# Define function to turn a note's tags field into a list of distinct strings
+def normalize_tags(tags) -> list:
+    # Convert every tag to a string and drop repeats, keeping the first order; a scalar is one tag
+    return list(dict.fromkeys(str(tag) for tag in tag_list(tags)))
+
+
+# Define function to split text into lowercase search terms
+def tokenize(text) -> list:
+    # Lowercase the text and return every word-character run
+    return TOKEN_RE.findall(str(text).lower())
+
+
+# Define function to collect the distinct three-character substrings of a text
+def trigrams(text: str) -> set:
+    # Slide a three-character window over the text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Define function to find literal runs every match of a regex must contain
+def regex_literals(pattern: str) -> list:
+    """Return lowercase ASCII literal runs that any match of ``pattern`` must contain.
+
+    Only top-level literal sequences are collected; groups, classes,
+    repeats and alternations end a run, so the result is always safe to
+    use as a prefilter (an empty list means "no prefilter possible").
+    The parse tree comes from the private ``re._parser`` module; if it is
+    missing or looks different in this Python, there is no prefilter.
+    """
+    # Leave error reporting to the actual compile step, and treat any surprise from the
+    # private parser as "no literals"
+    try:
+        return _literal_runs(re._parser.parse(pattern, re.IGNORECASE), re._constants.LITERAL)
+    except Exception:
+        return []
+
+
+# Define helper that collects the top-level literal runs of a parsed regex
+def _literal_runs(parsed, literal) -> list:
+    # Initialize the list of runs and the run being built
+    runs, current = [], []
+    # Iterate through the top-level opcodes of the pattern
+    for op, arg in parsed:
+        # Extend the current run with plain ASCII literal characters
+        if op is literal and arg < 128:
+            current.append(chr(arg).lower())
+            continue
+        # Any other opcode ends the current run
+        if current:
+            runs.append(''.join(current))
+            current = []
+    # Keep the final run, if any
+    if current:
+        runs.append(''.join(current))
+    # Return the collected runs
+    return runs
+
+
+# Define class that keeps parsed note metadata cached on disk
+class NotesIndex:
+    """Persistent metadata cache and full-text index for a notes directory.
+
+    Parsed YAML headers are stored in a SQLite sidecar keyed by filename,
+    mtime and size, so only notes that changed since the last run are
+    re-parsed. Word and trigram postings live in contentless SQLite FTS5
+    tables and are built lazily, the first time a search needs them.
+    Deleting the sidecar is always safe: it is rebuilt on demand.
+    """
+
+    # Trust the cache without scanning the directory; set by the daemon, which refreshes it in the background
+    assume_fresh = False
+
+    # Initialize the index for the given notes directory
+    def __init__(self, notes_dir: Path, use_trigrams=None, report=None):
+        # Remember the notes directory as a Path object
+        self.notes_dir = Path(notes_dir)
+        # Remember where read errors go; the CLI prints them, library callers may log them
+        self.report = report or print
+        # Open the backend that stores the notes, and the directory layout of note files
+        self.backend = open_backend(self.notes_dir)
+        self.layout = self.backend.layout
+        # Build the path of the sidecar database file
+        self.db_path = self.notes_dir / INDEX_FILENAME
+        # Decide whether this run prefilters with trigrams, honouring the environment
+        if use_trigrams is None:
+            use_trigrams = os.environ.get(TRIGRAM_ENV, "1") != "0"
+        # Remember whether the prefilter is used; the trigrams are maintained either way
+        self.use_trigrams = use_trigrams
+        # Initialize the list of corrupted files seen by the last sync
+        self.corrupted = []
+        # Open (or create) the sidecar database
+        self.conn = self._connect()
+        # Trigrams are kept wherever SQLite ships the trigram tokenizer
+        self.has_trigrams = self._has_trigram_table()
+
+    # Allow the index to be used as a context manager
+    def __enter__(self):
+        # Return the index itself
+        return self
+
+    # Close the database when leaving the with-block
+    def __exit__(self, exc_type, exc, tb):
+        # Close the connection
+        self.close()
+
+    # Define method to close the database connection
+    def close(self):
+        # Only close if the connection is still open
+        if self.conn is not None:
+            # Commit any pending changes and close
+            self.conn.commit()
+            self.conn.close()
+            # Mark the connection as closed
+            self.conn = None
+
+    # Define method to open the database and make sure the schema is current
+    def _connect(self):
+        # Try to open the on-disk sidecar
+        try:
+            # Connect to the database file
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            # Make sure the schema matches what this code expects
+            self._ensure_schema(conn)
+            # Return the ready connection
+            return conn
+        # Handle a corrupted sidecar by deleting and rebuilding it
+        except sqlite3.DatabaseError:
+            # Remove the broken file if it is still there
+            try:
+                self.db_path.unlink()
+            except OSError:
+                pass
+        # Handle read-only directories or other OS-level failures
+        except OSError:
+            pass
+        # Try once more with a fresh file
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._ensure_schema(conn)
+            return conn
+        # Fall back to an in-memory cache so commands still work
+        except (sqlite3.DatabaseError, OSError):
+            conn = sqlite3.connect(":memory:")
+            self._ensure_schema(conn)
+            return conn
+
+    # Define method to create or upgrade the schema
+    @staticmethod
+    def _ensure_schema(conn):
+        # Read the schema version stored in the database header
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        # Drop all tables when the stored version is outdated
+        if version != SCHEMA_VERSION:
+            # Find every table that currently exists, virtual tables first
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "ORDER BY sql LIKE 'CREATE VIRTUAL%' DESC")]
+            # Drop each table so the schema can be recreated cleanly
+            for table in tables:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            # Hand the pages of the dropped tables back to the file system
+            if tables:
+                conn.execute("VACUUM")
+            # Record the new schema version
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # Create any missing tables
+        conn.executescript(SCHEMA)
+        conn.execute(FULLTEXT_SCHEMA)
+        # Create the trigram table where SQLite ships the trigram tokenizer (3.34+)
+        try:
+            conn.execute(TRIGRAM_SCHEMA)
+        except sqlite3.OperationalError:
+            pass
+        # Persist the schema changes
+        conn.commit()
+
+    # Define method to check whether the trigram table could be created
+    def _has_trigram_table(self):
+        # Look the table up in the schema
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'trigrams'").fetchone() is not None
+
+    # Define method to bring the cache up to date with the notes directory
+    def sync(self):
+        """Re-parse changed notes and return ``[(filename, meta), ...]`` sorted by filename."""
+        # Run the streaming refresh to completion
+        return list(self.iter_sync())
+
+    # Define method that refreshes the cache without loading any metadata
+    def refresh(self):
+        """Bring the cache and tag index up to date with the notes directory.
+
+        Without the daemon this stats every note, even when nothing changed:
+        about 10 µs a note, so roughly a second at 100k notes. Directory
+        mtimes cannot stand in for those stats, since editors that save in
+        place leave them untouched. While the daemon runs, its inotify
+        watcher keeps the index fresh and a no-change check takes
+        microseconds.
+        """
+        # Run the refresh to completion without decoding cached metadata
+        for _ in self.iter_sync(load=False):
+            pass
+
+    # Define generator that refreshes the cache while yielding notes
+    def iter_sync(self, load=True, after=None):
+        """Yield ``(filename, meta)`` sorted by filename, refreshing the cache as it goes.
+
+        Notes are handled in batches, so the first results are available
+        before the whole directory has been parsed. Notes deleted from disk
+        are only pruned from the cache once the generator runs to the end.
+        With ``load=False`` the cache is refreshed but nothing is yielded.
+        With ``after``, only notes whose filename sorts after it are
+        refreshed and yielded.
+        """
+        # Serve the cache as it is when something else keeps it up to date
+        if self.assume_fresh:
+            if load:
+                for filename, stored in self.conn.execute(
+                        "SELECT filename, meta FROM notes WHERE filename > ? ORDER BY filename",
+                        (after or "",)):
+                    yield filename, load_meta(stored)
+            return
+        # Time the enumeration of the cache and the directory
+        with notes_profile.phase('scan'):
+            # Load the cached stamps for every known note
+            cached = {
+                filename: (mtime_ns, size, inode)
+                for filename, mtime_ns, size, inode in self.conn.execute(
+                    "SELECT filename, mtime_ns, size, inode FROM notes WHERE filename > ?", (after or "",))
+            }
+            # List the stored notes sorted by name for stable output, skipping those up to `after`
+            entries = sorted((e for e in self.backend.scan() if not after or e.name > after),
+                             key=lambda e: e.name)
+        notes_profile.count('files_scanned', len(entries))
+        # Reset the list of corrupted files
+        self.corrupted = []
+        # Commit whatever was refreshed, even when the caller stops early
+        try:
+            # Handle the entries one batch at a time
+            for start in range(0, len(entries), SYNC_BATCH):
+                # Refresh the batch and yield its notes in order
+                yield from self._sync_batch(entries[start:start + SYNC_BATCH], cached, load)
+            # Forget notes that were deleted from disk since the last run
+            for name in cached:
+                self._forget(name)
+        finally:
+            # Persist the changes in one transaction
+            if self.conn is not None:
+                self.conn.commit()
+
+    # Define method that refreshes one batch of directory entries
+    def _sync_batch(self, entries, cached, load=True):
+        # Initialize list of [filename, meta, stamp] triples in directory order
+        notes = []
+        # Time the stat calls and stamp comparisons
+        with notes_profile.phase('stat'):
+            # Iterate through the entries of the batch
+            for entry in entries:
+                # Stamp the entry (a stat for note files)
+                try:
+                    stamp = self.backend.entry_stamp(entry)
+                # Skip entries that disappeared while scanning
+                except OSError:
+                    continue
+                # Look up the cached stamp for this note, marking it as still present
+                cached_stamp = cached.pop(entry.name, None)
+                # Keep the stamp only when the note is new or changed and needs parsing
+                notes.append([entry.name, None, None if cached_stamp == stamp else stamp])
+        # Load the cached metadata of the unchanged notes in one query
+        unchanged = [name for name, _, stamp in notes if stamp is None]
+        notes_profile.count('cache_hits', len(unchanged))
+        notes_profile.count('cache_misses', len(notes) - len(unchanged))
+        stored = {}
+        if unchanged and load:
+            placeholders = ', '.join('?' * len(unchanged))
+            stored = dict(self.conn.execute(
+                f"SELECT filename, meta FROM notes WHERE filename IN ({placeholders})", unchanged))
+        # Parse the headers of changed notes, possibly on a worker pool
+        changed = [note for note in notes if note[2] is not None]
+        parsed = self.backend.load_many([name for name, _, _ in changed], header_only=True)
+        # Store the parsed metadata in directory order
+        for note, (meta, _, error) in zip(changed, parsed):
+            # Report read errors here so they come out in a deterministic order
+            if error:
+                self.report(error)
+            # Skip corrupted files without caching them so they are reported again
+            if meta is None:
+                self.corrupted.append(note[0])
+                self._forget(note[0])
+                continue
+            # Store the fresh metadata; its search postings are rebuilt lazily
+            self._store(note[0], note[2], meta)
+            note[1] = meta
+        # Stop here when the caller only wanted the cache refreshed
+        if not load:
+            return
+        # Yield the notes of the batch, leaving out corrupted ones
+        for filename, meta, stamp in notes:
+            # Decode cached metadata only when it is actually yielded
+            if stamp is None:
+                meta = load_meta(stored[filename])
+            # Yield everything that was parsed successfully
+            if meta is not None:
+                yield filename, meta
+
+    # Define method to save metadata for one note and invalidate its postings
+    def _store(self, filename, stamp, meta):
+        # Drop postings and trigrams that describe the previous version of the note
+        self._drop_postings(filename)
+        # Store the metadata together with its stamp and sort keys, keeping the note's row id
+        self.conn.execute(
+            "INSERT INTO notes (filename, mtime_ns, size, inode, meta, modified_key, created_key, title_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (filename) DO UPDATE SET mtime_ns = excluded.mtime_ns, "
+            "size = excluded.size, inode = excluded.inode, meta = excluded.meta, "
+            "modified_key = excluded.modified_key, created_key = excluded.created_key, "
+            "title_key = excluded.title_key",
+            (filename, *stamp, dump_meta(meta),
+             *(sort_key(field, meta.get(field)) for field in SORT_FIELDS)))
+        # Replace the note's entries in the tag index, one per distinct tag
+        note_id = self.conn.execute(
+            "SELECT id FROM notes WHERE filename = ?", (filename,)).fetchone()[0]
+        self.conn.execute("DELETE FROM note_tags WHERE note_id = ?", (note_id,))
+        self.conn.executemany(
+            "INSERT INTO note_tags (tag, note_id) VALUES (?, ?)",
+            [(tag, note_id) for tag in normalize_tags(meta.get('tags'))])
+
+    # Define method to retire the search postings of one note
+    def _drop_postings(self, filename):
+        """Detach a note from its postings.
+
+        Contentless FTS5 tables can only delete a row given its original
+        text, which is gone once the note changed. The postings stay behind
+        under a document number no note points to any more, so queries never
+        match them; :meth:`index_pending` rebuilds the tables once such dead
+        documents outnumber the live ones.
+        """
+        # Forget the note's document number
+        self.conn.execute("UPDATE notes SET doc = NULL WHERE filename = ?", (filename,))
+
+    # Define method to empty the search tables
+    def _clear_postings(self):
+        # Drop every posting and trigram, and have every note indexed again lazily
+        self.conn.execute("INSERT INTO fulltext (fulltext) VALUES ('delete-all')")
+        if self.has_trigrams:
+            self.conn.execute("INSERT INTO trigrams (trigrams) VALUES ('delete-all')")
+        self.conn.execute("UPDATE notes SET doc = NULL")
+        self.conn.execute("DELETE FROM settings WHERE key = 'last_doc'")
+
+    # Define helper that reads the last document number handed out
+    def _last_doc(self) -> int:
+        # Numbers are never reused until the tables are cleared, so old postings cannot match new notes
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'last_doc'").fetchone()
+        return int(row[0]) if row else 0
+
+    # Define method to remove every trace of a note from the index
+    def _forget(self, filename):
+        # Delete the postings, trigrams, tag entries and the metadata row
+        self._drop_postings(filename)
+        self.conn.execute(
+            "DELETE FROM note_tags WHERE note_id = (SELECT id FROM notes WHERE filename = ?)",
+            (filename,))
+        self.conn.execute("DELETE FROM notes WHERE filename = ?", (filename,))
+
+    # Define method to write the postings for one note
+    def _index_content(self, filename, meta, content):
+        # Give this version of the note a new document number; postings of older versions stay dead
+        doc = self._last_doc() + 1
+        self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('last_doc', ?)", (str(doc),))
+        # Index title, tags and content as separate columns so title/tag hits can be boosted
+        tags = ' '.join(normalize_tags(meta.get('tags')))
+        self.conn.execute(
+            "INSERT INTO fulltext (rowid, title, tags, content) VALUES (?, ?, ?, ?)",
+            (doc, str(meta.get('title', '')), tags, content))
+        # Index the trigrams of the exact text substring search runs against, even in runs
+        # that skip the prefilter, so the table never misses a note
+        if self.has_trigrams:
+            self.conn.execute(
+                "INSERT INTO trigrams (rowid, text) VALUES (?, ?)",
+                (doc, search_haystack(meta, content)))
+        # Point the note at its postings, which marks it as indexed
+        self.conn.execute("UPDATE notes SET doc = ? WHERE filename = ?", (doc, filename))
+
+    # Define method to index the content of notes whose postings are missing
+    def index_pending(self):
+        # Rebuild the search tables once outdated documents outnumber the notes
+        live = self.conn.execute("SELECT COUNT(doc) FROM notes").fetchone()[0]
+        if self._last_doc() - live > max(live, MIN_DEAD_DOCS):
+            self._clear_postings()
+        # Find every cached note that has not been content-indexed yet
+        pending = self.conn.execute(
+            "SELECT filename FROM notes WHERE doc IS NULL").fetchall()
+        # Read the full pending notes, possibly on a worker pool
+        loaded = self.backend.load_many([filename for (filename,) in pending])
+        # Index each pending note, timing the writes to the search tables
+        with notes_profile.phase('index_content'):
+            for (filename,), (meta, content, error) in zip(pending, loaded):
+                # Report read errors in a deterministic order
+                if error:
+                    self.report(error)
+                # Forget notes that became unreadable since they were cached
+                if meta is None:
+                    self._forget(filename)
+                    continue
+                # Write the postings for the note
+                self._index_content(filename, meta, content)
+            # Persist the new postings
+            self.conn.commit()
+
+    # Define method to store and index a note whose text is already in memory
+    def index_note(self, filename, stamp, meta, content):
+        """Store and index one note in the current transaction, without re-reading it.
+
+        ``stamp`` is the note's backend stamp. Bulk writers call this once per
+        note and :meth:`commit` once at the end.
+        """
+        # Store the metadata and tags, then index the content right away
+        self._store(filename, stamp, meta)
+        self._index_content(filename, meta, content)
+
+    # Define method to persist staged changes
+    def commit(self):
+        # Commit the current transaction
+        self.conn.commit()
+
+    # Define method to discard staged changes
+    def rollback(self):
+        # Roll back the current transaction
+        self.conn.rollback()
+
+    # Define method to refresh the index entry for a single note
+    def update_note(self, filename):
+        # Stamp the note, forgetting it if it no longer exists
+        stamp = self.backend.stamp(filename)
+        if stamp is None:
+            self.remove_note(filename)
+            return
+        # Read the full note including its body
+        meta, content, error = self.backend.load(filename)
+        # Forget notes that cannot be parsed
+        if meta is None:
+            self.report(error)
+            self.remove_note(filename)
+            return
+        # Store the metadata and index the content right away
+        self.index_note(filename, stamp, meta, content)
+        # Persist the changes
+        self.conn.commit()
+
+    # Define method to re-check only the notes a change detector reported
+    def apply_changes(self, filenames) -> int:
+        """Bring just ``filenames`` up to date and return how many were re-parsed.
+
+        Used with :class:`notes_watch.InotifyWatcher`, which reports the
+        notes touched since its last check, so nothing else is scanned.
+        Names that no longer exist are forgotten.
+        """
+        # Stamp each reported note and keep the ones whose stamp changed
+        changed = []
+        for filename in sorted(set(filenames)):
+            stamp = self.backend.stamp(filename)
+            # Forget notes that were deleted or moved away
+            if stamp is None:
+                self._forget(filename)
+                continue
+            row = self.conn.execute(
+                "SELECT mtime_ns, size, inode FROM notes WHERE filename = ?", (filename,)).fetchone()
+            if row != stamp:
+                changed.append((filename, stamp))
+        # Parse the headers of the changed notes, possibly on a worker pool
+        parsed = self.backend.load_many([filename for filename, _ in changed], header_only=True)
+        # Store the fresh metadata; search postings are rebuilt lazily as in a full sync
+        for (filename, stamp), (meta, _, error) in zip(changed, parsed):
+            # Report read errors in a deterministic order
+            if error:
+                self.report(error)
+            # Skip corrupted files without caching them
+            if meta is None:
+                self.corrupted.append(filename)
+                self._forget(filename)
+                continue
+            self._store(filename, stamp, meta)
+        # Persist the changes
+        self.conn.commit()
+        # Return the number of notes that were re-parsed
+        return len(changed)
+
+    # Define method to drop a single note from the index
+    def remove_note(self, filename):
+        # Forget the note and persist the change
+        self._forget(filename)
+        self.conn.commit()
+
+    # Define method to rebuild the whole index from scratch
+    def rebuild(self):
+        # Delete every cached row, posting, trigram and tag entry
+        self.conn.execute("DELETE FROM note_tags")
+        self.conn.execute("DELETE FROM tag_counts")
+        self._clear_postings()
+        self.conn.execute("DELETE FROM notes")
+        self.conn.commit()
+        # Re-parse all notes and index their content
+        notes = self.sync()
+        self.index_pending()
+        # Return the number of notes indexed
+        return len(notes)
+
+    # Define method to count the cached notes
+    def count(self) -> int:
+        # Read the count the notes table triggers maintain
+        return int(self.conn.execute(
+            "SELECT value FROM settings WHERE key = 'note_count'").fetchone()[0])
+
+    # Define method to read the precomputed number of notes per tag
+    def tag_counts(self) -> dict:
+        """Return ``{tag: number of notes}``, most used tags first."""
+        # Read the counts maintained by the tag index triggers
+        return dict(self.conn.execute(
+            "SELECT tag, count FROM tag_counts ORDER BY count DESC, tag"))
+
+    # Define generator that answers boolean tag queries from the tag index
+    def query_tags(self, all_tags=(), any_tags=(), exclude_tags=(), offset=0, limit=None,
+                   sort=None, descending=False, after=None):
+        """Yield ``(filename, meta)`` for notes matching a boolean tag query.
+
+        A note matches when it carries every tag in ``all_tags``, at least
+        one tag in ``any_tags`` (if given) and no tag in ``exclude_tags``.
+        Notes come in filename order, or ordered by ``sort`` (one of
+        :data:`notes_model.SORT_FIELDS`) with ties in filename order; both
+        orders are read from an index, so only the requested page is
+        touched. ``descending`` reverses the order. ``after`` starts the
+        filename order after that filename, seeking in the same index. Call
+        :meth:`refresh` first so the index reflects the disk.
+        """
+        # Build one set of note ids per condition and intersect them
+        selects, params = [], []
+        # Each required tag contributes its own set of notes
+        for tag in all_tags:
+            selects.append("SELECT note_id FROM note_tags WHERE tag = ?")
+            params.append(tag)
+        # The alternative tags contribute the union of their notes
+        if any_tags:
+            selects.append(
+                f"SELECT note_id FROM note_tags WHERE tag IN ({', '.join('?' * len(any_tags))})")
+            params.extend(any_tags)
+        # Intersect the positive conditions, starting from every note when there is none
+        matching = " INTERSECT ".join(selects) or "SELECT id FROM notes"
+        # Subtract notes carrying an excluded tag
+        if exclude_tags:
+            matching += (" EXCEPT SELECT note_id FROM note_tags "
+                         f"WHERE tag IN ({', '.join('?' * len(exclude_tags))})")
+            params.extend(exclude_tags)
+        # Leave the condition out entirely for unfiltered listings, so SQLite just walks an index
+        conditions = [f"id IN ({matching})"] if params else []
+        # Seek past the notes earlier pages returned
+        if after:
+            conditions.append("filename > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Order by the sort key and then the filename, both reversed when descending
+        direction = " DESC" if descending else ""
+        order = f"{SORT_COLUMNS[sort]}{direction}, " if sort else ""
+        # Fetch the matching notes in order, paginated by SQLite
+        rows = self.conn.execute(
+            f"SELECT filename, meta FROM notes {where} "
+            f"ORDER BY {order}filename{direction} LIMIT ? OFFSET ?",
+            (*params, -1 if limit is None else limit, offset))
+        # Yield the notes one at a time
+        for filename, stored in rows:
+            yield filename, load_meta(stored)
+
+    # Define method that finds cached notes that changed since they were cached
+    def stale(self, filenames) -> list:
+        """Return the ``filenames`` whose backend stamp differs from the cached one (one stat each)."""
+        # Compare each note's current stamp with the stored one; deleted notes have no stamp
+        stale = []
+        for filename in filenames:
+            row = self.conn.execute(
+                "SELECT mtime_ns, size, inode FROM notes WHERE filename = ?", (filename,)).fetchone()
+            if row is None or row != self.backend.stamp(filename):
+                stale.append(filename)
+        return stale
+
+    # Define method that finds the notes a name given by the user may refer to
+    def resolve(self, name: str) -> list:
+        """Return up to :data:`RESOLVE_LIMIT` sorted filenames that ``name`` may refer to.
+
+        The first rule that matches anything wins: the exact title, then a
+        prefix of the note ID, then the title in any case. Each rule is a
+        lookup in an index of the cache, so the time taken does not grow
+        with the number of notes. The cache is used as it is; check the
+        result with :meth:`stale` before trusting it.
+        """
+        # An empty name refers to nothing, not to every note
+        if not name:
+            return []
+        # Find notes whose title equals the name in any case, from the title index
+        rows = self.conn.execute(
+            "SELECT filename, meta FROM notes WHERE title_key = ? ORDER BY filename LIMIT ?",
+            (sort_key('title', name), RESOLVE_LIMIT)).fetchall()
+        # Prefer notes whose title is exactly the name
+        exact = [filename for filename, stored in rows if str(load_meta(stored).get('title')) == name]
+        if exact:
+            return exact
+        # Then notes whose ID starts with the name, from the filename index
+        prefixed = [filename for (filename,) in self.conn.execute(
+            "SELECT filename FROM notes WHERE filename >= ? AND filename < ? ORDER BY filename LIMIT ?",
+            (name, name + "\U0010ffff", RESOLVE_LIMIT))]
+        if prefixed:
+            return prefixed
+        # Finally notes whose title matches in another case
+        return [filename for filename, _ in rows]
+
+    # Define method to narrow a substring or regex search to candidate notes
+    def candidates(self, literals, after=None):
+        """Return sorted filenames whose search text contains every literal.
+
+        Returns ``None`` when this run skips the trigram prefilter, SQLite has
+        no trigram tokenizer, or no literal is long enough to filter on,
+        meaning every note is a candidate. With ``after``, only filenames
+        sorting after it are returned.
+        """
+        # Without trigrams every note has to be checked
+        if not (self.use_trigrams and self.has_trigrams):
+            return None
+        # Collect the trigrams every match must contain
+        grams = set()
+        for literal in literals:
+            grams |= trigrams(literal)
+        # Literals shorter than three characters cannot be filtered on
+        if not grams:
+            return None
+        # Make sure the metadata and trigrams reflect what is on disk
+        self.refresh()
+        self.index_pending()
+        # Keep only notes that contain every required trigram
+        with notes_profile.phase('trigram_query'):
+            rows = self.conn.execute(
+                "SELECT notes.filename FROM trigrams JOIN notes ON notes.doc = trigrams.rowid "
+                "WHERE trigrams MATCH ? AND notes.filename > ? ORDER BY notes.filename",
+                (' AND '.join(_fts_quote(gram) for gram in sorted(grams)), after or ""))
+            filenames = [filename for (filename,) in rows]
+        # Return the candidate filenames
+        notes_profile.count('candidates', len(filenames))
+        return filenames
+
+    # Define method to run a ranked full-text search
+    def search(self, query: str):
+        """Return ``[(filename, meta, score), ...]`` for notes containing every query term.
+
+        Hits are ranked with BM25, counting title and tag matches more than
+        body matches.
+        """
+        # Split the query into unique terms, keeping their order
+        terms = list(dict.fromkeys(tokenize(query)))
+        # Return nothing for queries without any searchable term
+        if not terms:
+            return []
+        # Make sure the metadata and postings reflect what is on disk
+        self.refresh()
+        self.index_pending()
+        # Let FTS5 find notes with every term and rank them (lower bm25 is better)
+        with notes_profile.phase('fulltext_query'):
+            rows = self.conn.execute(
+                "SELECT notes.filename, notes.meta, bm25(fulltext, ?, ?, ?) AS rank "
+                "FROM fulltext JOIN notes ON notes.doc = fulltext.rowid "
+                "WHERE fulltext MATCH ? ORDER BY rank, notes.filename",
+                (*FIELD_WEIGHTS, ' AND '.join(_fts_quote(term) for term in terms)))
+            # Return filename, metadata and score triples, higher scores first
+            return [(filename, load_meta(stored), -rank) for filename, stored, rank in rows]
+
+
+# Define helper that quotes a string as a literal FTS5 query term
+def _fts_quote(text: str) -> str:
+    # Wrap the text in double quotes, doubling any quotes inside it
+    return '"' + text.replace('"', '""') + '"'
+
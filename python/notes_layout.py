@@ -0,0 +1,194 @@
+# Import os module for fast directory scanning and atomic renames
+import os
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import the note file extension
+from notes_utils import NOTE_EXT
+
+# Define the marker file that records which layout a notes directory uses
+LAYOUT_FILENAME = ".notes_layout"
+# Define the supported layouts: every note in one directory, or hashed subdirectories
+FLAT, SHARDED = "flat", "sharded"
+LAYOUTS = (FLAT, SHARDED)
+# Define the number of hex characters per shard level and the number of levels
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+# Define the characters a shard directory name is made of
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+# Define function that computes the shard directory of a note
+def shard_of(filename: str) -> str:
+    """Return the relative shard directory (e.g. ``"3f/a0"``) for a note filename.
+
+    The shard is derived from a hash of the note ID (the filename without its
+    extension), so it can be computed without touching the disk.
+    """
+    # Strip the extension to get the note ID
+    note_id = filename[:-len(NOTE_EXT)] if filename.endswith(NOTE_EXT) else filename
+    # Hash the ID and split the leading hex digits into directory levels; hashlib is loaded on first use
+    import hashlib
+    digest = hashlib.sha1(note_id.encode('utf-8')).hexdigest()
+    return '/'.join(digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH))
+
+
+# Define helper that tells whether a directory name looks like a shard
+def is_shard_name(name: str) -> bool:
+    # Shards are fixed-width lowercase hex names
+    return len(name) == SHARD_WIDTH and set(name) <= _HEX_DIGITS
+
+
+# Define class that maps note filenames to paths for one notes directory
+class NoteLayout:
+    """Path resolution and enumeration for a flat or hash-sharded notes directory.
+
+    The layout is read from the ``.notes_layout`` marker (missing means
+    flat). Resolving a note costs at most two ``stat`` calls: its location in
+    the current layout, then the other one. That fallback keeps notes
+    reachable while ``migrate_layout`` is moving them.
+    """
+
+    # Initialize the layout by reading the marker file
+    def __init__(self, notes_dir: Path):
+        # Remember the notes directory as a Path object
+        self.notes_dir = Path(notes_dir)
+        # Read the recorded layout, defaulting to flat
+        try:
+            name = (self.notes_dir / LAYOUT_FILENAME).read_text(encoding='utf-8').strip()
+        except OSError:
+            name = FLAT
+        # Ignore unknown values rather than guessing
+        self.name = name if name in LAYOUTS else FLAT
+
+    # Define property telling whether notes live in shard directories
+    @property
+    def sharded(self) -> bool:
+        # Compare against the sharded layout name
+        return self.name == SHARDED
+
+    # Define method that returns a note's location in a given layout
+    def location(self, filename: str, layout: str) -> Path:
+        # Nest sharded notes under their hash directories
+        if layout == SHARDED:
+            return self.notes_dir / shard_of(filename) / filename
+        # Keep flat notes directly in the notes directory
+        return self.notes_dir / filename
+
+    # Define method that resolves an existing note to its path
+    def path(self, filename: str) -> Path:
+        """Return the path of ``filename``, wherever it currently lives."""
+        # Check the location in the current layout first
+        primary = self.location(filename, self.name)
+        if primary.exists():
+            return primary
+        # Fall back to the other layout for notes that were not migrated yet
+        other = self.location(filename, FLAT if self.sharded else SHARDED)
+        return other if other.exists() else primary
+
+    # Define method that returns the path a new note should be written to
+    def new_path(self, filename: str) -> Path:
+        # Use the location in the current layout, creating shard directories as needed
+        path = self.location(filename, self.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    # Define generator that yields directory entries for every note file
+    def scan(self):
+        """Yield ``os.DirEntry`` objects for every note file in either layout.
+
+        The location of the other layout is scanned first, so a note moved by a
+        concurrent migration is seen at least once; repeats are dropped.
+        """
+        # Track names already yielded
+        seen = set()
+        # Scan the other layout's location first, then the current one
+        scans = (self._scan_shards, self._scan_top) if not self.sharded else (self._scan_top, self._scan_shards)
+        for scan in scans:
+            for entry in scan():
+                if entry.name not in seen:
+                    seen.add(entry.name)
+                    yield entry
+
+    # Define helper generator for note files directly in the notes directory
+    def _scan_top(self):
+        # Yield regular files that carry the note extension
+        for entry in _scandir(self.notes_dir):
+            if entry.name.endswith(NOTE_EXT) and entry.is_file():
+                yield entry
+
+    # Define helper generator for note files inside shard directories
+    def _scan_shards(self):
+        # Walk the shard levels breadth first
+        level = [self.notes_dir]
+        for _ in range(SHARD_DEPTH):
+            level = [Path(entry.path) for directory in level for entry in _scandir(directory)
+                     if is_shard_name(entry.name) and entry.is_dir()]
+        # Yield the note files of the deepest level
+        for directory in level:
+            for entry in _scandir(directory):
+                if entry.name.endswith(NOTE_EXT) and entry.is_file():
+                    yield entry
+
+    # Define method that records a new layout in the marker file
+    def set_layout(self, name: str):
+        # Reject unknown layouts
+        if name not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{name}', expected one of: {', '.join(LAYOUTS)}")
+        # Write the marker through a temporary file so it is never half-written
+        marker = self.notes_dir / LAYOUT_FILENAME
+        temp = self.notes_dir / f"{LAYOUT_FILENAME}.tmp"
+        temp.write_text(name + "\n", encoding='utf-8')
+        os.replace(temp, marker)
+        # Remember the new layout
+        self.name = name
+
+
+# Define helper that lists a directory, treating a missing one as empty
+def _scandir(directory):
+    # Materialize the entries so the directory handle is closed right away
+    try:
+        with os.scandir(directory) as it:
+            return list(it)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+# Define function that moves every note into a new layout while staying usable
+def migrate_layout(notes_dir: Path, target: str) -> int:
+    """Switch ``notes_dir`` to the ``target`` layout and return the number of notes moved.
+
+    The marker is switched first, so new notes already go to their final
+    place, then notes are moved one atomic rename at a time. Readers keep
+    working throughout because path resolution checks both locations, and
+    renames keep mtime and size, so cached metadata stays valid.
+    """
+    # Record the target layout before moving anything
+    layout = NoteLayout(notes_dir)
+    layout.set_layout(target)
+    # Move every note that is not in its target location yet
+    moved = 0
+    for entry in list(layout.scan()):
+        destination = layout.location(entry.name, target)
+        if Path(entry.path) == destination:
+            continue
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(entry.path, destination)
+        moved += 1
+    # Remove shard directories left empty by a migration back to flat
+    if target == FLAT:
+        for first in _scandir(notes_dir):
+            if is_shard_name(first.name) and first.is_dir():
+                for second in _scandir(first.path):
+                    _remove_empty_dir(second.path)
+                _remove_empty_dir(first.path)
+    # Return the number of notes moved
+    return moved
+
+
+# Define helper that removes a directory only if it is empty
+def _remove_empty_dir(path):
+    # Ignore directories that still hold files
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
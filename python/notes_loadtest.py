@@ -0,0 +1,180 @@
+# Import argparse module for command-line argument parsing
+import argparse
+# Import http.client module for keep-alive connections to the server
+import http.client
+# Import json module for reading server replies and writing the report
+import json
+# Import sys module for exiting with a status code
+import sys
+# Import threading module for running concurrent clients
+import threading
+# Import time module for high-resolution timers
+import time
+# Import URL helpers for splitting the server address and quoting note IDs
+from urllib.parse import quote, urlsplit
+# Import the nearest-rank percentile helper shared with the benchmarks
+from notes_bench import percentile
+
+# Define the server address used when none is given
+DEFAULT_URL = "http://127.0.0.1:8080"
+# Define how many notes are sampled for per-note requests
+SAMPLE_NOTES = 20
+
+
+# Define function that picks request paths from what the server holds
+def discover_paths(url: str) -> list:
+    """Return a request mix of list, note, search and stats paths for the server at ``url``."""
+    # Fetch the first page of notes to find IDs and a search word
+    conn = _connect(url)
+    try:
+        conn.request("GET", f"/notes?limit={SAMPLE_NOTES}")
+        items = json.loads(conn.getresponse().read()).get('items', [])
+    finally:
+        conn.close()
+    # Mix pages, single notes, a search and the statistics
+    paths = ["/notes?limit=50", "/stats"]
+    paths += [f"/notes/{quote(item['filename'])}" for item in items]
+    words = str(items[0].get('title', '')).split() if items else []
+    if words:
+        paths.append(f"/search?q={quote(words[0].lower())}&limit=20")
+    return paths
+
+
+# Define helper that opens a connection to the server
+def _connect(url: str):
+    # Connect to the host and port of the URL
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+
+# Define function that runs concurrent clients against the server
+def run_load_test(url: str, paths, clients=8, duration=10.0, conditional=False, gzip=False) -> dict:
+    """Send requests from ``clients`` threads for ``duration`` seconds and return statistics.
+
+    Each client keeps one connection open and cycles through ``paths``.
+    With ``conditional`` set, clients send the last ETag they saw for a
+    path as ``If-None-Match``, like a browser revalidating its cache.
+    """
+    # Collect latencies, statuses and errors from every client
+    latencies, statuses, errors = [], {}, []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    # Define the loop each client thread runs
+    def client(offset):
+        # Keep per-client results local and merge them at the end
+        mine, seen, etags, failures = [], {}, {}, []
+        conn = _connect(url)
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            headers = {'Accept-Encoding': "gzip"} if gzip else {}
+            if conditional and path in etags:
+                headers['If-None-Match'] = etags[path]
+            # Time the full round trip, including reading the body
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            # Reconnect after failures and count them
+            except (OSError, http.client.HTTPException) as e:
+                failures.append(f"{path}: {e}")
+                conn.close()
+                conn = _connect(url)
+                continue
+            mine.append(time.perf_counter() - start)
+            seen[response.status] = seen.get(response.status, 0) + 1
+            if response.getheader('ETag'):
+                etags[path] = response.getheader('ETag')
+        conn.close()
+        # Merge the results
+        with lock:
+            latencies.extend(mine)
+            errors.extend(failures)
+            for status, count in seen.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    # Start the clients at different points of the request mix and wait for them
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # Summarize throughput and latency
+    samples = sorted(latencies)
+    return {
+        'clients': clients,
+        'duration_s': round(elapsed, 3),
+        'requests': len(samples),
+        'errors': len(errors),
+        'requests_per_s': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(percentile(samples, fraction) * 1000, 3) if samples else None
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+# Define function that prints a load test report in a readable form
+def print_report(report):
+    # Print throughput, then the latency percentiles and status counts
+    print(f"{report['requests']} requests from {report['clients']} clients in {report['duration_s']:.1f}s: "
+          f"{report['requests_per_s']:.1f} req/s, {report['errors']} errors")
+    print("latency " + "  ".join(f"{name} {value:.2f} ms" for name, value in report['latency_ms'].items()
+                                 if value is not None))
+    print("statuses " + ", ".join(f"{status}: {count}" for status, count in report['statuses'].items()))
+
+
+# Define the main function of the load test tool
+def main(argv=None):
+    # Create an ArgumentParser object with a description for the load test tool
+    parser = argparse.ArgumentParser(description="Measure requests per second and latency of `notes serve`")
+    # Add options for the server, the request mix and the load
+    parser.add_argument('--url', default=DEFAULT_URL, help=f'Server address (default: {DEFAULT_URL})')
+    parser.add_argument('--path', action='append', dest='paths', metavar='PATH',
+                        help='Request path to include (repeatable; default: discovered from the server)')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to keep sending requests')
+    # Add options for conditional requests and compression
+    parser.add_argument('--conditional', action='store_true', help='Revalidate with If-None-Match')
+    parser.add_argument('--gzip', action='store_true', help='Accept gzip-compressed responses')
+    # Add an option for saving the results
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    # Parse the command-line arguments
+    args = parser.parse_args(argv)
+    # Work out the request mix, failing when the server cannot be reached
+    try:
+        paths = args.paths or discover_paths(args.url)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        print(f"Cannot reach {args.url}: {e}")
+        return 1
+    # Run the load test and print the summary
+    report = run_load_test(args.url, paths, args.clients, args.duration, args.conditional, args.gzip)
+    print_report(report)
+    # Save the JSON report if requested
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    # Fail when any request failed
+    return 1 if report['errors'] else 0
+
+
+# Check if this script is being run directly (not imported)
+if __name__ == "__main__":
+    # Run the load test and exit with its status
+    sys.exit(main())
+
+
+# Multi-line comment containing usage instructions for the load test tool
+# Usage instructions:
+'''
+python python/notes_cli.py serve --port 8080 &
+python python/notes_loadtest.py --clients 16 --duration 10
+python python/notes_loadtest.py --conditional --gzip --output load.json
+python python/notes_loadtest.py --path "/search?q=meeting" --path /stats
+'''
@@ -0,0 +1,220 @@
+# Import os module for sizing read buffers
+import os
+# Import re module for finding the end of the YAML header
+import re
+# Import time module for profiling timers
+import time
+# Import chain and islice for putting the bytes read with the header back in front of the body
+from itertools import chain, islice
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import the header parser, the haystack builder and the error formatter
+from notes_utils import parse_header_text, search_haystack, _format_read_error
+# Import the optional per-phase profiler
+import notes_profile
+
+# Define how many bytes of a body are lowercased or decoded at a time
+SEARCH_CHUNK = 1024 * 1024
+DECODE_CHUNK = 1024 * 1024
+# Define how many trailing characters are re-lowered with the next chunk, so context-dependent
+# lowercasing (the Greek final sigma) sees what follows
+LOWER_CONTEXT = 16
+# Define the closing line of a YAML header
+_HEADER_END = re.compile(rb"^---\r?\n", re.MULTILINE)
+# Define the UTF-8 encodings of the only non-ASCII characters whose lowercase form contains
+# ASCII letters: KELVIN SIGN lowers to "k" and LATIN CAPITAL LETTER I WITH DOT ABOVE to "i̇"
+_LOWERS_TO_ASCII = (b"\xe2\x84\xaa", b"\xc4\xb0")
+# Define the characters that may be spelled differently in raw YAML than in the parsed value
+_YAML_QUOTES = ("'", '"')
+
+
+# Define helper that finds an ASCII needle in raw bytes, ignoring ASCII case
+def _bytes_contains(chunks, needle: bytes):
+    """Look for lowercase ``needle`` in a stream of byte chunks, one lowercased chunk at a time.
+
+    Returns ``(found, folds)``, where ``folds`` tells whether the bytes seen
+    hold one of the characters that lowercase to ASCII.
+    """
+    # bytes.lower() folds ASCII letters only, which is exact for an ASCII needle and
+    # never touches UTF-8 multi-byte sequences; overlap chunks so no match is cut apart
+    overlap = max(len(needle) - 1, max(len(seq) for seq in _LOWERS_TO_ASCII) - 1)
+    tail, folds = b"", False
+    for chunk in chunks:
+        window = tail + chunk
+        folds = folds or any(seq in window for seq in _LOWERS_TO_ASCII)
+        if window.lower().find(needle) != -1:
+            return True, folds
+        tail = window[-overlap:]
+    # The needle does not occur
+    return False, folds
+
+
+# Define helper that finds a lowercase needle in decoded text without holding it all in memory
+def _decoded_contains(chunks, needle: str) -> bool:
+    """Decode a stream of byte chunks and look for ``needle`` in its lowercase form."""
+    # Import codecs here; only non-ASCII queries or bodies get this far
+    import codecs
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    # Carry the end of each chunk over so matches across chunk borders are found
+    keep = len(needle) + LOWER_CONTEXT
+    carry = ""
+    # An empty chunk after the last one flushes the decoder
+    for chunk in chain(chunks, [None]):
+        final = chunk is None
+        text = carry + decoder.decode(b"" if final else chunk, final)
+        lowered = text.lower()
+        # Ignore hits in the last few characters until their right-hand context is known
+        end = len(lowered) if final else max(len(lowered) - LOWER_CONTEXT, 0)
+        if lowered.find(needle, 0, end) != -1:
+            return True
+        carry = text[-keep:]
+    # The needle does not occur
+    return False
+
+
+# Define helper that decides whether a title or tag could contain the needle
+def _header_may_match(header: bytes, needle: str) -> bool:
+    # Needles with whitespace can span title, tags and body, or folded YAML lines
+    if any(c.isspace() for c in needle):
+        return True
+    # Escapes, quoting and non-ASCII text mean raw bytes may differ from parsed values
+    if not needle.isascii() or any(q in needle for q in _YAML_QUOTES) or b"\\" in header or not header.isascii():
+        return True
+    # Otherwise a title or tag can only match if the raw header contains the needle
+    return needle.encode('ascii') in header.lower()
+
+
+# Define function that checks a note file against a substring query without decoding its body
+def match_note_file(filepath: Path, query: str):
+    """Return ``(meta, matched, error)`` like reading the note and checking its haystack.
+
+    The file is read a chunk at a time into one reused buffer and the body
+    searched as raw UTF-8 bytes, so nothing proportional to the note size
+    is held in memory. Unlike a memory map, a file truncated meanwhile just
+    reads short instead of killing the process with SIGBUS. ASCII queries are
+    matched against ASCII-lowercased chunks of the bytes; non-ASCII queries,
+    and bodies holding one of the two characters that lowercase to ASCII,
+    are decoded chunk by chunk instead. The YAML header is always parsed, so
+    broken headers are reported even when the note cannot match; title and
+    tags are only checked when the raw header could hold the query.
+
+    The query must not contain line breaks, which the text reader would
+    have translated.
+    """
+    # Lowercase the query the way the haystack is lowercased
+    needle = query.lower()
+    # Take the start time when profiling
+    profiling = notes_profile.enabled
+    if profiling:
+        start = time.perf_counter()
+    # Read the file unbuffered, straight into the chunk buffer
+    try:
+        with open(filepath, 'rb', buffering=0) as f:
+            return _match_chunks(_file_chunks(f), needle)
+    # Report unreadable and malformed files like the regular reader does
+    except Exception as e:
+        if profiling:
+            notes_profile.count('corrupted')
+        return None, False, _format_read_error(Path(filepath), e)
+    # Record the time spent, including YAML
+    finally:
+        if profiling:
+            notes_profile.add_time('load', time.perf_counter() - start)
+            notes_profile.count('files_read')
+
+
+# Define function that checks a note held in memory against a substring query
+def match_note_bytes(name: str, data: bytes, query: str):
+    """Return ``(meta, matched, error)`` like :func:`match_note_file`, for the raw bytes of a
+    note that does not live in a file of its own (e.g. a packfile record)."""
+    # Search the bytes a chunk at a time, exactly like a file
+    profiling = notes_profile.enabled
+    try:
+        return _match_chunks(_bytes_chunks(data), query.lower())
+    # Report malformed notes like the regular reader does
+    except Exception as e:
+        if profiling:
+            notes_profile.count('corrupted')
+        return None, False, _format_read_error(Path(name), e)
+
+
+# Define helper that reads a file from an offset, one chunk at a time
+def _file_chunks(f):
+    """Return ``chunks(start, size)``, which yields the bytes of ``f`` from ``start`` on.
+
+    Full chunks share one buffer, so each is only valid until the next one
+    is read.
+    """
+    # Size the buffers for the file, so small notes do not get a whole chunk each
+    length = os.fstat(f.fileno()).st_size
+    def chunks(start, size=SEARCH_CHUNK):
+        # Read every chunk of this pass into the same buffer
+        size = max(min(size, length - start), 1)
+        buffer = bytearray(size)
+        f.seek(start)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                return
+            if notes_profile.enabled:
+                notes_profile.count('bytes_read', count)
+            yield buffer if count == size else buffer[:count]
+    return chunks
+
+
+# Define helper that cuts bytes held in memory into chunks
+def _bytes_chunks(data: bytes):
+    """Return ``chunks(start, size)`` like :func:`_file_chunks`, for bytes in memory."""
+    def chunks(start, size=SEARCH_CHUNK):
+        # Slice one chunk at a time
+        for offset in range(start, len(data), size):
+            chunk = data[offset:offset + size]
+            if notes_profile.enabled:
+                notes_profile.count('bytes_read', len(chunk))
+            yield chunk
+    return chunks
+
+
+# Define helper that matches a note read through a chunk reader
+def _match_chunks(chunks, needle: str):
+    # Read until the header is complete; only its bytes are collected
+    data = bytearray()
+    first_end, closing = -1, None
+    for chunk in chunks(0):
+        searched = len(data)
+        data += chunk
+        # Check the opening line of the header as soon as it is complete
+        first_end = data.find(b"\n")
+        if first_end < 0:
+            continue
+        if data[:first_end + 1].strip() != b"---":
+            raise ValueError("Missing YAML header")
+        # Look for the closing line, including one cut in half by the previous chunk border
+        closing = _HEADER_END.search(data, max(first_end + 1, searched - 4))
+        if closing is not None:
+            break
+    # Report files that ended before the header did
+    if closing is None:
+        if first_end < 0 and data.strip() != b"---":
+            raise ValueError("Missing YAML header")
+        raise ValueError("Malformed YAML header (missing closing ---)")
+    header = bytes(data[first_end + 1:closing.start()])
+    body = closing.end()
+    # Search the body from the bytes already read on: bytes for ASCII needles, decoded text otherwise
+    rest = chain([bytes(data[body:])], chunks(len(data)))
+    with notes_profile.phase('match'):
+        if needle.isascii():
+            matched, folds = _bytes_contains(rest, needle.encode('ascii'))
+            # Only two characters lowercase to ASCII; decode the body again when it has either of them
+            if not matched and folds:
+                matched = _decoded_contains(chunks(body, DECODE_CHUNK), needle)
+        else:
+            matched = _decoded_contains(rest, needle)
+    # Parse the header of every note, so broken ones are reported as corrupted
+    meta = parse_header_text(header.decode('utf-8'))
+    # Check title and tags, plus the start of the body a needle may run into, when they could match
+    if not matched and _header_may_match(header, needle):
+        head = b"".join(islice(chunks(body, max(4 * len(needle), 1)), 1)).decode('utf-8', 'ignore')
+        matched = needle in search_haystack(meta, head[:max(len(needle) - 1, 0)])
+    # Return the metadata and whether it matched
+    return meta, matched, None
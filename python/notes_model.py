@@ -0,0 +1,215 @@
+# Import datetime module for parsing header timestamps
+import datetime
+# Import sys module for interning tag strings
+import sys
+# Import Mapping base class so records still read like header dictionaries
+from collections.abc import Mapping
+# Import the note file extension
+from notes_utils import NOTE_EXT
+
+# Define the header fields old notes repeat although the filename or layout already says them
+REDUNDANT_FIELDS = frozenset(('note_id', 'filename', 'path', 'content', 'editor'))
+# Define the header fields that get their own slot
+CORE_FIELDS = ('title', 'tags', 'created', 'modified')
+# Define the fields notes can be sorted by
+SORT_FIELDS = ('modified', 'created', 'title')
+# Define the sort key of notes without a usable timestamp; they sort as the oldest
+NO_TIMESTAMP = -(1 << 63)
+# Define marker for fields a note does not have
+_MISSING = object()
+# Define the origin and unit of timestamp sort keys
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+# Define helper that turns an ISO 8601 header value into a datetime
+def parse_timestamp(value):
+    """Return ``value`` as an aware datetime when it is an ISO 8601 string that formats back
+    to exactly the same text, else return it unchanged."""
+    # Only strings need parsing; YAML already turns unquoted timestamps into datetimes
+    if not isinstance(value, str):
+        return value
+    # Accept the "Z" suffix written by iso_now()
+    try:
+        parsed = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return value
+    # Keep the text when formatting would not reproduce it, so writing it back changes nothing
+    return parsed if format_timestamp(parsed) == value else value
+
+
+# Define helper that turns a parsed timestamp back into its header text
+def format_timestamp(value):
+    # Write UTC times with the "Z" suffix used by iso_now(); leave everything else alone
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    return value
+
+
+# Define helper that turns a timestamp into a compact, comparable integer
+def timestamp_key(value) -> int:
+    """Return ``value`` as microseconds since the epoch, or :data:`NO_TIMESTAMP`.
+
+    Datetimes without a time zone and plain dates count as UTC, like the
+    times ``iso_now()`` writes.
+    """
+    # Parse ISO 8601 text, accepting text that would not format back identically
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+        except ValueError:
+            return NO_TIMESTAMP
+    # Count microseconds from the epoch
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return (value - _EPOCH) // _MICROSECOND
+    # YAML reads bare dates as dates; count them from midnight
+    if isinstance(value, datetime.date):
+        return timestamp_key(datetime.datetime.combine(value, datetime.time()))
+    return NO_TIMESTAMP
+
+
+# Define helper that computes what a note is sorted by
+def sort_key(field: str, value):
+    """Return the sort key of a header ``value`` for ``field`` (one of :data:`SORT_FIELDS`).
+
+    Timestamps become integers; titles compare without regard to case,
+    with missing titles first.
+    """
+    # Titles compare case-insensitively
+    if field == 'title':
+        return "" if value is None or value is _MISSING else str(value).casefold()
+    # Timestamps compare as integers
+    return timestamp_key(value)
+
+
+# Define helper that shares one string object per distinct tag
+def _intern_tags(tags) -> tuple:
+    # Treat a missing or scalar tag field as a list, like the tag index does
+    if tags is None:
+        return ()
+    if not isinstance(tags, (list, tuple)):
+        tags = [tags]
+    # Intern string tags; other YAML scalars (numbers, dates) are kept as they are
+    return tuple(sys.intern(tag) if isinstance(tag, str) else tag for tag in tags)
+
+
+# Define class for the compact in-memory form of a note header
+class NoteMeta(Mapping):
+    """Note metadata held in slots instead of a per-note dictionary.
+
+    Tags are interned, so notes sharing a tag share its string, and
+    ``created``/``modified`` are parsed into datetimes. Fields that repeat
+    what the filename or layout already say (``note_id``, ``filename``,
+    ``path``, ``content``, ``editor``) are not kept; the note is identified
+    by :attr:`note_id` instead. Every other header field is kept in
+    :attr:`extra` and round-trips through :meth:`to_dict`.
+
+    Read as a mapping, a record shows the header as it would be written,
+    so ``meta['created']`` is the ISO text while ``meta.created`` is the
+    datetime.
+    """
+
+    # Keep instances small; millions of them may be held at once
+    __slots__ = ('note_id', 'title', 'tags', 'created', 'modified', 'extra')
+
+    # Initialize a record from already normalized values
+    def __init__(self, note_id, title=_MISSING, tags=(), created=_MISSING, modified=_MISSING, extra=None):
+        # Store the identity and the typed fields
+        self.note_id = note_id
+        self.title = title
+        self.tags = tags
+        self.created = created
+        self.modified = modified
+        # Store other fields, or None so notes without any share no empty dict
+        self.extra = extra or None
+
+    # Define constructor that builds a record from a parsed header
+    @classmethod
+    def from_meta(cls, filename: str, meta: dict):
+        """Build a record for ``filename`` from the dictionary the YAML header parsed into."""
+        # Derive the ID from the filename, which is what lookups use
+        note_id = filename[:-len(NOTE_EXT)] if filename.endswith(NOTE_EXT) else filename
+        # Keep every field that is neither a slot nor redundant
+        extra = {key: value for key, value in meta.items()
+                 if key not in REDUNDANT_FIELDS and key not in CORE_FIELDS}
+        # Normalize the slotted fields
+        return cls(
+            note_id,
+            meta.get('title', _MISSING),
+            _intern_tags(meta.get('tags')),
+            parse_timestamp(meta.get('created', _MISSING)),
+            parse_timestamp(meta.get('modified', _MISSING)),
+            extra,
+        )
+
+    # Define property for the note's filename
+    @property
+    def filename(self) -> str:
+        # Add the extension back to the ID
+        return self.note_id + NOTE_EXT
+
+    # Define method that computes what the note is sorted by
+    def sort_key(self, field: str):
+        # Use the parsed slots, so timestamps are not parsed again
+        return sort_key(field, getattr(self, field))
+
+    # Define method that rebuilds the header dictionary
+    def to_dict(self) -> dict:
+        """Return the header fields in the form they are written to disk."""
+        # Start with the slotted fields the note has
+        header = {}
+        if self.title is not _MISSING:
+            header['title'] = self.title
+        header['tags'] = list(self.tags)
+        for key in ('created', 'modified'):
+            value = getattr(self, key)
+            if value is not _MISSING:
+                header[key] = format_timestamp(value)
+        # Add the custom fields unchanged
+        if self.extra:
+            header.update(self.extra)
+        return header
+
+    # Define mapping lookup by header field name
+    def __getitem__(self, key):
+        # Look up slotted fields first, then custom ones
+        if key in CORE_FIELDS:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return list(value) if key == 'tags' else format_timestamp(value)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    # Define iteration over the header field names
+    def __iter__(self):
+        # Yield the slotted fields the note has, then the custom ones
+        for key in CORE_FIELDS:
+            if key == 'tags' or getattr(self, key) is not _MISSING:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    # Define the number of header fields
+    def __len__(self) -> int:
+        # Count the fields yielded by iteration
+        return sum(1 for _ in self)
+
+    # Define how records are pickled; the missing-field marker cannot be
+    def __reduce__(self):
+        # Rebuild from the ID and the header dictionary
+        return _from_dict, (self.note_id, self.to_dict())
+
+    # Define a short representation for debugging
+    def __repr__(self) -> str:
+        return f"NoteMeta({self.note_id!r}, {self.to_dict()!r})"
+
+
+# Define helper that unpickles a record
+def _from_dict(note_id, header):
+    # Parse the header again as if it came from the file
+    return NoteMeta.from_meta(note_id, header)
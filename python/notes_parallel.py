@@ -0,0 +1,149 @@
+# Import os module for environment variables and the CPU count
+import os
+# Import the built-in lock type for guarding the shared worker pool; unlike threading it costs no startup time
+from _thread import allocate_lock
+# Import contextmanager for scoping settings to one command
+from contextlib import contextmanager
+
+# Define environment variable that sets the number of workers
+JOBS_ENV = "NOTES_JOBS"
+# Define environment variable that selects the worker pool kind
+POOL_ENV = "NOTES_POOL"
+# Define the supported worker pool kinds
+POOL_KINDS = ("thread", "process")
+# Define how many items each process pool task handles at once
+PROCESS_CHUNKSIZE = 64
+# Define the fewest items worth handing to the worker pool; smaller inputs run in the caller
+MIN_PARALLEL_ITEMS = 32
+
+# Store the settings chosen on the command line (None means "use environment")
+_settings = {'jobs': None, 'pool': None}
+# Store the worker pool shared by every parallel_map call, and the settings it was made for
+_pool = {'key': None, 'executor': None}
+_pool_lock = allocate_lock()
+
+
+# Define function to override the worker settings, e.g. from CLI flags
+def configure(jobs=None, pool=None):
+    # Remember the number of workers if one was given
+    if jobs is not None:
+        _settings['jobs'] = jobs
+    # Remember the pool kind if one was given
+    if pool is not None:
+        _settings['pool'] = pool
+
+
+# Define context manager that undoes configure() calls made inside it
+@contextmanager
+def scoped_settings():
+    """Restore the worker settings on exit, so one command's flags do not outlive it.
+
+    The worker pool is shut down as well, since it was sized for those flags.
+    """
+    # Remember the settings and put them back afterwards
+    saved = dict(_settings)
+    try:
+        with worker_pool():
+            yield
+    finally:
+        _settings.update(saved)
+
+
+# Define context manager that bounds the life of the shared worker pool
+@contextmanager
+def worker_pool():
+    """Let every :func:`parallel_map` call in the block share one worker pool, and stop it on exit.
+
+    Commands wrap their whole run in this, so a command that reads its notes
+    in many batches starts its workers once.
+    """
+    # Shut the pool down however the block ends
+    try:
+        yield
+    finally:
+        shutdown()
+
+
+# Define function that stops the shared worker pool
+def shutdown():
+    # Detach the pool under the lock, then wait for its workers outside it
+    with _pool_lock:
+        executor = _pool['executor']
+        _pool.update(key=None, executor=None)
+    if executor is not None:
+        executor.shutdown()
+
+
+# Define helper that returns the shared worker pool, starting it on first use
+def _executor(kind: str, jobs: int):
+    # Reuse the running pool unless the settings changed since it was started
+    with _pool_lock:
+        if _pool['key'] != (kind, jobs):
+            # Import the executors only when work is really spread over a pool
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            if _pool['executor'] is not None:
+                _pool['executor'].shutdown()
+            executor_class = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+            _pool.update(key=(kind, jobs), executor=executor_class(max_workers=jobs))
+        return _pool['executor']
+
+
+# Define function to work out how many workers to use
+def get_jobs() -> int:
+    # Prefer the configured value, then the environment, then a single worker
+    jobs = _settings['jobs']
+    if jobs is None:
+        try:
+            jobs = int(os.environ.get(JOBS_ENV, "1"))
+        # Ignore malformed values and stay sequential
+        except ValueError:
+            jobs = 1
+    # Zero means one worker per CPU
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    # Never use fewer than one worker
+    return max(jobs, 1)
+
+
+# Define helper that counts the CPUs this process may run on
+def _usable_cpus() -> int:
+    # Honour CPU affinity where the platform reports it
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Define function to work out which kind of pool to use
+def get_pool() -> str:
+    # Prefer the configured value, then the environment, then threads
+    pool = _settings['pool'] or os.environ.get(POOL_ENV, "thread")
+    # Fall back to threads for unknown values
+    return pool if pool in POOL_KINDS else "thread"
+
+
+# Define function to apply a function to every item using the worker pool
+def parallel_map(func, items) -> list:
+    """Return ``[func(item) for item in items]``, possibly computed in parallel.
+
+    Results always come back in input order so output stays deterministic.
+    Threads suit I/O-bound reads; a process pool also spreads YAML parsing
+    and matching over several CPUs, but ``func`` and the items must then be
+    picklable. The pool is started on first use and kept for later calls
+    until :func:`shutdown` (see :func:`worker_pool`).
+    """
+    # Materialize the items so they can be counted
+    items = list(items)
+    # Get the number of workers; more worker processes than CPUs only add overhead
+    jobs, kind = get_jobs(), get_pool()
+    if kind == "process":
+        jobs = min(jobs, _usable_cpus())
+    # Run sequentially when there is nothing to gain from workers
+    if jobs == 1 or len(items) < MIN_PARALLEL_ITEMS:
+        return [func(item) for item in items]
+    # Run the work on the shared pool, in chunks for worker processes
+    executor = _executor(kind, jobs)
+    if kind == "process":
+        chunksize = max(1, min(PROCESS_CHUNKSIZE, len(items) // jobs))
+        return list(executor.map(func, items, chunksize=chunksize))
+    return list(executor.map(func, items))
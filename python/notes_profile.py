@@ -0,0 +1,143 @@
+# Import sys module for writing the report to stderr
+import sys
+# Import time module for high-resolution phase timers
+import time
+
+# Define environment variable that turns profiling on when set to "1"
+PROFILE_ENV = "NOTES_PROFILE"
+# Define environment variable naming a file for a cProfile dump
+PROFILE_DUMP_ENV = "NOTES_PROFILE_DUMP"
+
+# Store whether profiling is on; hot paths check this flag before doing any work
+enabled = False
+# Store accumulated [seconds, calls] per phase and totals per counter
+_timers = {}
+_counters = {}
+# Store the lock guarding the totals, the optional cProfile profiler and the start time
+_lock = None
+_profiler = None
+_started = 0.0
+
+
+# Define class for a phase timer used as a context manager
+class _Phase:
+    # Keep instances small; one is created per timed call
+    __slots__ = ('name', 'start')
+
+    # Initialize the timer for a named phase
+    def __init__(self, name):
+        # Remember the phase name
+        self.name = name
+
+    # Start timing when entering the with-block
+    def __enter__(self):
+        # Record the start time
+        self.start = time.perf_counter()
+        return self
+
+    # Stop timing when leaving the with-block
+    def __exit__(self, exc_type, exc, tb):
+        # Add the elapsed time to the phase
+        add_time(self.name, time.perf_counter() - self.start)
+
+
+# Define class for the shared do-nothing timer used while profiling is off
+class _NullPhase:
+    # Do nothing when entering the with-block
+    def __enter__(self):
+        return self
+
+    # Do nothing when leaving the with-block
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+# Create the single do-nothing timer
+_NULL_PHASE = _NullPhase()
+
+
+# Define function that turns profiling on
+def start(dump=None):
+    """Start collecting timers and counters, and run cProfile too if ``dump`` names a file."""
+    global enabled, _lock, _profiler, _started
+    # Import threading here; worker threads update the totals concurrently
+    import threading
+    _lock = threading.Lock()
+    _timers.clear()
+    _counters.clear()
+    # Start cProfile when a dump file was requested
+    if dump:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    # Record the start time and switch the hooks on
+    _started = time.perf_counter()
+    enabled = True
+
+
+# Define function that times a phase
+def phase(name):
+    """Return a context manager that adds its duration to ``name``; free when profiling is off."""
+    # Hand out the shared no-op timer when profiling is off
+    return _Phase(name) if enabled else _NULL_PHASE
+
+
+# Define function that adds a measured duration to a phase
+def add_time(name, seconds):
+    # Ignore calls while profiling is off
+    if not enabled:
+        return
+    # Update the totals under the lock
+    with _lock:
+        totals = _timers.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+
+# Define function that increments a counter
+def count(name, n=1):
+    # Ignore calls while profiling is off
+    if not enabled:
+        return
+    # Update the counter under the lock
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+# Define function that returns the collected measurements
+def report() -> dict:
+    """Return ``{'total_s', 'phases': {name: {'seconds', 'calls'}}, 'counters'}``.
+
+    Phase times are summed over all worker threads, so with ``--jobs`` they
+    can add up to more than ``total_s``. Work done in a process pool is not
+    included.
+    """
+    # Copy the totals under the lock
+    with _lock:
+        phases = {name: {'seconds': round(seconds, 6), 'calls': calls}
+                  for name, (seconds, calls) in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+    # Return the report with the elapsed wall-clock time
+    return {'total_s': round(time.perf_counter() - _started, 6), 'phases': phases, 'counters': counters}
+
+
+# Define function that turns profiling off and writes the results
+def stop(dump=None, stream=None):
+    """Stop profiling, print the JSON report to stderr and write the cProfile dump, if any."""
+    global enabled, _profiler
+    # Nothing to do when profiling never started
+    if not enabled:
+        return None
+    # Stop cProfile and save its statistics
+    if _profiler is not None:
+        _profiler.disable()
+        if dump:
+            _profiler.dump_stats(dump)
+        _profiler = None
+    # Build the report, then switch the hooks off
+    result = report()
+    enabled = False
+    # Write the report as one JSON line
+    import json
+    print(json.dumps(result), file=stream or sys.stderr)
+    return result
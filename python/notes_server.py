@@ -0,0 +1,330 @@
+# Import base64 module for opaque pagination cursors
+import base64
+# Import gzip module for compressing responses
+import gzip
+# Import json module for request cursors and response bodies
+import json
+# Import re module for recognizing invalid search patterns
+import re
+# Import the standard library HTTP server
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# Import islice for cutting pages out of result streams
+from itertools import islice
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import URL helpers for parsing request paths
+from urllib.parse import parse_qs, unquote, urlsplit
+# Import the default notes directory
+from notes_utils import DEFAULT_NOTES_DIR
+# Import the store that answers every request, and its errors
+from notes_store import BlockingNotesStore, NoteNotFound, NoteReadError, report_to_stderr
+# Import the fields notes can be sorted by
+from notes_model import SORT_FIELDS
+
+# Define the address the server listens on by default; only this machine can connect
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Define the default and largest number of items per page
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Define the smallest body worth compressing
+GZIP_MIN_BYTES = 512
+
+
+# Define class for request errors that become JSON error responses
+class HTTPError(Exception):
+    # Initialize the error with a status code and message
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# Define helper that turns a pagination position into an opaque cursor
+def encode_cursor(position: dict) -> str:
+    # Encode the position as URL-safe base64 JSON without padding
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip("=")
+
+
+# Define helper that reads a cursor back
+def decode_cursor(cursor: str) -> dict:
+    # Restore the padding and decode, rejecting anything that is not a cursor
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPError(400, "Invalid cursor")
+    if not isinstance(position, dict):
+        raise HTTPError(400, "Invalid cursor")
+    return position
+
+
+# Define helper that computes the ETag of a note from its stamp
+def note_etag(stamp) -> str:
+    """Return a weak ETag from a note's stamp (mtime, size and inode for note files); the note
+    does not have to be read."""
+    # Weak, since gzip and identity encodings of the note share it
+    return 'W/"' + '-'.join(f"{part:x}" for part in stamp) + '"'
+
+
+# Define helper that turns a note record into its JSON form
+def note_item(filename: str, meta) -> dict:
+    # Use the header as written, plus the note's ID and filename
+    return {**meta.to_dict(), 'id': meta.note_id, 'filename': filename}
+
+
+# Define helper that cuts one page out of a filename-ordered stream
+def _page_after(stream, limit):
+    """Return ``(items, next_after)`` for the first ``limit`` notes of a stream that already
+    starts after the cursor's filename."""
+    # Fetch one extra note to see whether more follow
+    try:
+        items = list(islice(stream, limit + 1))
+    # Stop scanning as soon as the page is full
+    finally:
+        stream.close()
+    # Point the next cursor at the last note of this page, if there is more
+    more = len(items) > limit
+    items = items[:limit]
+    return items, items[-1][0] if more and items else None
+
+
+# Define class that handles one HTTP request
+class NotesRequestHandler(BaseHTTPRequestHandler):
+    """Serve notes as JSON: ``/notes``, ``/notes/<id>``, ``/search`` and ``/stats``.
+
+    ``/notes`` takes ``sort`` (modified, created or title) and ``desc``.
+    Lists are paginated with opaque cursors; ``next`` in a response is the
+    cursor of the following page, or null on the last one. Each note has
+    an ETag derived from its stamp (mtime, size and inode for note files),
+    so ``If-None-Match`` is answered with 304 after a single stat call.
+    Clients that accept gzip get compressed bodies.
+    """
+
+    # Keep connections open between requests
+    protocol_version = "HTTP/1.1"
+    # Identify the server in responses
+    server_version = "FutureProofNotes"
+    # Send headers and body without waiting for ACKs; with Nagle, keep-alive replies stall ~40 ms
+    disable_nagle_algorithm = True
+
+    # Define method that answers GET requests
+    def do_GET(self):
+        # Route the request and send its JSON reply, turning failures into error responses
+        try:
+            url = urlsplit(self.path)
+            params = parse_qs(url.query)
+            status, body, headers = self._route(url.path, params)
+        except HTTPError as e:
+            status, body, headers = e.status, {'error': str(e)}, {}
+        except NoteReadError as e:
+            status, body, headers = 422, {'error': str(e)}, {}
+        # Keep the connection usable after unexpected failures
+        except Exception as e:
+            self.log_error("Request failed: %r", e)
+            status, body, headers = 500, {'error': "Internal server error"}, {}
+        self._send(status, body, headers)
+
+    # Define helper that picks the handler for a path
+    def _route(self, path: str, params: dict):
+        # Dispatch on the path
+        if path in ("/notes", "/notes/"):
+            return self._list(params)
+        if path.startswith("/notes/"):
+            return self._note(unquote(path[len("/notes/"):]))
+        if path == "/search":
+            return self._search(params)
+        if path == "/stats":
+            return 200, self.server.store.stats(), {}
+        raise HTTPError(404, f"No route for {path}")
+
+    # Define method that lists notes a page at a time
+    def _list(self, params: dict):
+        # Read the filters, the order and the page position
+        limit = _page_size(params)
+        position = _cursor_position(params)
+        tags, any_tags, exclude_tags = params.get('tag'), params.get('any_tag', ()), params.get('exclude_tag', ())
+        sort = params.get('sort', [None])[0]
+        if sort is not None and sort not in SORT_FIELDS:
+            raise HTTPError(400, f"sort must be one of: {', '.join(SORT_FIELDS)}")
+        descending = _flag(params, 'desc')
+        store = self.server.store
+        # Sorted lists come from the sort index, so page through them by offset
+        if sort or descending:
+            offset = _cursor_offset(position)
+            items = store.list(tags, offset, limit + 1, any_tags, exclude_tags, sort, descending)
+            next_position = {'offset': offset + limit} if len(items) > limit else None
+            items = items[:limit]
+        # Other lists come in filename order, so continue after the last note
+        else:
+            stream = store.iter_notes(tags, any_tags=any_tags, exclude_tags=exclude_tags,
+                                      after=_cursor_after(position))
+            items, next_after = _page_after(stream, limit)
+            next_position = {'after': next_after} if next_after else None
+        # Return the page with the cursor of the next one
+        return 200, {
+            'items': [note_item(filename, meta) for filename, meta in items],
+            'next': encode_cursor(next_position) if next_position else None,
+        }, {}
+
+    # Define method that returns one note
+    def _note(self, note_id: str):
+        # Stamp the note; the stamp is the ETag
+        store = self.server.store
+        try:
+            etag = note_etag(store.stamp(note_id))
+        except NoteNotFound as e:
+            raise HTTPError(404, str(e))
+        # Answer a matching If-None-Match without reading the file
+        if _etag_matches(self.headers.get('If-None-Match', ""), etag):
+            return 304, None, {'ETag': etag}
+        # Read and return the note
+        try:
+            meta, content = store.read(note_id)
+        except NoteNotFound as e:
+            raise HTTPError(404, str(e))
+        return 200, {**note_item(meta.filename, meta), 'content': content}, {'ETag': etag}
+
+    # Define method that searches notes a page at a time
+    def _search(self, params: dict):
+        # Read the query, the mode and the page position
+        query = params.get('q', [""])[0]
+        if not query:
+            raise HTTPError(400, "Missing query parameter 'q'")
+        ranked, regex = _flag(params, 'ranked'), _flag(params, 'regex')
+        limit = _page_size(params)
+        position = _cursor_position(params)
+        store = self.server.store
+        # Ranked hits are ordered by score, so page through them by offset
+        if ranked:
+            offset = _cursor_offset(position)
+            items = store.search(query, ranked=True, offset=offset, limit=limit + 1)
+            next_position = {'offset': offset + limit} if len(items) > limit else None
+            items = items[:limit]
+        # Other matches come in filename order, so continue after the last one
+        else:
+            # Invalid patterns are the client's fault
+            try:
+                stream = store.iter_search(query, regex=regex, after=_cursor_after(position))
+                items, next_after = _page_after(stream, limit)
+            except re.error as e:
+                raise HTTPError(400, f"Invalid regular expression: {e}")
+            next_position = {'after': next_after} if next_after else None
+        # Return the page with the cursor of the next one
+        return 200, {
+            'items': [note_item(filename, meta) for filename, meta in items],
+            'next': encode_cursor(next_position) if next_position else None,
+        }, {}
+
+    # Define helper that writes a JSON response
+    def _send(self, status: int, body, headers: dict):
+        # Serialize the body; datetimes and other YAML scalars become strings
+        data = b"" if body is None else json.dumps(body, default=str).encode('utf-8')
+        # Compress larger bodies for clients that accept gzip
+        gzipped = len(data) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', "")
+        if gzipped:
+            data = gzip.compress(data, compresslevel=5)
+        # Send the status line and headers
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', "application/json; charset=utf-8")
+        if gzipped:
+            self.send_header('Content-Encoding', "gzip")
+        self.send_header('Vary', "Accept-Encoding")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        # Send the body
+        self.wfile.write(data)
+
+    # Define method that logs requests, unless the server is quiet
+    def log_message(self, format, *args):
+        # Leave logging to the base class only when asked for
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+# Define helper that reads the page size parameter
+def _page_size(params: dict) -> int:
+    # Default to a moderate page and cap what clients can ask for
+    try:
+        limit = int(params.get('limit', [DEFAULT_PAGE_SIZE])[0])
+    except ValueError:
+        raise HTTPError(400, "limit must be an integer")
+    if limit < 1:
+        raise HTTPError(400, "limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# Define helper that reads the cursor parameter
+def _cursor_position(params: dict) -> dict:
+    # Start at the beginning when there is no cursor
+    cursor = params.get('cursor', [""])[0]
+    return decode_cursor(cursor) if cursor else {}
+
+
+# Define helper that reads the offset of a cursor for lists paged by position
+def _cursor_offset(position: dict) -> int:
+    # Start at the beginning, rejecting anything that is not a position
+    offset = position.get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPError(400, "Invalid cursor")
+    return offset
+
+
+# Define helper that reads the last filename of a cursor for lists paged by filename
+def _cursor_after(position: dict):
+    # Start at the beginning, rejecting anything that is not a filename
+    after = position.get('after')
+    if after is not None and not isinstance(after, str):
+        raise HTTPError(400, "Invalid cursor")
+    return after
+
+
+# Define helper that reads a boolean query parameter
+def _flag(params: dict, name: str) -> bool:
+    # Accept the usual spellings of "true"
+    return params.get(name, ["0"])[0].lower() in ("1", "true", "yes")
+
+
+# Define helper that checks an ETag against an If-None-Match header
+def _etag_matches(header: str, etag: str) -> bool:
+    # "*" matches any existing note
+    if header.strip() == "*":
+        return True
+    # Compare weakly, ignoring the W/ prefix on either side (RFC 9110, section 13.1.2)
+    def opaque(tag):
+        return tag[2:] if tag.startswith("W/") else tag
+    return opaque(etag) in {opaque(tag.strip()) for tag in header.split(",")}
+
+
+# Define class for the HTTP server bound to a notes directory
+class NotesHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering requests from a :class:`BlockingNotesStore`."""
+
+    # Let worker threads die with the server
+    daemon_threads = True
+
+    # Initialize the server for a notes directory
+    def __init__(self, address, notes_dir: Path = DEFAULT_NOTES_DIR, quiet=False):
+        # Keep the store shared by all request threads
+        self.store = BlockingNotesStore(notes_dir, report=report_to_stderr)
+        self.quiet = quiet
+        super().__init__(address, NotesRequestHandler)
+
+
+# Define function that runs the server in the foreground
+def serve(notes_dir: Path = DEFAULT_NOTES_DIR, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    # Bind the server, reporting ports that are taken
+    try:
+        server = NotesHTTPServer((host, port), notes_dir)
+    except OSError as e:
+        print(f"Cannot start server: {e}")
+        return
+    print(f"Serving {Path(notes_dir)} on http://{host}:{server.server_address[1]}/", flush=True)
+    # Serve until interrupted
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
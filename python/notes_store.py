@@ -0,0 +1,626 @@
+# Import heapq module for picking the first notes of a sorted order without sorting them all
+import heapq
+# Import os module for building lock keys
+import os
+# Import re module for regular expression search
+import re
+# Import sys module for reporting errors on stderr
+import sys
+# Import threading module for the per-note write locks
+import threading
+# Import contextmanager for the lock and editing helpers
+from contextlib import contextmanager
+# Import lru_cache for compiling each search pattern once and partial for executor calls
+from functools import lru_cache, partial
+# Import islice for applying offset and limit to streamed results
+from itertools import islice
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import utility functions from notes_utils module
+from notes_utils import (
+    NOTE_EXT, DEFAULT_NOTES_DIR, iso_now, generate_note_filename,
+    search_haystack, load_note, load_note_bytes
+)
+# Import the worker pool helper
+from notes_parallel import parallel_map
+# Import the optional per-phase profiler
+import notes_profile
+# Import the storage backends
+from notes_backend import FILES, open_backend
+# Import the byte-level substring matchers
+from notes_match import match_note_bytes, match_note_file
+# Import the compact metadata record handed out by list and search
+from notes_model import NoteMeta
+
+# Define how many note files search reads and checks per batch while streaming
+SEARCH_BATCH = 256
+# Define how many fresh filenames create tries before giving up
+CREATE_ATTEMPTS = 16
+
+# Map (notes directory, filename) to [lock, number of holders and waiters]
+_note_locks = {}
+# Guard the lock table itself
+_note_locks_guard = threading.Lock()
+
+
+# Define class for errors about notes that do not exist
+class NoteNotFound(LookupError):
+    """Raised when a note ID does not name a note file."""
+
+    # Initialize the error with the requested ID
+    def __init__(self, note_id, message=None):
+        # Keep the ID and the message the CLI prints
+        super().__init__(message or f"Note '{note_id}' not found.")
+        self.note_id = note_id
+
+
+# Define class for errors about names that fit several notes
+class AmbiguousNote(NoteNotFound):
+    """Raised when a title or ID prefix refers to more than one note."""
+
+    # Initialize the error with the requested name and the notes it fits
+    def __init__(self, note_id, candidates):
+        # Keep the candidates and list them in the message the CLI prints
+        super().__init__(note_id, f"Note '{note_id}' is ambiguous; it could be: {', '.join(candidates)}")
+        self.candidates = candidates
+
+
+# Define class for errors about note files that cannot be parsed
+class NoteReadError(ValueError):
+    """Raised when a note file exists but cannot be read or parsed."""
+
+
+# Define helper that holds the write lock of one note
+@contextmanager
+def note_lock(notes_dir: Path, filename: str):
+    """Serialize writers of one note; readers never wait, since writes replace files atomically."""
+    # Find or create the lock, counting this user so idle locks can be dropped
+    key = (os.path.abspath(notes_dir), filename)
+    with _note_locks_guard:
+        entry = _note_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    # Hold the lock for the duration of the block
+    try:
+        with entry[0]:
+            yield
+    # Drop the lock once nobody holds or waits for it
+    finally:
+        with _note_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _note_locks[key]
+
+
+# Define helper that applies offset/limit to a stream and stops it early
+def _paginate(stream, offset=0, limit=None):
+    # Skip the first `offset` results and stop after `limit` more
+    try:
+        yield from islice(stream, offset, None if limit is None else offset + limit)
+    # Close the underlying generator so it stops scanning right away
+    finally:
+        stream.close()
+
+
+# Define helper that sorts a stream of records, keeping only the requested page
+def _top_k(stream, sort, descending=False, offset=0, limit=None):
+    """Yield the ``(filename, NoteMeta)`` pairs of ``stream`` ordered by ``sort`` (or just the
+    filename when None), ties by filename.
+
+    Used when no index holds the order: with a ``limit`` only the first
+    ``offset + limit`` records are kept, on a heap, instead of sorting
+    everything.
+    """
+    # Compare the precomputed keys, then the filenames
+    def key(item):
+        return (item[1].sort_key(sort), item[0]) if sort else item[0]
+    # Keep the page on a heap, or sort everything when there is no limit
+    try:
+        if limit is None:
+            ordered = sorted(stream, key=key, reverse=descending)
+        else:
+            ordered = (heapq.nlargest if descending else heapq.nsmallest)(offset + limit, stream, key=key)
+    # Close the underlying generator even when sorting fails
+    finally:
+        stream.close()
+    yield from ordered[offset:]
+
+
+# Define helper that turns a stream of parsed headers into compact records
+def _records(stream):
+    # Convert each note as it is yielded
+    try:
+        for filename, meta in stream:
+            yield filename, NoteMeta.from_meta(filename, meta)
+    # Close the underlying generator so it stops scanning right away
+    finally:
+        stream.close()
+
+
+# Define helper that compiles search patterns once per process
+@lru_cache(maxsize=32)
+def _compile_search_regex(query: str):
+    # Compile the pattern case-insensitively
+    return re.compile(query, re.IGNORECASE)
+
+
+# Define helper that checks lowercased note text against a query
+def _haystack_matches(haystack, query, regex) -> bool:
+    # Use a regex search or a substring check
+    if regex:
+        return _compile_search_regex(query).search(haystack) is not None
+    return query.lower() in haystack
+
+
+# Define worker that reads one note and checks it against a query
+def _match_note(task):
+    """Return ``(meta, matched, error)`` for a ``(source, query, regex)`` task.
+
+    ``source`` is a note file, or ``(filename, bytes)`` for a note held in a
+    packfile. Runs on the worker pool, so it must not print and must stay
+    picklable.
+    """
+    # Unpack the task
+    source, query, regex = task
+    # Search substrings in the raw bytes; regexes can anchor anywhere in the haystack and
+    # line breaks are translated when decoding, so those read the whole note
+    substring = not regex and "\n" not in query and "\r" not in query
+    # Match records of a packfile in memory
+    if isinstance(source, tuple):
+        name, data = source
+        if substring:
+            return match_note_bytes(name, data or b"", query)
+        meta, content, error = load_note_bytes(name, data or b"")
+    # Match note files a chunk at a time
+    elif substring:
+        return match_note_file(source, query)
+    # Read metadata and content from the note file
+    else:
+        meta, content, error = load_note(source)
+    # Report corrupted files to the caller
+    if meta is None:
+        return None, False, error
+    # Time lowercasing and matching separately when profiling
+    if notes_profile.enabled:
+        with notes_profile.phase('lowercase'):
+            haystack = search_haystack(meta, content)
+        with notes_profile.phase('match'):
+            matched = _haystack_matches(haystack, query, regex)
+    else:
+        # Create searchable text by combining title, tags, and content (all lowercase)
+        haystack = search_haystack(meta, content)
+        # Check the haystack with a regex search or a substring check
+        matched = _haystack_matches(haystack, query, regex)
+    # Return the metadata and whether it matched
+    return meta, matched, error
+
+
+# Define class with the blocking implementation of every store operation
+class BlockingNotesStore:
+    """Create, read, update, delete, list, search and summarize notes.
+
+    Nothing here prints or prompts: results are returned, failures are
+    raised as :class:`NoteNotFound` or :class:`NoteReadError`, and notes
+    skipped while scanning go to ``report`` (``print`` by default). Notes
+    are kept by the backend recorded in the notes directory (see
+    :mod:`notes_backend`). Writes replace notes atomically under a per-note
+    lock, so concurrent writers of one note take turns while readers carry
+    on. Each call opens its own index connection, so calls may run on any
+    thread.
+    """
+
+    # Initialize the store for a notes directory
+    def __init__(self, notes_dir: Path = DEFAULT_NOTES_DIR, report=None):
+        # Remember the notes directory and where read errors go
+        self.notes_dir = Path(notes_dir)
+        self.report = report or print
+
+    # Define helper that opens the metadata cache and search index
+    def _open_index(self):
+        # Import the index on first use so commands like `read` do not load SQLite
+        from notes_index import NotesIndex
+        return NotesIndex(self.notes_dir, report=self.report)
+
+    # Define helper that opens the backend storing the notes
+    def _backend(self):
+        # Read the marker on every call; the directory may have been migrated meanwhile
+        return open_backend(self.notes_dir)
+
+    # Define helper that resolves a note ID to an existing note
+    def _existing(self, note_id: str):
+        """Return ``(backend, filename)`` for ``note_id``.
+
+        ``note_id`` is a filename, with or without extension, a unique
+        prefix of one, or a note title (exact, or in any case). Names ending
+        in the extension are only taken as filenames. Raises
+        :class:`NoteNotFound`, or :class:`AmbiguousNote` when it fits
+        several notes.
+        """
+        # Accept IDs without the extension as well; an exact ID needs one check and no index
+        filename = note_id if note_id.endswith(NOTE_EXT) else note_id + NOTE_EXT
+        backend = self._backend()
+        if backend.exists(filename):
+            return backend, filename
+        # Full filenames are never titles or prefixes, so they need no lookup either
+        if note_id.endswith(NOTE_EXT):
+            raise NoteNotFound(note_id)
+        # Otherwise look the name up by title and ID prefix
+        return backend, self._resolve(backend, note_id)
+
+    # Define helper that looks up a note by title or ID prefix
+    def _resolve(self, backend, note_id: str) -> str:
+        """Return the filename ``note_id`` names according to the cache.
+
+        Only the matches are re-checked (one stat each), so a name that fits
+        nothing, such as a typo, costs no rescan. Notes added by other
+        programs are found once the cache has caught up: after any listing
+        or search, or an explicit :meth:`refresh`.
+        """
+        # Ask the cache first, then check the matches have not changed since they were cached
+        with self._open_index() as index:
+            candidates = index.resolve(note_id)
+            stale = index.stale(candidates)
+            # A changed match may have been retitled, and others retitled to this name, so a stale match
+            # means the cache is behind: rescan, and re-check the stale notes for the daemon's cache
+            if stale:
+                index.refresh()
+                index.apply_changes(stale)
+                candidates = index.resolve(note_id)
+        # Refuse names that fit nothing or several notes
+        if not candidates:
+            raise NoteNotFound(note_id)
+        if len(candidates) > 1:
+            raise AmbiguousNote(note_id, candidates)
+        return candidates[0]
+
+    # Define helper that reads and parses a whole note
+    def _load(self, backend, filename: str):
+        # Raise the reader's message for unreadable notes
+        meta, content, error = backend.load(filename)
+        if meta is None:
+            raise NoteReadError(error)
+        return meta, content
+
+    # Define helper that stores a changed note and refreshes its index entry
+    def _replace(self, backend, filename: str, meta: dict, content: str):
+        # Call with the note's lock held; bump the modified timestamp
+        meta['modified'] = iso_now()
+        backend.write(filename, meta, content)
+        with self._open_index() as index:
+            index.update_note(filename)
+
+    # Define method that catches the cache up with changes made by other programs
+    def refresh(self):
+        """Re-check every note against the cache, so names changed elsewhere resolve."""
+        # Compare the stamp of every note and re-parse the changed ones
+        with self._open_index() as index:
+            index.refresh()
+
+    # Define method that returns the stamp of a note
+    def stamp(self, note_id: str) -> tuple:
+        """Return a tuple that changes whenever the note does, without reading it.
+
+        For note files this is ``(mtime_ns, size, inode)``.
+        """
+        # Ask the backend, raising for notes that do not exist
+        backend, filename = self._existing(note_id)
+        stamp = backend.stamp(filename)
+        if stamp is None:
+            raise NoteNotFound(note_id)
+        return stamp
+
+    # Define method that writes a new note
+    def create(self, title: str, tags=(), content: str = "", fields=None):
+        """Write a new note and index it; return ``(filename, NoteMeta)``."""
+        # Refuse notes without a title
+        title = title.strip()
+        if not title:
+            raise ValueError("Title cannot be empty.")
+        # Build the header: custom fields first, then the standard ones
+        created = iso_now()
+        metadata = dict(fields or {})
+        metadata.update({'created': created, 'modified': created, 'tags': list(tags), 'title': title})
+        backend = self._backend()
+        # Pick a filename nobody has taken, holding its lock while writing
+        for _ in range(CREATE_ATTEMPTS):
+            filename = generate_note_filename(title)
+            with note_lock(self.notes_dir, filename):
+                # Create the note exclusively; another process may have taken the name
+                try:
+                    backend.create(filename, metadata, content)
+                except FileExistsError:
+                    continue
+                # Add the new note to the search index
+                with self._open_index() as index:
+                    index.update_note(filename)
+            return filename, NoteMeta.from_meta(filename, metadata)
+        raise FileExistsError(f"No free filename for '{title}'")
+
+    # Define method that reads a whole note
+    def read(self, note_id: str):
+        """Return ``(NoteMeta, content)``."""
+        # Parse the note
+        backend, filename = self._existing(note_id)
+        meta, content = self._load(backend, filename)
+        return NoteMeta.from_meta(filename, meta), content
+
+    # Define method that reads only the body of a note
+    def read_body(self, note_id: str) -> str:
+        # Skip the header without parsing YAML, raising the reader's message on failure
+        backend, filename = self._existing(note_id)
+        content, error = backend.load_body(filename)
+        if content is None:
+            raise NoteReadError(error)
+        return content
+
+    # Define method that changes a note
+    def update(self, note_id: str, title=None, tags=None, content=None, fields=None):
+        """Apply the given changes, bump ``modified`` and re-index; return the new ``NoteMeta``.
+
+        With no changes, the note is re-read as it is on disk (e.g. after an
+        editor changed it) and only ``modified`` moves.
+        """
+        # Hold the note's lock across read, change and write, so no update is lost
+        backend, filename = self._existing(note_id)
+        with note_lock(self.notes_dir, filename):
+            meta, old_content = self._load(backend, filename)
+            # Apply the requested changes
+            meta.update(fields or {})
+            if title is not None:
+                meta['title'] = title
+            if tags is not None:
+                meta['tags'] = list(tags)
+            # Store the note and refresh its index entry
+            self._replace(backend, filename, meta, old_content if content is None else content)
+        return NoteMeta.from_meta(filename, meta)
+
+    # Define method that lets an editor change a note
+    @contextmanager
+    def editing(self, note_id: str):
+        """Yield a ``.note`` file for an editor, then store what it holds with ``modified`` bumped.
+
+        Note files are edited in place. Notes in a packfile are copied to a
+        temporary file, read back when the block ends and stored as a new
+        version. Raises :class:`NoteReadError` if the editor left the note
+        unreadable; a packed note then keeps its previous version.
+        """
+        # Edit note files where they are, then re-read them like any outside change
+        backend, filename = self._existing(note_id)
+        if backend.name == FILES:
+            yield backend.layout.path(filename)
+            self.update(filename)
+            return
+        # Check other notes out to a temporary file that keeps the note's filename
+        import tempfile
+        with tempfile.TemporaryDirectory(prefix="notes-edit-") as directory:
+            filepath = Path(directory) / filename
+            filepath.write_bytes(backend.read_raw(filename))
+            yield filepath
+            # Store the edited note unless the editor broke it
+            meta, content, error = load_note(filepath)
+            if meta is None:
+                raise NoteReadError(error)
+            with note_lock(self.notes_dir, filename):
+                self._replace(backend, filename, meta, content)
+
+    # Define method that deletes a note
+    def delete(self, note_id: str) -> str:
+        """Delete a note and return its filename."""
+        # Remove the note under its lock, then drop it from the index
+        backend, filename = self._existing(note_id)
+        with note_lock(self.notes_dir, filename):
+            try:
+                backend.delete(filename)
+            # Another process may have deleted it first
+            except FileNotFoundError:
+                raise NoteNotFound(note_id)
+            with self._open_index() as index:
+                index.remove_note(filename)
+        return filename
+
+    # Define generator that streams notes with optional tag filtering
+    def iter_notes(self, filter_tag=None, offset=0, limit=None, any_tags=(), exclude_tags=(),
+                   sort=None, descending=False, after=None):
+        """Yield ``(filename, NoteMeta)`` pairs as the notes directory is scanned.
+
+        ``filter_tag`` may be one tag or a list of tags that must all be
+        present; ``any_tags`` and ``exclude_tags`` add OR and NOT conditions.
+        Notes come in filename order unless ``sort`` names one of
+        :data:`notes_model.SORT_FIELDS`; ``descending`` reverses the order.
+        In filename order, ``after`` skips every note up to that filename
+        without reading it.
+        """
+        # Accept a single tag or a list of required tags
+        all_tags = [filter_tag] if isinstance(filter_tag, str) else list(filter_tag or [])
+        # Open the metadata cache for the duration of the stream
+        with self._open_index() as index:
+            # Answer tag queries and sorted listings from the index once it is up to date
+            if all_tags or any_tags or exclude_tags or sort or descending:
+                index.refresh()
+                yield from _records(index.query_tags(all_tags, list(any_tags), list(exclude_tags),
+                                                     offset, limit, sort, descending, after))
+            # Otherwise yield notes as soon as their batch has been refreshed
+            else:
+                yield from _records(_paginate(index.iter_sync(after=after), offset, limit))
+
+    # Define method that lists notes
+    def list(self, filter_tag=None, offset=0, limit=None, any_tags=(), exclude_tags=(),
+             sort=None, descending=False, after=None) -> list:
+        # Collect the streamed notes into a list
+        return list(self.iter_notes(filter_tag, offset, limit, any_tags, exclude_tags, sort, descending, after))
+
+    # Define generator that streams notes matching a query
+    def iter_search(self, query: str, ranked=False, regex=False, offset=0, limit=None,
+                    sort=None, descending=False, after=None):
+        """Yield ``(filename, NoteMeta)`` for matching notes as they are found.
+
+        With ``sort`` the matches are ordered by that field instead, which
+        means waiting for the search to finish. Unranked matches come in
+        filename order, and ``after`` skips every note up to that filename
+        without reading it.
+        """
+        # Order the matches by the requested field, keeping only the page on a heap
+        if sort or descending:
+            yield from _top_k(_records(self._search_stream(query, ranked, regex, after)),
+                              sort, descending, offset, limit)
+            return
+        # Apply offset and limit to the unpaginated stream of matches
+        yield from _records(_paginate(self._search_stream(query, ranked, regex, after), offset, limit))
+
+    # Define method that searches notes
+    def search(self, query: str, ranked=False, regex=False, offset=0, limit=None,
+               sort=None, descending=False, after=None) -> list:
+        # Collect the streamed matches into a list
+        return list(self.iter_search(query, ranked, regex, offset, limit, sort, descending, after))
+
+    # Define helper generator that produces every match of a query
+    def _search_stream(self, query, ranked, regex, after=None):
+        # Answer ranked queries from the inverted index instead of scanning files
+        if ranked:
+            with self._open_index() as index:
+                hits = index.search(query)
+            # Drop the scores, keeping the best matches first
+            for filename, meta, _ in hits:
+                yield filename, meta
+            return
+        # Track corrupted files
+        corrupted_files = []
+        # If the query is a regular expression
+        if regex:
+            # Compile the pattern up front to fail on invalid patterns once
+            _compile_search_regex(query)
+            # Collect the literal text every match must contain for the prefilter
+            from notes_index import regex_literals
+            literals = regex_literals(query)
+        # Otherwise the whole lowercased query must appear in every match
+        else:
+            literals = [query.lower()]
+
+        # Ask the trigram index which notes can possibly match
+        with self._open_index() as index:
+            candidates = index.candidates(literals, after)
+            # Remember corrupted files the index skipped while refreshing
+            corrupted_files.extend(index.corrupted)
+        backend = index.backend
+        # Fall back to checking every note when there is no prefilter
+        if candidates is None:
+            with notes_profile.phase('scan'):
+                names = sorted(entry.name for entry in backend.scan() if not after or entry.name > after)
+            notes_profile.count('files_scanned', len(names))
+        # Otherwise only read the candidates
+        else:
+            names = candidates
+
+        # Warn about corrupted files seen so far, even if the caller stops early
+        try:
+            # Check the notes one batch at a time so matches stream out early
+            for start in range(0, len(names), SEARCH_BATCH):
+                batch = names[start:start + SEARCH_BATCH]
+                # Read and check the batch, possibly on a worker pool
+                checked = parallel_map(_match_note, [(source, query, regex)
+                                                     for source in backend.match_sources(batch)])
+                # Iterate through the outcomes in filename order
+                for filename, (meta, matched, error) in zip(batch, checked):
+                    # Report read errors in a deterministic order
+                    if error:
+                        self.report(error)
+                    # Skip this note if metadata couldn't be read (corrupted)
+                    if meta is None:
+                        corrupted_files.append(filename)
+                        continue
+                    # Yield filename and metadata tuple when the query matched
+                    if matched:
+                        yield filename, meta
+        finally:
+            # Warn about corrupted files if any were found
+            if corrupted_files:
+                self.report(f"Warning: Skipped {len(corrupted_files)} corrupted file(s): "
+                            f"{', '.join(corrupted_files)}")
+
+    # Define method that summarizes the notes
+    def stats(self) -> dict:
+        """Return ``{'count': number of notes, 'tags': {tag: number of notes}}``.
+
+        The usual stamp check picks up notes changed by other programs (the
+        daemon's watcher does it when the daemon runs); only changed notes
+        are re-parsed. The answer then comes from the counts the index
+        keeps, in time proportional to the number of tags.
+        """
+        # Read the note count and the precomputed tag counts from the index
+        with self._open_index() as index:
+            # Make sure the index reflects what is on disk
+            index.refresh()
+            return {'count': index.count(), 'tags': index.tag_counts()}
+
+
+# Define helper that reports skipped files of library calls on stderr
+def report_to_stderr(message: str):
+    # Keep stdout free for the embedding program
+    print(message, file=sys.stderr)
+
+
+# Define class with the asyncio API of the store
+class NotesStore:
+    """Asyncio front end of :class:`BlockingNotesStore` for embedding in servers.
+
+    Every call runs the blocking operation in ``executor`` (the loop's
+    default thread pool when None), so file I/O and SQLite never block the
+    event loop. Reads run concurrently with each other and with writes;
+    writes of the same note are serialized by per-note locks.
+    """
+
+    # Initialize the store for a notes directory
+    def __init__(self, notes_dir: Path = DEFAULT_NOTES_DIR, executor=None, report=None):
+        # Keep the blocking implementation and the executor it runs on
+        self.blocking = BlockingNotesStore(notes_dir, report or report_to_stderr)
+        self.executor = executor
+
+    # Define property for the notes directory
+    @property
+    def notes_dir(self) -> Path:
+        return self.blocking.notes_dir
+
+    # Define helper that runs a blocking operation in the executor
+    async def _call(self, func, *args, **kwargs):
+        # Import asyncio only here, so the CLI never pays for loading it
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    # Define coroutine that writes a new note
+    async def create(self, title: str, tags=(), content: str = "", fields=None):
+        return await self._call(self.blocking.create, title, tags, content, fields)
+
+    # Define coroutine that reads a whole note
+    async def read(self, note_id: str):
+        return await self._call(self.blocking.read, note_id)
+
+    # Define coroutine that reads only the body of a note
+    async def read_body(self, note_id: str) -> str:
+        return await self._call(self.blocking.read_body, note_id)
+
+    # Define coroutine that changes a note
+    async def update(self, note_id: str, title=None, tags=None, content=None, fields=None):
+        return await self._call(self.blocking.update, note_id, title, tags, content, fields)
+
+    # Define coroutine that deletes a note
+    async def delete(self, note_id: str) -> str:
+        return await self._call(self.blocking.delete, note_id)
+
+    # Define coroutine that lists notes
+    async def list(self, filter_tag=None, offset=0, limit=None, any_tags=(), exclude_tags=(),
+                   sort=None, descending=False, after=None) -> list:
+        return await self._call(self.blocking.list, filter_tag, offset, limit, any_tags, exclude_tags,
+                                sort, descending, after)
+
+    # Define coroutine that searches notes
+    async def search(self, query: str, ranked=False, regex=False, offset=0, limit=None,
+                     sort=None, descending=False, after=None) -> list:
+        return await self._call(self.blocking.search, query, ranked, regex, offset, limit, sort, descending,
+                                after)
+
+    # Define coroutine that summarizes the notes
+    async def stats(self) -> dict:
+        return await self._call(self.blocking.stats)
+
+    # Define coroutine that catches the cache up with changes made by other programs
+    async def refresh(self):
+        return await self._call(self.blocking.refresh)
@@ -1,14 +1,56 @@
-# Import yaml module for YAML parsing and dumping
-import yaml
 # Import datetime module for timestamp operations
 import datetime
-# Import uuid module for generating unique identifiers
-import uuid
+# Import os module for renames and flushing files to disk
+import os
+# Import stat module for copying file permissions
+import stat
+# Import threading module for handing out note IDs from one clock
+import threading
+# Import time module for profiling timers and note IDs
+import time
 # Import Path class from pathlib for cross-platform path handling
 from pathlib import Path
+# Import the optional per-phase profiler
+import notes_profile
 
 # Define constant for note file extension
 NOTE_EXT = ".note"
+# Define the default notes directory, next to the python/ folder
+DEFAULT_NOTES_DIR = Path(__file__).parent.parent / "notes_repository"
+
+# Define the digits of note ID suffixes: Crockford's base32, lowercase, without i, l, o and u
+ID_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+# Define how many bits of the ID suffix hold the process ID (Linux allows at most 2**22 processes)
+ID_PID_BITS = 22
+
+# Cache the yaml module with its loader and dumper once something needs them
+_yaml = None
+# Remember the last microsecond handed out in a note ID, so every ID of this process is later
+_last_id_time = 0
+# Guard the ID clock across threads
+_id_lock = threading.Lock()
+
+# Define helper that imports PyYAML on first use
+def _load_yaml():
+    """Return ``(yaml, Loader, Dumper)``, importing PyYAML the first time.
+
+    Importing yaml is a large share of CLI startup, so commands that never
+    parse or write a header do not pay for it.
+    """
+    global _yaml
+    # Import the module only once
+    if _yaml is None:
+        # Time the import on its own so it does not inflate the first parse
+        with notes_profile.phase('import_yaml'):
+            import yaml
+            # Prefer libyaml's C loader and dumper, falling back to the pure Python ones
+            try:
+                from yaml import CSafeLoader as loader, CSafeDumper as dumper
+            except ImportError:
+                from yaml import SafeLoader as loader, SafeDumper as dumper
+        _yaml = (yaml, loader, dumper)
+    # Return the cached module, loader and dumper
+    return _yaml
 
 # Define function to get current timestamp in ISO format
 def iso_now():
@@ -22,53 +64,221 @@ def sanitize_filename(name: str) -> str:
     # Replace invalid characters with underscore and spaces with underscore
     return ''.join(c if c in valid_chars else '_' for c in name).replace(' ', '_')
 
+# Define function that returns a suffix no other note ID has
+def unique_id() -> str:
+    """Return 15 base32 digits that differ for every call, in every process on this machine.
+
+    The digits encode a microsecond timestamp that never repeats within a
+    process, followed by the process ID, so no directory has to be
+    scanned. IDs made later sort after earlier ones.
+    """
+    global _last_id_time
+    # Take the current microsecond, moving past the last one handed out if the clock has not
+    with _id_lock:
+        _last_id_time = max(time.time_ns() // 1000, _last_id_time + 1)
+        value = (_last_id_time << ID_PID_BITS) | (os.getpid() & ((1 << ID_PID_BITS) - 1))
+    # Write the value in base32, most significant digit first
+    digits = []
+    for _ in range(15):
+        value, digit = divmod(value, 32)
+        digits.append(ID_ALPHABET[digit])
+    return ''.join(reversed(digits))
+
 # Define function to generate unique filename from title
 def generate_note_filename(title: str) -> str:
     # Sanitize the title to make it filename-safe
     sanitized = sanitize_filename(title)
-    # Generate 2-character unique ID from UUID hex string
-    unique_id = uuid.uuid4().hex[:2]  # Only 2 characters for uniqueness
     # Combine sanitized title, unique ID, and file extension
-    return f"{sanitized}_{unique_id}{NOTE_EXT}"
+    return f"{sanitized}_{unique_id()}{NOTE_EXT}"
 
-# Define function to read note file and parse metadata and content
-def read_note_file(filepath: Path):
+# Define helper that reads a tags field as a list, whatever YAML made of it
+def tag_list(tags) -> list:
+    # Treat a missing field as no tags and a single string, number or date as one tag
+    if tags is None:
+        return []
+    if not isinstance(tags, (list, tuple)):
+        return [tags]
+    return list(tags)
+
+# Define function to build the lowercase text that substring search runs against
+def search_haystack(meta: dict, content: str) -> str:
+    # Combine title, tags, and content (all lowercase) separated by spaces
+    return ' '.join([
+        str(meta.get('title', '')).lower(),
+        ' '.join(str(tag).lower() for tag in tag_list(meta.get('tags'))),
+        content.lower()
+    ])
+
+# Define helper that reads the raw YAML header lines from an open note file
+def _read_header_lines(f) -> list:
+    # Check if file is empty or doesn't start with YAML header marker
+    if f.readline().strip() != "---":
+        # Raise error for missing YAML header
+        raise ValueError("Missing YAML header")
+    # Collect header lines until the closing marker, leaving the body unread
+    header_lines = []
+    # Read the header one line at a time
+    while True:
+        line = f.readline()
+        # Handle case where closing marker is not found
+        if not line:
+            # Raise error for malformed YAML header
+            raise ValueError("Malformed YAML header (missing closing ---)")
+        # Stop at the closing YAML header marker
+        if line == "---\n":
+            break
+        # Keep the header line
+        header_lines.append(line)
+    # Return the header lines, leaving the stream at the start of the body
+    return header_lines
+
+# Define helper that parses the YAML header from an open note file
+def _parse_header(f):
+    # Read the header lines and parse them into a metadata dictionary
+    return parse_header_text(''.join(_read_header_lines(f)))
+
+# Define function that parses header text already split off a note
+def parse_header_text(header: str):
+    # Load the parser on first use
+    yaml, loader, _ = _load_yaml()
+    # Time the YAML parse on its own when profiling
+    if notes_profile.enabled:
+        with notes_profile.phase('yaml'):
+            metadata = yaml.load(header, Loader=loader)
+    else:
+        metadata = yaml.load(header, Loader=loader)
+    # Refuse headers that are empty, a list or a scalar, so every reader reports the note as corrupted
+    if not isinstance(metadata, dict):
+        raise ValueError("YAML header is not a mapping of fields")
+    return metadata
+
+# Define function to parse a whole note from an open text stream
+def parse_note_stream(f):
+    """Return ``(meta, content)`` parsed from a text stream; raise on malformed notes."""
+    # Parse the metadata from the YAML header
+    metadata = _parse_header(f)
+    # Return it with the content after the closing YAML marker
+    return metadata, f.read()
+
+# Define helper that formats a read error the same way for every reader
+def _format_read_error(filepath: Path, e: Exception) -> str:
+    # More specific YAML error reporting; only possible once yaml has been loaded
+    if _yaml is not None and isinstance(e, _yaml[0].YAMLError):
+        return f"YAML parsing error in {filepath.name}: {e}"
+    # Error message with filename and exception details
+    return f"Error reading note {filepath.name}: {e}"
+
+# Define function to read a note without printing, for use in worker pools
+def load_note(filepath: Path, header_only=False):
+    """Return ``(meta, content, error)`` for a note file without printing anything.
+
+    ``content`` is None when ``header_only`` is set; ``error`` is the message
+    ``read_note_file`` would print, or None when the note was read cleanly.
+    """
+    # Take the start time when profiling
+    profiling = notes_profile.enabled
+    if profiling:
+        start = time.perf_counter()
     # Try to read and parse the file
     try:
         # Open file in read mode with UTF-8 encoding
         with open(filepath, 'r', encoding='utf-8') as f:
-            # Read all lines from the file
-            lines = f.readlines()
-        # Check if file is empty or doesn't start with YAML header marker
-        if not lines or lines[0].strip() != "---":
-            # Raise error for missing YAML header
-            raise ValueError("Missing YAML header")
-        # Try to find the closing YAML header marker
-        try:
-            # Find index of closing "---" line in remaining lines
-            yaml_end = lines[1:].index("---\n") + 1
-        # Handle case where closing marker is not found
-        except ValueError:
-            # Raise error for malformed YAML header
-            raise ValueError("Malformed YAML header (missing closing ---)")
-        # Extract YAML content between the markers
-        yaml_str = ''.join(lines[1:yaml_end])
-        # Parse YAML string into metadata dictionary
-        metadata = yaml.safe_load(yaml_str)
-        # Extract content after the closing YAML marker
-        content = ''.join(lines[yaml_end + 1:])
+            # Parse the metadata from the YAML header
+            metadata = _parse_header(f)
+            # Read the content after the closing YAML marker unless only the header is wanted
+            content = None if header_only else f.read()
+            # Count the bytes pulled from disk when profiling
+            if profiling:
+                notes_profile.count('bytes_read', f.buffer.tell())
         # Return parsed metadata and content
-        return metadata, content
+        return metadata, content, None
     # Handle any exceptions during file reading or parsing
-    except yaml.YAMLError as e:
-        # More specific YAML error reporting
-        print(f"YAML parsing error in {filepath.name}: {e}")
-        return None, None
     except Exception as e:
-        # Print error message with filename and exception details
-        print(f"Error reading note {filepath.name}: {e}")
-        # Return None values to indicate failure
-        return None, None
+        # Count the corrupted file when profiling
+        if profiling:
+            notes_profile.count('corrupted')
+        # Return None values and the error message to indicate failure
+        return None, None, _format_read_error(filepath, e)
+    # Record the time spent reading and parsing, including YAML
+    finally:
+        if profiling:
+            notes_profile.add_time('load', time.perf_counter() - start)
+            notes_profile.count('files_read')
+
+# Define function to read note file and parse metadata and content
+def read_note_file(filepath: Path):
+    # Read the note, collecting any error message
+    metadata, content, error = load_note(filepath)
+    # Print the error message if reading failed
+    if error:
+        print(error)
+    # Return parsed metadata and content (None values on failure)
+    return metadata, content
+
+# Define function to read only the body of a note file without printing
+def load_note_body(filepath: Path):
+    """Return ``(content, error)`` for a note without parsing its header."""
+    # Skip over the header lines and read the rest
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            _read_header_lines(f)
+            return f.read(), None
+    # Handle any exceptions during file reading
+    except Exception as e:
+        # Return None and the error message to indicate failure
+        return None, _format_read_error(filepath, e)
+
+# Define function to read only the body of a note file
+def read_note_body(filepath: Path):
+    """Return the body of a note without parsing its header, or None on error."""
+    # Read the body, collecting any error message
+    content, error = load_note_body(filepath)
+    # Print the error message if reading failed
+    if error:
+        print(error)
+    # Return the body (None on failure)
+    return content
+
+# Define function to read only the YAML header of a note file
+def read_note_header(filepath: Path):
+    """Return the metadata of a note without reading its body, or None on error."""
+    # Read only the header, collecting any error message
+    metadata, _, error = load_note(filepath, header_only=True)
+    # Print the error message if reading failed
+    if error:
+        print(error)
+    # Return the parsed metadata (None on failure)
+    return metadata
+
+# Define helper that opens note bytes as a text stream
+def _text_stream(data):
+    # Decode like a file opened in text mode, translating line endings the same way
+    import io
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+
+# Define function to parse a note held in memory (e.g. a packfile record) without printing
+def load_note_bytes(name: str, data: bytes, header_only=False):
+    """Return ``(meta, content, error)`` for the raw note ``data``, as :func:`load_note` would for a file named ``name``."""
+    # Parse the header, then the body unless only the header is wanted
+    try:
+        f = _text_stream(data)
+        metadata = _parse_header(f)
+        return metadata, None if header_only else f.read(), None
+    # Return None values and the error message to indicate failure
+    except Exception as e:
+        return None, None, _format_read_error(Path(name), e)
+
+# Define function to read only the body of a note held in memory without printing
+def load_note_body_bytes(name: str, data: bytes):
+    """Return ``(content, error)`` for the raw note ``data`` without parsing its header."""
+    # Skip over the header lines and read the rest
+    try:
+        f = _text_stream(data)
+        _read_header_lines(f)
+        return f.read(), None
+    # Return None and the error message to indicate failure
+    except Exception as e:
+        return None, _format_read_error(Path(name), e)
 
 # Define function to write note file with metadata and content
 def write_note_file(filepath: Path, metadata: dict, content: str):
@@ -77,8 +287,185 @@ def write_note_file(filepath: Path, metadata: dict, content: str):
         # Write opening YAML header marker
         f.write("---\n")
         # Dump metadata dictionary as YAML without sorting keys
-        yaml.dump(metadata, f, sort_keys=False)
+        yaml, _, dumper = _load_yaml()
+        yaml.dump(metadata, f, Dumper=dumper, sort_keys=False)
         # Write closing YAML header marker
         f.write("---\n")
         # Write the note content after the YAML front matter
-        f.write(content)
\ No newline at end of file
+        f.write(content)
+
+# Define function that renders a note in the file format, for storage other than a note file
+def format_note(metadata: dict, content: str) -> str:
+    # Produce exactly what write_note_file writes: YAML header between markers, then the content
+    yaml, _, dumper = _load_yaml()
+    return "---\n" + yaml.dump(metadata, Dumper=dumper, sort_keys=False) + "---\n" + content
+
+# Define helper that creates a temporary file that can be renamed over a target
+def open_temp_file(target: Path):
+    """Create an empty hidden file next to ``target`` and return ``(fd, path)``.
+
+    Unlike ``tempfile.mkstemp`` (always 0600), the file gets the permissions
+    of ``target`` when it exists and the umask's default otherwise, so
+    renaming it into place does not change who may read the file.
+    """
+    # Pick a name nobody uses; its dot and suffix keep it from looking like a note
+    target = Path(target)
+    while True:
+        temp = target.with_name(f".{target.name}.{os.urandom(4).hex()}.tmp")
+        try:
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        except FileExistsError:
+            continue
+        break
+    # Copy the permissions of the file about to be replaced
+    try:
+        os.chmod(temp, stat.S_IMODE(os.stat(target).st_mode))
+    except FileNotFoundError:
+        pass
+    except BaseException:
+        os.close(fd)
+        os.unlink(temp)
+        raise
+    return fd, temp
+
+# Define function to write a note file so readers never see it half-written
+def write_note_atomic(filepath: Path, metadata: dict, content: str, exclusive=False):
+    """Write a note through a temporary file and rename it over ``filepath``.
+
+    Readers see either the old or the new note, never a half-written one.
+    With ``exclusive`` the note must be new: ``FileExistsError`` is raised
+    when ``filepath`` exists, even if another process created it a moment
+    ago.
+    """
+    # Create a temporary file next to the target; its name is not a note file
+    filepath = Path(filepath)
+    fd, temp = open_temp_file(filepath)
+    os.close(fd)
+    # Write and flush the note, then move it into place
+    try:
+        write_note_file(Path(temp), metadata, content)
+        with open(temp, 'rb+') as f:
+            os.fsync(f.fileno())
+        if exclusive:
+            _link_new(temp, filepath)
+        else:
+            os.replace(temp, filepath)
+    # Remove the temporary file when anything went wrong
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+# Define helper that moves a finished file to a name that must not exist yet
+def _link_new(temp, filepath: Path):
+    # A hard link fails instead of replacing a file that appeared meanwhile
+    try:
+        os.link(temp, filepath)
+    except FileExistsError:
+        raise
+    # Without hard links, reserve the name exclusively, then move the file over the reservation
+    except OSError:
+        os.close(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        os.replace(temp, filepath)
+        return
+    os.unlink(temp)
+
+# Define class that writes many notes atomically, flushing them all before any is renamed
+class NoteBatchWriter:
+    """Write a batch of notes through temporary files and rename them into place.
+
+    Each note is written with :func:`write_note_file` to a hidden temporary
+    file next to its final path. :meth:`commit` flushes every temporary
+    file, renames them over their targets and syncs each directory once, so readers only ever see complete notes. Used as a context
+    manager, the batch is committed on success and discarded on error.
+    """
+
+    # Initialize an empty batch for a notes directory
+    def __init__(self, notes_dir: Path):
+        # Remember the target directory
+        self.notes_dir = Path(notes_dir)
+        # Initialize list of (temporary path, final path) pairs
+        self._pending = []
+
+    # Start the batch when entering a with-block
+    def __enter__(self):
+        # Return the writer itself
+        return self
+
+    # Commit or discard the batch when leaving the with-block
+    def __exit__(self, exc_type, exc, tb):
+        # Commit when the block finished cleanly, otherwise throw the batch away
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    # Define method that writes one note to a temporary file
+    def add(self, filename: str, metadata: dict, content: str, final: Path = None) -> Path:
+        # Build the final path unless the caller chose one (e.g. in a shard directory)
+        final = Path(final) if final is not None else self.notes_dir / filename
+        # Put the temporary file next to it so the rename stays atomic; its name is not a note file
+        temp = final.with_name(f".{filename}.tmp")
+        # Write the note in the regular format
+        write_note_file(temp, metadata, content)
+        # Remember the pair for the commit
+        self._pending.append((temp, final))
+        # Return the temporary path; its size and mtime survive the rename
+        return temp
+
+    # Define method that writes one note given as raw bytes, e.g. copied from other storage
+    def add_bytes(self, filename: str, data: bytes, final: Path = None) -> Path:
+        # Build the final path and the temporary file next to it, as for add()
+        final = Path(final) if final is not None else self.notes_dir / filename
+        temp = final.with_name(f".{filename}.tmp")
+        # Write the bytes unchanged
+        temp.write_bytes(data)
+        # Remember the pair for the commit and return the temporary path
+        self._pending.append((temp, final))
+        return temp
+
+    # Define method that flushes and renames every note of the batch
+    def commit(self) -> list:
+        """Make the batch durable and visible; return the final paths."""
+        # Flush the temporary files one by one; os.sync() would flush every filesystem on the machine
+        for temp, _ in self._pending:
+            with open(temp, 'rb+') as f:
+                os.fsync(f.fileno())
+        # Atomically move each note into place
+        for temp, final in self._pending:
+            os.replace(temp, final)
+        # Make the renames themselves durable in every directory that changed
+        for directory in {final.parent for _, final in self._pending}:
+            _fsync_directory(directory)
+        # Return the final paths and start a new batch
+        committed = [final for _, final in self._pending]
+        self._pending = []
+        return committed
+
+    # Define method that discards an unfinished batch
+    def abort(self):
+        # Remove every temporary file that was written
+        for temp, _ in self._pending:
+            try:
+                temp.unlink()
+            except OSError:
+                pass
+        # Start a new batch
+        self._pending = []
+
+# Define helper that flushes a directory entry list to disk
+def _fsync_directory(directory: Path):
+    # Directories cannot be opened for syncing on every platform (e.g. Windows)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    # Sync and close the directory handle
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
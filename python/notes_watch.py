@@ -0,0 +1,262 @@
+# Import collections module for the change set record
+import collections
+# Import ctypes modules for calling the Linux inotify API without extra dependencies
+import ctypes
+import ctypes.util
+# Import os module for scanning directories and reading inotify events
+import os
+# Import struct module for decoding inotify event records
+import struct
+# Import sys module for detecting the platform
+import sys
+# Import Path class from pathlib for cross-platform path handling
+from pathlib import Path
+# Import the note file extension
+from notes_utils import NOTE_EXT
+# Import the stamp that decides whether a note changed
+from notes_backend import file_stamp
+# Import shard helpers of the directory layout
+from notes_layout import SHARD_DEPTH, is_shard_name
+
+# Define environment variable that picks the watcher: "auto", "inotify" or "poll"
+WATCH_ENV = "NOTES_WATCH"
+
+# Define the inotify event bits used here (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# Define the events that can change, add or remove a note
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# Define the layout of the fixed part of an inotify event record
+EVENT_HEADER = struct.Struct("iIII")
+
+# Define record for the differences between two snapshots
+Changes = collections.namedtuple('Changes', ['added', 'modified', 'deleted'])
+
+
+# Define function that records the stamp of every note file
+def snapshot(layout) -> dict:
+    """Return ``{filename: (mtime_ns, size, inode)}`` for every note ``layout`` can see."""
+    # Stat each entry found by the layout's os.scandir walk
+    stamps = {}
+    for entry in layout.scan():
+        try:
+            stamps[entry.name] = file_stamp(entry.stat())
+        # Skip entries that disappeared while scanning
+        except OSError:
+            continue
+    # Return the snapshot
+    return stamps
+
+
+# Define function that compares two snapshots
+def diff_snapshots(old: dict, new: dict) -> Changes:
+    # Sort each kind of change by filename for deterministic processing
+    return Changes(
+        added=sorted(new.keys() - old.keys()),
+        modified=sorted(name for name in new.keys() & old.keys() if new[name] != old[name]),
+        deleted=sorted(old.keys() - new.keys()),
+    )
+
+
+# Define class that finds changes by comparing directory snapshots
+class PollingWatcher:
+    """Report changed notes by diffing ``os.scandir`` snapshots.
+
+    Works everywhere, but every check stats every note, so it is only run
+    on an interval.
+    """
+
+    # Polling has no event source to wait on
+    realtime = False
+
+    # Initialize the watcher with a first snapshot
+    def __init__(self, layout):
+        # Remember the layout and what it looks like now
+        self.layout = layout
+        self._snapshot = snapshot(layout)
+
+    # Define method that returns the event source to wait on, if any
+    def fileno(self):
+        # There is nothing to select on
+        return None
+
+    # Define method that reports notes added, modified or deleted since the last check
+    def changes(self):
+        """Return the set of changed filenames, or None when a full rescan is needed."""
+        # Take a new snapshot and compare it with the previous one
+        current = snapshot(self.layout)
+        changes = diff_snapshots(self._snapshot, current)
+        self._snapshot = current
+        # Return every name that needs re-checking
+        return set(changes.added) | set(changes.modified) | set(changes.deleted)
+
+    # Define method that releases resources
+    def close(self):
+        # Drop the snapshot
+        self._snapshot = {}
+
+
+# Define helper that loads the C library functions for inotify
+def _inotify_libc():
+    # inotify only exists on Linux
+    if not sys.platform.startswith('linux'):
+        raise OSError("inotify is only available on Linux")
+    # Load libc and check that it exports the inotify calls
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("libc does not provide inotify")
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    return libc
+
+
+# Define class that finds changes through Linux inotify events
+class InotifyWatcher:
+    """Report changed notes from inotify events instead of rescanning.
+
+    The notes directory and every shard directory are watched; shard
+    directories created later are picked up as they appear. A check only
+    drains pending events, so it costs next to nothing when nothing changed.
+    When the kernel drops events (queue overflow) or the notes directory
+    itself goes away, :meth:`changes` returns None to ask for a full rescan.
+    """
+
+    # inotify delivers events as they happen
+    realtime = True
+
+    # Initialize the watcher and register the directories
+    def __init__(self, layout):
+        # Remember the layout and open an inotify instance
+        self.layout = layout
+        self._libc = _inotify_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Map watch descriptors to (directory, shard depth)
+        self._dirs = {}
+        # Watch the notes directory and every existing shard directory
+        try:
+            self._watch_tree(layout.notes_dir, 0)
+        except OSError:
+            self.close()
+            raise
+
+    # Define method that returns the event source to wait on
+    def fileno(self):
+        # Select on the inotify descriptor
+        return self._fd
+
+    # Define helper that watches one directory
+    def _watch(self, directory: Path, depth: int):
+        # Register the directory, failing on errors such as hitting max_user_watches
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+        self._dirs[wd] = (Path(directory), depth)
+
+    # Define helper that watches a directory and its shard subdirectories
+    def _watch_tree(self, directory: Path, depth: int) -> set:
+        """Watch ``directory`` and the shards below it; return the notes already inside."""
+        # Watch first, then list, so files created in between are not missed
+        self._watch(directory, depth)
+        found = set()
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return found
+        for entry in entries:
+            # Descend into shard directories
+            if depth < SHARD_DEPTH and is_shard_name(entry.name) and entry.is_dir():
+                found |= self._watch_tree(Path(entry.path), depth + 1)
+            # Collect note files
+            elif entry.name.endswith(NOTE_EXT):
+                found.add(entry.name)
+        return found
+
+    # Define method that reports notes touched since the last check
+    def changes(self):
+        """Return the set of changed filenames, or None when a full rescan is needed."""
+        # Collect note names from every pending event
+        names, rescan = set(), False
+        while True:
+            # Read whatever the kernel has queued, stopping when the queue is empty
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            # Decode each variable-length event record
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                start = offset + EVENT_HEADER.size
+                name = os.fsdecode(data[start:start + length].rstrip(b"\0"))
+                offset = start + length
+                # Lost events mean the picture is incomplete
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                directory, depth = self._dirs.get(wd, (None, None))
+                # Forget watches the kernel removed; losing the notes directory needs a rescan
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    rescan = rescan or depth == 0
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    rescan = rescan or depth == 0
+                    continue
+                # Follow shard directories as they come and go
+                if mask & IN_ISDIR:
+                    if directory is None or depth >= SHARD_DEPTH or not is_shard_name(name):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            names |= self._watch_tree(directory / name, depth + 1)
+                        except OSError:
+                            rescan = True
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        rescan = True
+                    continue
+                # Report note files; temporary files of batch writes are not notes
+                if name.endswith(NOTE_EXT):
+                    names.add(name)
+        # Ask for a full rescan when events were lost
+        return None if rescan else names
+
+    # Define method that releases the inotify descriptor
+    def close(self):
+        # Close the descriptor once
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._dirs = {}
+
+
+# Define function that picks the best watcher for this platform
+def make_watcher(layout):
+    """Return an :class:`InotifyWatcher` where possible, else a :class:`PollingWatcher`.
+
+    ``NOTES_WATCH=poll`` forces polling; ``NOTES_WATCH=inotify`` makes a
+    failure to set up inotify an error instead of a silent fallback.
+    """
+    # Read the requested kind
+    kind = os.environ.get(WATCH_ENV, "auto")
+    # Try inotify unless polling was requested
+    if kind != "poll":
+        try:
+            return InotifyWatcher(layout)
+        except OSError:
+            if kind == "inotify":
+                raise
+    # Fall back to snapshot diffs
+    return PollingWatcher(layout)
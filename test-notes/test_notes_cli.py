@@ -1,4 +1,16 @@
+import asyncio
+import gzip
+import http.client
+import io
+import json
+import os
+import pickle
+import threading
+import time
+import tracemalloc
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
 import shutil
 from pathlib import Path
@@ -8,6 +20,21 @@ from pathlib import Path
 # Import functions and modules from your split files
 import notes_utils
 import notes_commands
+import notes_index
+import notes_parallel
+import notes_bench
+import notes_bulk
+import notes_layout
+import notes_daemon
+import notes_watch
+import notes_profile
+import notes_match
+import notes_model
+import notes_store
+import notes_backend
+import notes_server
+import notes_loadtest
+import notes_cli
 
 class TestPersonalNotesCLI(unittest.TestCase):
 
@@ -125,5 +152,1024 @@ class TestPersonalNotesCLI(unittest.TestCase):
         self.assertNotIn("/", clean_name)
         self.assertTrue(len(clean_name) > 0)
 
+    def _write(self, title, tags=None, content=""):
+        # Helper that writes a note directly, bypassing the interactive prompts
+        meta = {
+            'title': title,
+            'created': notes_utils.iso_now(),
+            'modified': notes_utils.iso_now(),
+            'tags': tags or [],
+        }
+        filepath = notes_commands.NOTES_DIR / notes_utils.generate_note_filename(title)
+        notes_utils.write_note_file(filepath, meta, content)
+        return filepath
+
+    def test_metadata_cache_picks_up_external_edits(self):
+        filepath = self._write("Cached", ['old'])
+        self.assertEqual(notes_commands.list_notes()[0][1]['tags'], ['old'])
+        self.assertTrue((notes_commands.NOTES_DIR / notes_index.INDEX_FILENAME).exists())
+
+        # Simulate an edit made through EDITOR (bigger file, newer mtime)
+        meta, content = notes_utils.read_note_file(filepath)
+        meta['tags'] = ['new', 'tags']
+        notes_utils.write_note_file(filepath, meta, content)
+        self.assertEqual(notes_commands.list_notes()[0][1]['tags'], ['new', 'tags'])
+
+        filepath.unlink()
+        self.assertEqual(notes_commands.list_notes(), [])
+
+    def test_metadata_cache_rebuilds_when_deleted(self):
+        self._write("One", ['a'])
+        self._write("Two", ['b'])
+        first = notes_commands.list_notes()
+        (notes_commands.NOTES_DIR / notes_index.INDEX_FILENAME).unlink()
+        self.assertEqual(notes_commands.list_notes(), first)
+
+        # A garbage sidecar is replaced instead of breaking the command
+        (notes_commands.NOTES_DIR / notes_index.INDEX_FILENAME).write_bytes(b"not a database")
+        self.assertEqual(notes_commands.list_notes(), first)
+
+    def test_ranked_search_boosts_title_matches(self):
+        self._write("Grocery run", ['errands'], "Pick up milk and bread.")
+        self._write("Milk", ['dairy'], "All about it.")
+        self._write("Bakery", ['errands'], "Sourdough bread only.")
+
+        results = notes_commands.search_notes("milk", ranked=True)
+        self.assertEqual([meta['title'] for _, meta in results], ['Milk', 'Grocery run'])
+
+        # Multi-term queries only return notes containing every term
+        results = notes_commands.search_notes("bread milk", ranked=True)
+        self.assertEqual([meta['title'] for _, meta in results], ['Grocery run'])
+        self.assertEqual(notes_commands.search_notes("mil", ranked=True), [])
+
+    def test_search_index_follows_create_and_delete(self):
+        with mock.patch.object(notes_commands, 'EDITOR', 'true'), \
+                mock.patch('builtins.input', side_effect=["Indexed note", "alpha, beta"]):
+            notes_commands.create_note()
+        results = notes_commands.search_notes("alpha", ranked=True)
+        self.assertEqual(len(results), 1)
+
+        notes_commands.delete_note(results[0][0])
+        self.assertEqual(notes_commands.search_notes("alpha", ranked=True), [])
+
+        # The rebuild command starts from an empty sidecar
+        self._write("Fresh", [], "gamma")
+        notes_commands.reindex()
+        self.assertEqual(len(notes_commands.search_notes("gamma", ranked=True)), 1)
+
+    def test_search_tables_store_no_note_text(self):
+        filepath = self._write("Draft", [], "original wording")
+        self.assertEqual(len(notes_commands.search_notes("original", ranked=True)), 1)
+        with notes_index.NotesIndex(notes_commands.NOTES_DIR) as index:
+            self.assertEqual(index.conn.execute("SELECT content FROM fulltext").fetchall(), [(None,)])
+
+        # Postings of the previous version never match once the note changed
+        with mock.patch.object(notes_index, 'MIN_DEAD_DOCS', 2):
+            for number in range(4):
+                meta, content = notes_utils.read_note_file(filepath)
+                notes_utils.write_note_file(filepath, meta, f"revised wording {number}")
+                self.assertEqual(notes_commands.search_notes("original", ranked=True), [])
+                self.assertEqual(notes_commands.search_notes("original"), [])
+                self.assertEqual(len(notes_commands.search_notes(f"{number}", ranked=True)), 1)
+
+        # Dead postings are dropped once they outnumber the notes
+        with notes_index.NotesIndex(notes_commands.NOTES_DIR) as index:
+            self.assertLessEqual(index.conn.execute("SELECT COUNT(*) FROM fulltext_docsize").fetchone()[0], 3)
+
+    def test_trigram_prefilter_matches_full_scan(self):
+        self._write("Shopping list", ['errands'], "Buy milk, eggs, and bread.")
+        self._write("Recipes", ['Cooking'], "Whisk the eggs with MILK.")
+        self._write("Reading", ['books'], "Nothing relevant here.")
+        (notes_commands.NOTES_DIR / "Broken_00.note").write_text("no header", encoding='utf-8')
+
+        for query in ["milk", "k, e", "cooking", "ing", "eg", "xyz", "d."]:
+            with mock.patch.dict('os.environ', {'NOTES_TRIGRAM_INDEX': '0'}):
+                expected = notes_commands.search_notes(query)
+            self.assertEqual(notes_commands.search_notes(query), expected, query)
+
+        # Files that cannot contain the query are never opened
+        with mock.patch.object(notes_store, 'match_note_file',
+                               wraps=notes_store.match_note_file) as reader:
+            results = notes_commands.search_notes("whisk")
+        self.assertEqual([meta['title'] for _, meta in results], ['Recipes'])
+        self.assertEqual(reader.call_count, 1)
+
+        # Opting out skips the prefilter for that run only; the next run only indexes the new note
+        with mock.patch.dict('os.environ', {'NOTES_TRIGRAM_INDEX': '0'}):
+            later = self._write("Later", [], "whisk again")
+            self.assertEqual(len(notes_commands.search_notes("whisk")), 2)
+        with mock.patch.object(notes_backend.FileBackend, 'load_many', autospec=True,
+                               side_effect=notes_backend.FileBackend.load_many) as loader, \
+                mock.patch.object(notes_store, 'match_note_file',
+                                  wraps=notes_store.match_note_file) as reader:
+            results = notes_commands.search_notes("whisk")
+        self.assertEqual([meta['title'] for _, meta in results], ['Later', 'Recipes'])
+        self.assertEqual(reader.call_count, 2)
+        self.assertEqual([name for call in loader.call_args_list for name in call.args[1]
+                          if not call.kwargs.get('header_only')], [later.name])
+
+    def test_regex_search(self):
+        self._write("Shopping list", ['errands'], "Buy milk, eggs, and bread.")
+        self._write("Recipes", ['cooking'], "Whisk the eggs with milk.")
+
+        results = notes_commands.search_notes(r"BUY\s+MILK", regex=True)
+        self.assertEqual([meta['title'] for _, meta in results], ['Shopping list'])
+        results = notes_commands.search_notes(r"eggs,? (and|with)", regex=True)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(notes_commands.search_notes("(", regex=True), [])
+        self.assertEqual(notes_index.regex_literals(r"Buy\s+milk?|x"), [])
+        self.assertEqual(notes_index.regex_literals(r"Buy\s+milk?"), ['buy', 'mil'])
+        # A Python whose private regex parser differs just gets no prefilter
+        with mock.patch.object(notes_index.re, '_parser', None):
+            self.assertEqual(notes_index.regex_literals(r"Buy\s+milk?"), [])
+        with mock.patch.object(notes_index.re._parser, 'parse', return_value=[(None, None)]):
+            self.assertEqual(notes_index.regex_literals(r"Buy\s+milk?"), [])
+
+    def test_header_only_reads(self):
+        body = "To be, or not to be.\n" * 50000
+        filepath = self._write("Hamlet", ['plays'], body)
+
+        self.assertEqual(notes_utils.read_note_header(filepath)['title'], 'Hamlet')
+
+        broken = notes_commands.NOTES_DIR / "Broken_00.note"
+        broken.write_text("---\ntitle: never closed\n", encoding='utf-8')
+        self.assertIsNone(notes_utils.read_note_header(broken))
+
+    def test_parallel_scan_is_deterministic(self):
+        for i in range(20):
+            self._write(f"Note {i:02d}", ['even' if i % 2 == 0 else 'odd'], f"body {i}")
+        for name in ("Broken_a.note", "Broken_b.note"):
+            (notes_commands.NOTES_DIR / name).write_text("no header", encoding='utf-8')
+        with mock.patch.dict('os.environ', {'NOTES_TRIGRAM_INDEX': '0'}):
+            expected = notes_commands.search_notes("body")
+        (notes_commands.NOTES_DIR / notes_index.INDEX_FILENAME).unlink()
+
+        self.addCleanup(notes_parallel._settings.update, {'jobs': None, 'pool': None})
+        self.addCleanup(notes_parallel.shutdown)
+        for pool in notes_parallel.POOL_KINDS:
+            notes_parallel.configure(jobs=4, pool=pool)
+            with mock.patch('builtins.print') as printed, \
+                    mock.patch.dict('os.environ', {'NOTES_TRIGRAM_INDEX': '0'}), \
+                    mock.patch.object(notes_parallel, 'MIN_PARALLEL_ITEMS', 2), \
+                    mock.patch.object(notes_parallel, '_usable_cpus', return_value=4):
+                self.assertEqual(notes_commands.search_notes("body"), expected)
+            self.assertEqual(printed.call_args_list[-1], mock.call(
+                "Warning: Skipped 2 corrupted file(s): Broken_a.note, Broken_b.note"))
+            self.assertEqual(len(notes_commands.list_notes(filter_tag='even')), 10)
+
+    def test_worker_pool_is_shared_across_batches(self):
+        for i in range(12):
+            self._write(f"Note {i:02d}", ['all'], f"body {i}")
+        self.addCleanup(notes_parallel._settings.update, {'jobs': None, 'pool': None})
+        notes_parallel.configure(jobs=2, pool='thread')
+
+        # Every batch of one command runs on the same pool, which is stopped afterwards
+        with notes_parallel.worker_pool(), \
+                mock.patch.object(notes_index, 'SYNC_BATCH', 4), \
+                mock.patch.object(notes_parallel, 'MIN_PARALLEL_ITEMS', 2), \
+                mock.patch('concurrent.futures.ThreadPoolExecutor',
+                           wraps=ThreadPoolExecutor) as executor_class:
+            self.assertEqual(len(notes_commands.list_notes()), 12)
+            self.assertEqual(executor_class.call_count, 1)
+            self.assertIsNotNone(notes_parallel._pool['executor'])
+        self.assertIsNone(notes_parallel._pool['executor'])
+
+        # Small inputs never start a pool
+        self.assertEqual(notes_parallel.parallel_map(str, range(3)), ['0', '1', '2'])
+        self.assertIsNone(notes_parallel._pool['executor'])
+
+    def test_streaming_stops_early(self):
+        for i in range(10):
+            self._write(f"Note {i}", ['all'], f"match {i}")
+        names = [name for name, _ in notes_commands.list_notes()]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual([n for n, _ in notes_commands.list_notes(offset=3, limit=4)], names[3:7])
+        self.assertEqual(len(notes_commands.search_notes("match", offset=8, limit=5)), 2)
+        (notes_commands.NOTES_DIR / notes_index.INDEX_FILENAME).unlink()
+
+        # Only the batches needed for the first result get parsed
+        with mock.patch.object(notes_index, 'SYNC_BATCH', 2), \
+                mock.patch.object(notes_backend, 'load_note', wraps=notes_backend.load_note) as reader:
+            first = next(notes_commands.iter_notes())
+            self.assertEqual(first[0], names[0])
+            self.assertEqual(reader.call_count, 2)
+        with mock.patch.object(notes_store, 'SEARCH_BATCH', 3), \
+                mock.patch.dict('os.environ', {'NOTES_TRIGRAM_INDEX': '0'}), \
+                mock.patch.object(notes_store, 'match_note_file', wraps=notes_store.match_note_file) as reader:
+            self.assertEqual(len(notes_commands.search_notes("match", limit=1)), 1)
+            self.assertEqual(reader.call_count, 3)
+
+    def test_corpus_generator_is_reproducible(self):
+        names = notes_bench.CorpusGenerator(seed=7).write(notes_commands.NOTES_DIR, 25)
+        self.assertEqual(names, [notes_bench.CorpusGenerator(seed=7).make_note(i)[0] for i in range(25)])
+        notes = notes_commands.list_notes()
+        self.assertEqual(len(notes), 25)
+        self.assertTrue(all(meta['title'] and 'created' in meta for _, meta in notes))
+
+    def test_benchmark_report(self):
+        report = notes_bench.run_benchmarks(sizes=(10,), repeat=2, workdir=self.test_dir)
+        operations = report['sizes']['10']['operations']
+        self.assertEqual(set(operations), {'change_check', 'change_check_poll', 'change_check_daemon', 'list',
+                                           'list_tag', 'search_hit', 'search_miss', 'search_ranked', 'stats',
+                                           'read', 'create', 'edit'})
+        self.assertLessEqual(operations['list']['p50_s'], operations['list']['p99_s'])
+        self.assertEqual(notes_bench.compare_reports(report, report), [])
+
+    def test_boolean_tag_queries(self):
+        self._write("Both", ['work', 'urgent'])
+        self._write("Work only", ['work', 'work'])
+        self._write("Home", ['home'])
+        self._write("Untagged")
+
+        def titles(**kwargs):
+            return sorted(meta['title'] for _, meta in notes_commands.list_notes(**kwargs))
+
+        self.assertEqual(titles(filter_tag=['work', 'urgent']), ['Both'])
+        self.assertEqual(titles(any_tags=['urgent', 'home']), ['Both', 'Home'])
+        self.assertEqual(titles(filter_tag='work', exclude_tags=['urgent']), ['Work only'])
+        self.assertEqual(titles(exclude_tags=['work']), ['Home', 'Untagged'])
+        self.assertEqual(titles(filter_tag='work', limit=1), ['Both'])
+
+    def test_stats_uses_normalized_tag_counts(self):
+        first = self._write("First", ['test', 'test'])
+        self._write("Second", ['test', 'other'])
+        with mock.patch('builtins.print') as printed:
+            notes_commands.stats()
+        lines = [c.args[0] for c in printed.call_args_list]
+        self.assertEqual(lines, ["Total notes: 2", "Tags summary:", "  test: 2", "  other: 1"])
+
+        # Counts follow edits and deletions without a full recount
+        meta, content = notes_utils.read_note_file(first)
+        meta['tags'] = ['other']
+        notes_utils.write_note_file(first, meta, content + "edited")
+        with notes_index.NotesIndex(notes_commands.NOTES_DIR) as index:
+            index.refresh()
+            self.assertEqual(index.tag_counts(), {'other': 2, 'test': 1})
+        first.unlink()
+        with notes_index.NotesIndex(notes_commands.NOTES_DIR) as index:
+            index.refresh()
+            self.assertEqual(index.tag_counts(), {'other': 1, 'test': 1})
+
+        # Stats notices notes added and deleted behind its back, re-parsing only those
+        second = next(notes_commands.NOTES_DIR.glob("Second_*.note"))
+        self._write("Third", ['new'])
+        second.unlink()
+        store = notes_store.BlockingNotesStore(notes_commands.NOTES_DIR)
+        with mock.patch.object(notes_backend.FileBackend, 'load_many', autospec=True,
+                               side_effect=notes_backend.FileBackend.load_many) as loader:
+            self.assertEqual(store.stats(), {'count': 1, 'tags': {'new': 1}})
+            self.assertEqual(store.stats(), {'count': 1, 'tags': {'new': 1}})
+        parsed = [name for call in loader.call_args_list for name in call.args[1]]
+        self.assertEqual([name.split('_')[0] for name in parsed], ['Third'])
+
+    def test_odd_headers_are_counted_or_skipped(self):
+        directory = notes_commands.NOTES_DIR
+        (directory / "Scalar_00.note").write_text("---\ntitle: Scalar\ntags: 5\n---\nbody\n", encoding='utf-8')
+        (directory / "List_00.note").write_text("---\n- title\n- tags\n---\nbody\n", encoding='utf-8')
+        (directory / "Empty_00.note").write_text("---\n---\nbody\n", encoding='utf-8')
+        reports = []
+        store = notes_store.BlockingNotesStore(directory, report=reports.append)
+
+        self.assertEqual(store.stats(), {'count': 1, 'tags': {'5': 1}})
+        self.assertEqual([filename for filename, _ in store.list(['5'])], ["Scalar_00.note"])
+        self.assertEqual([filename for filename, _ in store.search("body")], ["Scalar_00.note"])
+        self.assertIn("Error reading note List_00.note: YAML header is not a mapping of fields", reports)
+        self.assertIn("Error reading note Empty_00.note: YAML header is not a mapping of fields", reports)
+        self.assertEqual(notes_index.normalize_tags(5), ['5'])
+
+    def test_import_front_matter_directory(self):
+        samples = Path(__file__).parent
+        imported, errors = notes_bulk.import_notes(samples, notes_commands.NOTES_DIR)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(imported), len(list(samples.glob("*.md"))))
+        self.assertEqual(list(notes_commands.NOTES_DIR.glob(".*.tmp")), [])
+
+        # The indexes were filled during the import itself
+        with mock.patch.object(notes_backend, 'load_note') as reader:
+            self.assertEqual(len(notes_commands.list_notes(filter_tag='planning')), 2)
+            results = notes_commands.search_notes("denmark", ranked=True)
+            reader.assert_not_called()
+        self.assertEqual([name for name, _ in results], ['shakespeare-hamlet.note'])
+
+    def test_export_and_reimport_round_trip(self):
+        self._write("First", ['a'], "one\n")
+        self._write("Second", ['b'], "two\n")
+        originals = {p.name: p.read_bytes() for p in notes_commands.NOTES_DIR.glob("*.note")}
+        export_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, export_dir)
+
+        for target in ("notes.jsonl", "notes.tar.gz"):
+            count, errors = notes_bulk.export_notes(notes_commands.NOTES_DIR, export_dir / target)
+            self.assertEqual((count, errors), (2, []))
+            restore_dir = export_dir / f"restore-{target}"
+            restore_dir.mkdir()
+            imported, errors = notes_bulk.import_notes(export_dir / target, restore_dir)
+            self.assertEqual(sorted(imported), sorted(originals))
+            restored = {p.name: p.read_bytes() for p in restore_dir.glob("*.note")}
+            self.assertEqual(restored, originals)
+
+        with self.assertRaises(ValueError):
+            notes_bulk.export_notes(notes_commands.NOTES_DIR, export_dir / "notes.zip")
+
+    def test_sharded_layout_migration(self):
+        first = self._write("First", ['a'], "alpha body\n")
+        self._write("Second", ['b'], "beta body\n")
+        self.assertEqual(len(notes_commands.list_notes()), 2)
+
+        notes_commands.migrate_notes_layout(notes_layout.SHARDED)
+        layout = notes_layout.NoteLayout(notes_commands.NOTES_DIR)
+        self.assertTrue(layout.sharded)
+        self.assertEqual(list(notes_commands.NOTES_DIR.glob("*.note")), [])
+        moved = layout.path(first.name)
+        self.assertEqual(moved.relative_to(notes_commands.NOTES_DIR).parent.as_posix(),
+                         notes_layout.shard_of(first.name))
+
+        # The cache stays valid and every command finds the moved notes
+        with mock.patch.object(notes_backend, 'load_note') as reader:
+            self.assertEqual(len(notes_commands.list_notes()), 2)
+            reader.assert_not_called()
+        self.assertEqual([m['title'] for _, m in notes_commands.search_notes("alpha")], ['First'])
+        with mock.patch('builtins.print') as printed:
+            notes_commands.read_note(first.name)
+        self.assertIn(mock.call("alpha body\n"), printed.call_args_list)
+
+        # A note left behind in the old location is still found during migration
+        stray = self._write("Stray", [], "gamma\n")
+        self.assertEqual(layout.path(stray.name), stray)
+        self.assertEqual(len(notes_commands.list_notes()), 3)
+        notes_commands.delete_note(first.name)
+        self.assertFalse(moved.exists())
+
+        # Migrating back leaves a flat directory without empty shards
+        self.assertEqual(notes_layout.migrate_layout(notes_commands.NOTES_DIR, notes_layout.FLAT), 1)
+        self.assertEqual(sorted(p.name for p in notes_commands.NOTES_DIR.iterdir() if p.is_dir()), [])
+        self.assertEqual(len(list(notes_commands.NOTES_DIR.glob("*.note"))), 2)
+
+    def test_daemon_serves_read_only_commands(self):
+        self._write("Served", ['daemon'], "resident body\n")
+        self.assertIsNone(notes_daemon.forward(["list"], notes_commands.NOTES_DIR))
+        daemon = notes_daemon.NotesDaemon(notes_commands.NOTES_DIR, interval=0.05)
+        daemon.start()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+
+        def forwarded(*argv):
+            with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+                status = notes_daemon.forward(argv, notes_commands.NOTES_DIR)
+            return status, out.getvalue()
+
+        try:
+            status, output = forwarded("list", "--tag", "daemon")
+            self.assertEqual(status, 0)
+            self.assertIn(": Served (tags: daemon)", output)
+            self.assertEqual(forwarded("search", "resident")[1], output.replace(" (tags: daemon)", ""))
+            # Interactive commands stay in the CLI process
+            self.assertIsNone(notes_daemon.forward(["create"], notes_commands.NOTES_DIR))
+
+            # Notes written behind the CLI's back show up after the next refresh
+            self._write("Outside", [], "later\n")
+            deadline = time.monotonic() + 5
+            while "Outside" not in forwarded("list")[1] and time.monotonic() < deadline:
+                time.sleep(0.02)
+            self.assertIn("Outside", forwarded("list")[1])
+        finally:
+            self.assertTrue(notes_daemon.stop(notes_commands.NOTES_DIR))
+            thread.join()
+            daemon.close()
+        self.assertFalse(notes_daemon.socket_path(notes_commands.NOTES_DIR).exists())
+        self.assertFalse(notes_index.NotesIndex.assume_fresh)
+
+    def test_read_body_skips_yaml(self):
+        filepath = self._write("Body only", ['x'], "just the body\n")
+        with mock.patch.object(notes_utils, '_load_yaml') as loader, \
+                mock.patch('builtins.print') as printed:
+            notes_commands.read_note(filepath.name, body_only=True)
+        loader.assert_not_called()
+        printed.assert_called_once_with("just the body\n")
+
+    def test_startup_avoids_heavy_imports(self):
+        # The tight budget is checked by `notes_bench.py --startup`; shared test machines only get a generous one
+        results = notes_bench.measure_startup(repeat=3)
+        for command, result in results.items():
+            for module in notes_bench.STARTUP_FORBIDDEN_MODULES:
+                self.assertNotIn(module, result['modules'], command)
+            self.assertLess(result['import_ms'], 4 * notes_bench.STARTUP_BUDGET_MS, command)
+        self.assertNotIn('notes_daemon', results['--help']['modules'])
+
+        # The choices the CLI spells out for a quick start stay those of the modules they come from
+        self.assertEqual(notes_cli.SORT_CHOICES, notes_model.SORT_FIELDS)
+        self.assertEqual(notes_cli.LAYOUT_CHOICES, notes_layout.LAYOUTS)
+        self.assertEqual(notes_cli.BACKEND_CHOICES, notes_backend.BACKENDS)
+        self.assertEqual(notes_cli.FORWARDED_COMMANDS, notes_daemon.FORWARDED_COMMANDS)
+
+    def test_sync_notices_replaced_file_with_same_stamp(self):
+        filepath = self._write("Before", [], "same size\n")
+        self.assertEqual(notes_commands.list_notes()[0][1]['title'], "Before")
+        st = filepath.stat()
+        replacement = filepath.with_name("replacement.tmp")
+        replacement.write_bytes(filepath.read_bytes().replace(b"Before", b"Beforx"))
+        os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(replacement.stat().st_size, st.st_size)
+        os.replace(replacement, filepath)
+        self.assertEqual(notes_commands.list_notes()[0][1]['title'], "Beforx")
+
+    def test_watchers_report_only_changed_notes(self):
+        kept = self._write("Kept", [], "kept\n")
+        edited = self._write("Edited", [], "old\n")
+        removed = self._write("Removed", [], "gone\n")
+        kinds = [notes_watch.PollingWatcher]
+        try:
+            notes_watch.InotifyWatcher(notes_layout.NoteLayout(notes_commands.NOTES_DIR)).close()
+            kinds.append(notes_watch.InotifyWatcher)
+        except OSError:
+            pass
+        for kind in kinds:
+            with notes_index.NotesIndex(notes_commands.NOTES_DIR) as index:
+                index.refresh()
+                watcher = kind(index.layout)
+                self.assertEqual(watcher.changes(), set())
+                meta, _ = notes_utils.read_note_file(edited)
+                notes_utils.write_note_file(edited, dict(meta, title="Edited again"), "new text\n")
+                removed.unlink()
+                added = self._write("Added", [], "new\n")
+                changed = watcher.changes()
+                watcher.close()
+                self.assertEqual(changed, {edited.name, removed.name, added.name}, kind.__name__)
+
+                with mock.patch.object(notes_backend, 'load_note', wraps=notes_backend.load_note) as reader:
+                    self.assertEqual(index.apply_changes(changed), 2)
+                self.assertEqual(reader.call_count, 2)
+                titles = sorted(m['title'] for _, m in index.sync())
+                self.assertEqual(titles, ["Added", "Edited again", "Kept"])
+            # Reset the directory for the next watcher kind
+            added.unlink()
+            removed = self._write("Removed", [], "gone\n")
+        self.assertTrue(kept.exists())
+        self.assertEqual(notes_watch.diff_snapshots({'a': 1, 'b': 2, 'c': 3}, {'b': 2, 'c': 4, 'd': 5}),
+                         notes_watch.Changes(added=['d'], modified=['c'], deleted=['a']))
+
+    def test_profile_reports_phases_and_counters(self):
+        self._write("Profiled", [], "needle\n")
+        (notes_commands.NOTES_DIR / "Broken_00.note").write_text("no header")
+        with mock.patch.object(notes_profile, 'add_time') as add_time, \
+                mock.patch('builtins.print'):
+            notes_commands.search_notes("needle")
+        add_time.assert_not_called()
+
+        stream = io.StringIO()
+        notes_profile.start()
+        try:
+            with mock.patch('builtins.print'):
+                notes_commands.search_notes("needle")
+        finally:
+            result = notes_profile.stop(stream=stream)
+        self.assertFalse(notes_profile.enabled)
+        self.assertEqual(json.loads(stream.getvalue()), result)
+        self.assertIn('load', result['phases'])
+        self.assertIn('yaml', result['phases'])
+        self.assertEqual(result['counters']['corrupted'], 1)
+        self.assertEqual(result['counters']['files_scanned'], 2)
+        self.assertGreater(result['counters']['bytes_read'], 0)
+
+    def test_byte_search_matches_decoded_haystack(self):
+        files = [
+            self._write("École d'été", ['Voyage'], "Rendez-vous à l'ÉCOLE.\n"),
+            self._write("Kelvin", ['units'], "300 \u212a is warm; \u0130stanbul.\n"),
+            self._write("Plain", ['misc'], "Line one\r\nline TWO ends here\n"),
+            self._write("Greek", [], "ΟΔΟΣ " * 40 + "\n"),
+            self._write("Long title that wraps " * 6, ['x'], "body\n"),
+        ]
+        (notes_commands.NOTES_DIR / "Broken_00.note").write_text("no header", encoding='utf-8')
+        queries = ["école", "ÉCOLE", "k is", "300 k", "istanbul", "i̇stanbul", "d'été", "voyage école",
+                   "line two", "e one", "misc line", "οδος", "οδοσ ", "wraps long", "title", "", "nothing"]
+        # Decode chunks of a few bytes so matches straddle chunk borders
+        with mock.patch.object(notes_match, 'DECODE_CHUNK', 7), \
+                mock.patch.object(notes_match, 'SEARCH_CHUNK', 5):
+            for query in queries:
+                for path in files:
+                    meta, content = notes_utils.read_note_file(path)
+                    expected = query.lower() in notes_utils.search_haystack(meta, content)
+                    got_meta, matched, error = notes_match.match_note_file(path, query)
+                    self.assertIsNone(error)
+                    self.assertEqual(matched, expected, (query, path.name))
+                    self.assertEqual(got_meta, meta)
+        _, matched, error = notes_match.match_note_file(notes_commands.NOTES_DIR / "Broken_00.note", "x")
+        self.assertFalse(matched)
+        self.assertEqual(error, "Error reading note Broken_00.note: Missing YAML header")
+        self.assertEqual([m['title'] for _, m in notes_commands.search_notes("ÉCOLE")], ["École d'été"])
+
+    def test_byte_search_survives_notes_truncated_meanwhile(self):
+        path = self._write("Shrinking", [], "straw\n" * 50 + "needle\n")
+        contains = notes_match._bytes_contains
+
+        # Another process empties the note once its header has been read
+        def truncate_then_search(chunks, needle):
+            path.write_bytes(b"")
+            return contains(chunks, needle)
+        with mock.patch.object(notes_match, '_bytes_contains', side_effect=truncate_then_search), \
+                mock.patch.object(notes_match, 'SEARCH_CHUNK', 64):
+            meta, matched, error = notes_match.match_note_file(path, "needle")
+        self.assertEqual((matched, error), (False, None))
+
+    def test_byte_search_reports_broken_headers_of_misses(self):
+        self._write("Fine", ['ok'], "body\n")
+        (notes_commands.NOTES_DIR / "Broken_a.note").write_text("---\ntitle: [unclosed\n---\nbody\n",
+                                                                encoding='utf-8')
+        (notes_commands.NOTES_DIR / "Broken_b.note").write_text("---\n- a list\n---\nbody\n", encoding='utf-8')
+
+        # Queries that match nothing still parse every header, with or without the trigram prefilter
+        for query, env in (("zz", {}), ("nothing here", {'NOTES_TRIGRAM_INDEX': '0'})):
+            with mock.patch('builtins.print') as printed, mock.patch.dict('os.environ', env):
+                self.assertEqual(notes_commands.search_notes(query), [])
+            self.assertEqual(printed.call_args_list[-1], mock.call(
+                "Warning: Skipped 2 corrupted file(s): Broken_a.note, Broken_b.note"), query)
+        _, matched, error = notes_match.match_note_file(notes_commands.NOTES_DIR / "Broken_b.note", "zz")
+        self.assertEqual((matched, error),
+                         (False, "Error reading note Broken_b.note: YAML header is not a mapping of fields"))
+
+    def test_index_stores_metadata_as_plain_json(self):
+        path = notes_commands.NOTES_DIR / "Typed_00.note"
+        path.write_text("---\ntitle: Typed\ncreated: 2024-01-02 03:04:05+00:00\ndue: 2024-02-03\n"
+                        "blob: !!binary aGk=\nlabels: !!set {a: null}\n2024-03-04: dated key\n"
+                        "extra: {$date: not a date}\ntags: [x]\n---\nbody\n", encoding='utf-8')
+        parsed = notes_utils.read_note_header(path)
+        self.assertEqual(len(notes_commands.list_notes()), 1)
+
+        # Cached metadata comes back with the types it was parsed with
+        with notes_index.NotesIndex(self.test_dir) as index:
+            (stored,), = index.conn.execute("SELECT meta FROM notes").fetchall()
+            cached = dict(index.iter_sync())[path.name]
+        self.assertIsInstance(stored, str)
+        self.assertEqual(json.loads(stored)['title'], 'Typed')
+        self.assertEqual(cached, dict(parsed, **{'2024-03-04': parsed.pop(notes_model.datetime.date(2024, 3, 4))}))
+        self.assertIsInstance(cached['created'], notes_model.datetime.datetime)
+        self.assertEqual((cached['blob'], cached['labels'], cached['extra']), (b'hi', {'a'}, {'$date': 'not a date'}))
+
+        # A sidecar holding a pickle payload is treated as a corrupted cache entry, never unpickled
+        with notes_index.NotesIndex(self.test_dir) as index:
+            index.conn.execute("UPDATE notes SET meta = ?", (pickle.dumps({'title': 'Evil'}),))
+            index.conn.commit()
+            with self.assertRaises(ValueError):
+                index.resolve('Typed')
+
+    def test_note_records_are_compact_and_round_trip(self):
+        created = notes_utils.iso_now()
+        header = {'note_id': 'Trip_ab', 'filename': 'Trip_ab.note', 'path': '/old/Trip_ab.note',
+                  'created': created, 'modified': '2024-02-30 not a date', 'tags': ['travel', 'work'],
+                  'title': 'Trip', 'content': '', 'editor': 'nano', 'priority': 3, 'links': ['a', 'b']}
+        path = self._write("Unused")
+        notes_utils.write_note_file(path, header, "body\n")
+        self._write("Other", ['travel'])
+
+        records = dict(notes_commands.list_notes())
+        record = records[path.name]
+        self.assertIsInstance(record, notes_model.NoteMeta)
+        self.assertEqual(record.filename, path.name)
+        self.assertEqual(record.created.tzinfo, notes_model.datetime.timezone.utc)
+        self.assertEqual(record['created'], created)
+        self.assertEqual(record['modified'], '2024-02-30 not a date')
+        self.assertEqual(record.to_dict(), {'title': 'Trip', 'tags': ['travel', 'work'], 'created': created,
+                                            'modified': '2024-02-30 not a date', 'priority': 3, 'links': ['a', 'b']})
+        self.assertNotIn('path', record)
+        self.assertIs(record.tags[0], records[next(n for n in records if n != path.name)].tags[0])
+        self.assertEqual(notes_commands.search_notes("trip"), [(path.name, record)])
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+
+        # Records take a fraction of the memory of the dictionaries they replace
+        metas = [dict(header, title=f"Trip {i}", tags=['travel', 'work']) for i in range(2000)]
+        blobs = [pickle.dumps(meta) for meta in metas]
+        tracemalloc.start()
+        try:
+            dicts = [pickle.loads(blob) for blob in blobs]
+            dict_bytes = tracemalloc.get_traced_memory()[0]
+            del dicts
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            kept = [notes_model.NoteMeta.from_meta(f"Trip_{i}.note", pickle.loads(blob))
+                    for i, blob in enumerate(blobs)]
+            record_bytes = tracemalloc.get_traced_memory()[0] - base
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(kept), 2000)
+        self.assertLess(record_bytes, dict_bytes / 2)
+
+    def test_async_store_serializes_writers_but_not_readers(self):
+        async def scenario():
+            store = notes_store.NotesStore(notes_commands.NOTES_DIR)
+            filename, meta = await store.create("Async", ['a'], "body\n")
+            self.assertEqual(meta.title, "Async")
+            # Concurrent updates of one note are applied one after another, so none is lost
+            await asyncio.gather(*(store.update(filename, fields={f'k{i}': i}) for i in range(20)))
+            meta, content = await store.read(filename)
+            self.assertEqual(sorted(meta.extra), sorted(f'k{i}' for i in range(20)))
+            self.assertEqual(content, "body\n")
+            # A writer waiting for the note's lock does not hold up readers
+            with notes_store.note_lock(store.notes_dir, filename):
+                pending = asyncio.ensure_future(store.update(filename, title="Renamed"))
+                meta, _ = await store.read(filename)
+                self.assertEqual(meta.title, "Async")
+                self.assertFalse(pending.done())
+            self.assertEqual((await pending).title, "Renamed")
+            self.assertEqual([n for n, _ in await store.search("renamed")], [filename])
+            self.assertEqual(await store.stats(), {'count': 1, 'tags': {'a': 1}})
+            await store.delete(filename)
+            self.assertEqual(await store.list(), [])
+            with self.assertRaises(notes_store.NoteNotFound):
+                await store.read(filename)
+        asyncio.run(scenario())
+        self.assertEqual(notes_store._note_locks, {})
+
+    def test_rest_server_pages_revalidates_and_compresses(self):
+        paths = [self._write(f"Note {i:02d}", ['all'] + (['odd'] if i % 2 else []), f"text {i}\n" * 100)
+                 for i in range(7)]
+        server = notes_server.NotesHTTPServer(("127.0.0.1", 0), notes_commands.NOTES_DIR, quiet=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+
+        def get(path, headers=None):
+            conn.request("GET", path, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+            if response.getheader('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            return response, json.loads(data) if data else None
+
+        try:
+            # Walk the list three notes at a time
+            names, cursor = [], ""
+            while True:
+                _, page = get(f"/notes?limit=3&cursor={cursor}")
+                names += [item['filename'] for item in page['items']]
+                if page['next'] is None:
+                    break
+                cursor = page['next']
+            self.assertEqual(names, sorted(p.name for p in paths))
+            _, page = get("/notes?tag=odd&limit=2")
+            self.assertEqual([item['title'] for item in page['items']], ["Note 01", "Note 03"])
+            _, page = get(f"/search?q=text+5&cursor={page['next']}")
+            self.assertEqual([item['title'] for item in page['items']], ["Note 05"])
+            _, page = get("/search?q=text&ranked=1&limit=5")
+            self.assertEqual(len(page['items']), 5)
+            self.assertEqual(len(get(f"/search?q=text&ranked=1&cursor={page['next']}")[1]['items']), 2)
+            self.assertEqual(get("/stats")[1], {'count': 7, 'tags': {'all': 7, 'odd': 3}})
+
+            # Later pages seek past the cursor instead of reading the notes before it again
+            cursor = notes_server.encode_cursor({'after': paths[4].name})
+            with mock.patch.object(notes_store, 'match_note_file',
+                                   wraps=notes_store.match_note_file) as reader:
+                _, page = get(f"/search?q=te&cursor={cursor}")
+            self.assertEqual([item['title'] for item in page['items']], ["Note 05", "Note 06"])
+            self.assertEqual(reader.call_count, 2)
+            _, page = get(f"/notes?tag=all&cursor={cursor}")
+            self.assertEqual([item['title'] for item in page['items']], ["Note 05", "Note 06"])
+            bad = notes_server.encode_cursor({'after': 5})
+            self.assertEqual(get(f"/notes?cursor={bad}")[0].status, 400)
+
+            # Notes carry an ETag; revalidating answers 304 without reading the file
+            response, note = get(f"/notes/{paths[0].name}", {'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+            self.assertEqual(note['content'], "text 0\n" * 100)
+            etag = response.getheader('ETag')
+            with mock.patch.object(notes_store.BlockingNotesStore, 'read') as read:
+                response, body = get(f"/notes/{paths[0].name}", {'If-None-Match': etag})
+            self.assertEqual((response.status, body), (304, None))
+            read.assert_not_called()
+            notes_utils.write_note_file(paths[0], {'title': "Changed", 'tags': []}, "new\n")
+            response, note = get(f"/notes/{paths[0].name}", {'If-None-Match': etag})
+            self.assertEqual((response.status, note['title']), (200, "Changed"))
+
+            self.assertEqual(get("/notes/missing.note")[0].status, 404)
+            self.assertEqual(get("/notes?cursor=!!")[0].status, 400)
+            self.assertEqual(get("/search?q=(&regex=1")[0].status, 400)
+
+            report = notes_loadtest.run_load_test(
+                f"http://127.0.0.1:{server.server_address[1]}", ["/stats", f"/notes/{paths[1].name}"],
+                clients=2, duration=0.2, conditional=True)
+            self.assertEqual(report['errors'], 0)
+            self.assertGreater(report['requests'], 0)
+            self.assertIn('304', report['statuses'])
+        finally:
+            conn.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def _exercise_store(self, notes_dir):
+        # The same checks run against every backend
+        store = notes_store.BlockingNotesStore(notes_dir, report=lambda message: None)
+        first, _ = store.create("Alpha note", ['work', 'x'], "alpha body\n")
+        second, _ = store.create("Beta note", ['home'], "beta body mentions alpha\n")
+        self.assertEqual(store.read(first)[1], "alpha body\n")
+        self.assertEqual(store.read_body(second[:-len(notes_utils.NOTE_EXT)]), "beta body mentions alpha\n")
+        self.assertEqual([name for name, _ in store.list(filter_tag='work')], [first])
+        self.assertEqual([name for name, _ in store.search("alpha")], sorted([first, second]))
+        self.assertEqual([name for name, _ in store.search("BETA.*ALPHA", regex=True)], [second])
+        self.assertEqual(store.search("alpha", ranked=True)[0][0], first)
+        # Updates change the stamp and are seen by list and search
+        stamp = store.stamp(first)
+        store.update(first, tags=['done'], content="rewritten\n")
+        self.assertNotEqual(store.stamp(first), stamp)
+        self.assertEqual(store.list(filter_tag='work'), [])
+        self.assertEqual(store.search("rewritten")[0][1].tags, ('done',))
+        # An editor gets a real .note file and its changes are stored
+        with store.editing(second) as filepath:
+            self.assertEqual(filepath.name, second)
+            meta, content = notes_utils.read_note_file(filepath)
+            notes_utils.write_note_file(filepath, {**meta, 'title': "Edited"}, content + "more\n")
+        meta, content = store.read(second)
+        self.assertEqual((meta['title'], content), ("Edited", "beta body mentions alpha\nmore\n"))
+        self.assertEqual(store.stats(), {'count': 2, 'tags': {'done': 1, 'home': 1}})
+        # Exports are plain note files whatever the backend
+        export = Path(self.test_dir) / f"export-{notes_backend.backend_name(notes_dir)}"
+        self.assertEqual(notes_bulk.export_notes(notes_dir, export), (2, []))
+        self.assertEqual(sorted(p.name for p in export.iterdir()), sorted([first, second]))
+        self.assertEqual(notes_utils.read_note_file(export / second), (store.read(second)[0].to_dict(), content))
+        # Deleted notes are gone everywhere
+        store.delete(first)
+        with self.assertRaises(notes_store.NoteNotFound):
+            store.read(first)
+        with self.assertRaises(notes_store.NoteNotFound):
+            store.delete(first)
+        self.assertEqual([name for name, _ in store.list()], [second])
+        self.assertEqual(store.search("rewritten"), [])
+        # Imports go through the same backend
+        imported, errors = notes_bulk.import_notes(export, notes_dir)
+        self.assertEqual((len(imported), errors), (2, []))
+        self.assertEqual(len(store.list()), 3)
+
+    def test_storage_backends_pass_the_same_tests(self):
+        for backend in notes_backend.BACKENDS:
+            with self.subTest(backend=backend):
+                notes_dir = Path(self.test_dir) / backend
+                notes_backend.set_backend(notes_dir, backend)
+                self._exercise_store(notes_dir)
+                # Only the pack backend keeps notes in a single file
+                self.assertEqual((notes_dir / notes_backend.PACK_FILENAME).exists(), backend == notes_backend.PACK)
+                self.assertEqual(bool(list(notes_dir.glob('*.note'))), backend == notes_backend.FILES)
+
+        # A backend missing part of the interface cannot be created
+        class Partial(notes_backend.NoteBackend):
+            def scan(self):
+                return []
+        with self.assertRaises(TypeError):
+            Partial(self.test_dir)
+
+    def test_packfile_recovers_torn_writes_and_compacts_in_background(self):
+        notes_dir = Path(self.test_dir)
+        notes_backend.set_backend(notes_dir, notes_backend.PACK)
+        pack = notes_backend.PackBackend(notes_dir)
+        with pack.batch() as batch:
+            for i in range(300):
+                batch.add(f"n{i:03d}.note", {'title': f"Note {i}"}, f"body {i}\n")
+        # The offset index is saved, so another process only scans what was appended since
+        self.assertTrue(pack.index_path.exists())
+        pack.write("late.note", {'title': "Late"}, "late\n")
+        other = notes_backend.PackBackend(notes_dir)
+        self.assertEqual(other.load("late.note"), ({'title': "Late"}, "late\n", None))
+        self.assertEqual(len(other.scan()), 301)
+
+        # A record cut short by a crash is ignored, then cut off by the next writer
+        size = pack.pack_path.stat().st_size
+        with open(pack.pack_path, 'ab') as f:
+            f.write(notes_backend.RECORD.pack(0, notes_backend.PUT, 999, 100, 4) + b"torn")
+        self.assertEqual(len(notes_backend.PackBackend(notes_dir).scan()), 301)
+        other.write("after.note", {'title': "After"}, "after\n")
+        self.assertEqual(pack.load("after.note")[1], "after\n")
+        self.assertEqual(pack.pack_path.stat().st_size, pack._end)
+        self.assertGreater(pack._end, size)
+
+        # Deleting most notes leaves garbage that a background thread compacts away
+        stamp = pack.stamp("n000.note")
+        with mock.patch.object(notes_backend, 'COMPACT_MIN_BYTES', 1024):
+            for i in range(1, 300):
+                pack.delete(f"n{i:03d}.note")
+            pack.wait_for_compaction()
+        self.assertLess(pack.pack_path.stat().st_size, size / 10)
+        # Readers elsewhere follow the swap, and stamps survive it
+        self.assertEqual(sorted(entry.name for entry in other.scan()), ["after.note", "late.note", "n000.note"])
+        self.assertEqual(other.stamp("n000.note"), stamp)
+        self.assertEqual(other.read_raw("n000.note"), b"---\ntitle: Note 0\n---\nbody 0\n")
+
+    def test_backend_migration_keeps_notes_byte_for_byte(self):
+        paths = [self._write(f"Note {i}", ['t'], f"body {i}\n") for i in range(3)]
+        originals = {p.name: p.read_bytes() for p in paths}
+        self.assertEqual(notes_commands.list_notes()[0][0], min(originals))
+        with mock.patch('builtins.print') as printed:
+            notes_commands.migrate_notes_backend('pack')
+            notes_commands.compact_notes()
+        printed.assert_any_call("Moved 3 note(s) to the pack backend.")
+        self.assertEqual(list(Path(self.test_dir).glob('*.note')), [])
+        pack = notes_backend.open_backend(self.test_dir)
+        self.assertEqual({name: pack.read_raw(name) for name in originals}, originals)
+        self.assertEqual(len(notes_commands.search_notes("body")), 3)
+        # And back again
+        self.assertEqual(notes_backend.migrate_backend(self.test_dir, notes_backend.FILES), 3)
+        self.assertEqual({p.name: p.read_bytes() for p in Path(self.test_dir).glob('*.note')}, originals)
+        self.assertFalse((Path(self.test_dir) / notes_backend.PACK_FILENAME).exists())
+        self.assertFalse((Path(self.test_dir) / notes_backend.PACK_LOCK_FILENAME).exists())
+
+    def test_list_sorts_by_date_or_title_from_the_index(self):
+        # Write notes whose timestamps and titles disagree with their filename order
+        dates = {"beta": ("2024-03-01T10:00:00Z", "2024-05-01T00:00:00Z"),
+                 "Alpha": ("2024-01-01T10:00:00Z", "2024-06-01T00:00:00.5+02:00"),
+                 "gamma": ("2023-12-31T23:59:59Z", "2024-02-01T00:00:00Z")}
+        for title, (created, modified) in dates.items():
+            notes_utils.write_note_file(Path(self.test_dir) / f"{title.lower()}.note",
+                                        {'title': title, 'created': created, 'modified': modified, 'tags': ['t']}, "x")
+        notes_utils.write_note_file(Path(self.test_dir) / "undated.note", {'title': "undated"}, "x")
+        names = lambda notes: [filename[:-5] for filename, _ in notes]
+        self.assertEqual(names(notes_commands.list_notes(sort='created')), ['undated', 'gamma', 'alpha', 'beta'])
+        self.assertEqual(names(notes_commands.list_notes(sort='modified', descending=True, limit=2)), ['alpha', 'beta'])
+        self.assertEqual(names(notes_commands.list_notes(sort='title', offset=1)), ['beta', 'gamma', 'undated'])
+        self.assertEqual(names(notes_commands.list_notes(sort='created', filter_tag='t', descending=True)),
+                         ['beta', 'alpha', 'gamma'])
+        self.assertEqual(names(notes_commands.list_notes(descending=True)), ['undated', 'gamma', 'beta', 'alpha'])
+        # Edits move notes in the order
+        notes_store.BlockingNotesStore(self.test_dir).update("gamma", content="y")
+        self.assertEqual(names(notes_commands.list_notes(sort='modified', descending=True, limit=1)), ['gamma'])
+        # SQLite walks the sort index instead of sorting the whole table
+        with notes_index.NotesIndex(self.test_dir) as index:
+            plan = index.conn.execute(
+                "EXPLAIN QUERY PLAN SELECT filename, meta FROM notes "
+                "ORDER BY modified_key DESC, filename DESC LIMIT 20").fetchall()
+            self.assertIn("notes_by_modified", str(plan))
+            self.assertNotIn("TEMP B-TREE", str(plan))
+            stored = index.conn.execute("SELECT created_key FROM notes WHERE filename = 'beta.note'").fetchone()
+        self.assertEqual(stored[0], notes_model.timestamp_key("2024-03-01T10:00:00Z"))
+        # Search results have no index to sort by and are ordered on a heap instead
+        self.assertEqual(names(notes_commands.search_notes("x", sort='created', descending=True, limit=2)),
+                         ['beta', 'alpha'])
+        self.assertEqual(names(notes_commands.search_notes("x", sort='title', offset=1)), ['beta', 'undated'])
+        # The CLI and the REST API take the same options
+        parser = notes_cli.build_parser()
+        with mock.patch('builtins.print') as printed:
+            notes_cli.run_command(parser.parse_args(['list', '--sort', 'created', '--desc', '--limit', '1']), parser)
+        printed.assert_called_once_with("beta.note: beta (tags: t)")
+        server = notes_server.NotesHTTPServer(("127.0.0.1", 0), self.test_dir, quiet=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        try:
+            pages, path = [], "/notes?sort=title&limit=3"
+            while path:
+                conn.request("GET", path)
+                body = json.loads(conn.getresponse().read())
+                pages.append([item['id'] for item in body['items']])
+                path = body['next'] and f"/notes?sort=title&limit=3&cursor={body['next']}"
+            self.assertEqual(pages, [['alpha', 'beta', 'gamma'], ['undated']])
+            conn.request("GET", "/notes?sort=size")
+            self.assertEqual(conn.getresponse().status, 400)
+        finally:
+            conn.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_notes_resolve_by_title_or_unique_id_prefix(self):
+        store = notes_store.BlockingNotesStore(self.test_dir)
+        shopping, _ = store.create("Shopping list", [], "milk\n")
+        shouting, _ = store.create("shopping LIST", [], "loud\n")
+        meeting, _ = store.create("Meeting", [], "agenda\n")
+        store.create("Meeting notes", [], "minutes\n")
+        # Exact titles win, then unique ID prefixes, then titles in any case
+        self.assertEqual(store.read("Shopping list")[1], "milk\n")
+        self.assertEqual(store.read("Meeting_n")[1], "minutes\n")
+        self.assertEqual(store.read("MEETING")[1], "agenda\n")
+        self.assertEqual(store.read(shouting[:len("shopping_LIST_") + 3])[1], "loud\n")
+        with self.assertRaises(notes_store.AmbiguousNote) as caught:
+            store.read("SHOPPING LIST")
+        self.assertEqual(caught.exception.candidates, sorted([shopping, shouting]))
+        with self.assertRaises(notes_store.AmbiguousNote):
+            store.read("Meet")
+        # Full filenames are only ever filenames
+        with self.assertRaises(notes_store.NoteNotFound):
+            store.read("Meeting.note")
+        # Notes added behind the cache's back are found once the caller refreshes, deleted ones are not
+        self._write("Written elsewhere", [], "outside\n")
+        with mock.patch.object(notes_index.NotesIndex, 'refresh') as refresh, \
+                self.assertRaises(notes_store.NoteNotFound):
+            store.read("written elsewhere")
+        refresh.assert_not_called()
+        store.refresh()
+        self.assertEqual(store.read("written elsewhere")[1], "outside\n")
+        (Path(self.test_dir) / meeting).unlink()
+        self.assertEqual(store.read("Meeting")[1], "minutes\n")
+        # The commands resolve names the same way
+        with mock.patch('builtins.print') as printed:
+            notes_commands.read_note("Shopping list", body_only=True)
+            notes_commands.delete_note("shopping LIST")
+            notes_commands.read_note("nothing like it")
+        self.assertEqual([str(c.args[0]) for c in printed.call_args_list],
+                         ["milk\n", f"Note '{shouting}' deleted.", "Note 'nothing like it' not found."])
+        # Lookups use the title and filename indexes instead of scanning the table
+        with notes_index.NotesIndex(self.test_dir) as index:
+            for query in ("SELECT filename, meta FROM notes WHERE title_key = ? LIMIT 10",
+                          "SELECT filename FROM notes WHERE filename >= ? AND filename < ? LIMIT 10"):
+                plan = str(index.conn.execute(f"EXPLAIN QUERY PLAN {query}", ("a",) * query.count("?")).fetchall())
+                self.assertIn("USING", plan)
+                self.assertNotIn("SCAN notes", plan)
+
+    def test_note_ids_are_unique_without_looking_at_the_directory(self):
+        # Even when the clock stands still, every thread gets a different, later ID
+        with mock.patch.object(notes_utils.time, 'time_ns', return_value=1_700_000_000 * 10**9):
+            ids = []
+            threads = [threading.Thread(target=lambda: ids.extend(notes_utils.unique_id() for _ in range(200)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(set(ids)), 800)
+            # Another process with the same clock gets IDs of its own
+            with mock.patch.object(notes_utils, '_last_id_time', 0), \
+                    mock.patch.object(notes_utils.os, 'getpid', return_value=os.getpid() + 1):
+                self.assertNotIn(notes_utils.unique_id(), ids)
+        # IDs sort by creation time and titles keep their readable prefix
+        first, second = notes_utils.generate_note_filename("Same"), notes_utils.generate_note_filename("Same")
+        self.assertLess(first, second)
+        self.assertRegex(first, r"^Same_[0-9a-hjkmnp-tv-z]{15}\.note$")
+
+    def test_title_lookup_notices_notes_retitled_elsewhere(self):
+        store = notes_store.BlockingNotesStore(self.test_dir)
+        meeting, _ = store.create("Meeting", [], "agenda\n")
+        groceries, _ = store.create("Groceries", [], "milk\n")
+        self.assertEqual(store.read("Meeting")[0].filename, meeting)
+        # Swap the titles behind the cache's back
+        for filename, title in ((meeting, "Archive"), (groceries, "Meeting")):
+            meta, content = notes_utils.read_note_file(Path(self.test_dir) / filename)
+            notes_utils.write_note_file(Path(self.test_dir) / filename, dict(meta, title=title), content + "edited\n")
+        # The cached match is stale, so the note now titled "Meeting" is the one deleted
+        self.assertEqual(store.delete("Meeting"), groceries)
+        self.assertTrue((Path(self.test_dir) / meeting).exists())
+        self.assertEqual(store.read("Archive")[1], "agenda\nedited\n")
+
+    def test_writes_keep_file_permissions(self):
+        store = notes_store.BlockingNotesStore(self.test_dir)
+        old_umask = os.umask(0o022)
+        try:
+            filename, _ = store.create("Modes", [], "text\n")
+        finally:
+            os.umask(old_umask)
+        filepath = Path(self.test_dir) / filename
+        # New notes get the umask's permissions, replaced notes keep theirs
+        self.assertEqual(filepath.stat().st_mode & 0o777, 0o644)
+        filepath.chmod(0o640)
+        store.update(filename, content="changed\n")
+        self.assertEqual(filepath.stat().st_mode & 0o777, 0o640)
+
+    def test_create_never_replaces_a_note_made_concurrently(self):
+        for backend in notes_backend.BACKENDS:
+            with self.subTest(backend=backend):
+                notes_dir = Path(self.test_dir) / backend
+                notes_backend.set_backend(notes_dir, backend)
+                store = notes_store.BlockingNotesStore(notes_dir)
+                taken, _ = store.create("Taken", [], "first\n")
+                # Another process creates the name between any check and the write
+                storage = notes_backend.open_backend(notes_dir)
+                with mock.patch.object(type(storage), 'exists', return_value=False):
+                    with self.assertRaises(FileExistsError):
+                        storage.create(taken, {'title': "Second"}, "second\n")
+                # The store moves on to a fresh name instead
+                with mock.patch.object(notes_store, 'generate_note_filename', side_effect=[taken, "fresh.note"]):
+                    self.assertEqual(store.create("Taken", [], "second\n")[0], "fresh.note")
+                self.assertEqual(store.read(taken)[1], "first\n")
+
+    def test_daemon_and_client_time_out_on_stalled_peers(self):
+        import socket
+        path = notes_daemon.socket_path(notes_commands.NOTES_DIR)
+        # A daemon that accepts but never replies makes the client run the command itself
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stuck:
+            stuck.bind(str(path))
+            stuck.listen()
+            with mock.patch.object(notes_daemon, 'REPLY_TIMEOUT', 0.1):
+                self.assertIsNone(notes_daemon.forward(["list"], notes_commands.NOTES_DIR))
+        path.unlink()
+
+        # A client that never sends its request is dropped, and later clients are answered
+        daemon = notes_daemon.NotesDaemon(notes_commands.NOTES_DIR, interval=0.05)
+        daemon.start()
+        thread = threading.Thread(target=daemon.serve_forever)
+        with mock.patch.object(notes_daemon, 'CLIENT_TIMEOUT', 0.1), \
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            thread.start()
+            try:
+                silent.connect(str(path))
+                self.assertEqual(notes_daemon._request(notes_commands.NOTES_DIR, {'command': 'ping'}),
+                                 {'status': 0})
+            finally:
+                self.assertTrue(notes_daemon.stop(notes_commands.NOTES_DIR))
+                thread.join()
+                daemon.close()
+
+    def test_daemon_requests_do_not_leak_worker_settings(self):
+        self._write("Note", [], "text\n")
+        daemon = notes_daemon.NotesDaemon(notes_commands.NOTES_DIR)
+        before = dict(notes_parallel._settings)
+        reply = daemon._dispatch({'argv': ['--jobs', '8', '--pool', 'process', 'list']})
+        self.assertEqual(reply['status'], 0)
+        self.assertIn("Note", reply['stdout'])
+        self.assertEqual(notes_parallel._settings, before)
+
 if __name__ == '__main__':
     unittest.main()